@@ -0,0 +1,149 @@
+#!/usr/bin/env python
+
+# Copyright (c) 2013-2021 Erik Hetzner
+#
+# This file is part of ledger-autosync
+#
+# ledger-autosync is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# ledger-autosync is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with ledger-autosync. If not, see
+# <http://www.gnu.org/licenses/>.
+
+"""Compare memory and lookup latency of a Python set of ids, Bloom
+filters at several false positive rates, and the on-disk id index with
+and without a Bloom filter.
+
+    $ python benchmarks/bloom.py [--ids N] [--journal-size M]
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+sys.path.insert(0, HERE)
+
+import generate  # noqa: E402
+
+from ledgerautosync.bloom import BloomFilter  # noqa: E402
+from ledgerautosync.index import IdIndex  # noqa: E402
+
+
+def ids(n, prefix="ofxid"):
+    return [
+        "%s=%s.%s.%08d" % (prefix, generate.FID, generate.ACCTID, i) for i in range(n)
+    ]
+
+
+def allocated(fn):
+    """Return (result, bytes allocated by fn and still alive)."""
+    tracemalloc.start()
+    result = fn()
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return (result, current)
+
+
+def per_lookup_us(contains, keys):
+    start = time.perf_counter()
+    for key in keys:
+        contains(key)
+    return (time.perf_counter() - start) / len(keys) * 1e6
+
+
+def report(name, memory, hit_us, miss_us, fp=None):
+    print(
+        "%-28s %10.1f MB %10.2f us %10.2f us %10s"
+        % (
+            name,
+            memory / 1e6,
+            hit_us,
+            miss_us,
+            "" if fp is None else "%.4f" % (fp),
+        )
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--ids", type=int, default=1000000)
+    parser.add_argument("--journal-size", type=int, default=100000)
+    parser.add_argument("--lookups", type=int, default=20000)
+    parser.add_argument("--fp-rate", type=float, action="append", help="(repeatable)")
+    args = parser.parse_args()
+    fp_rates = args.fp_rate or [0.1, 0.01, 0.001]
+
+    present = ids(args.ids)
+    step = max(1, args.ids // args.lookups)
+    hits = present[::step]
+    misses = ids(len(hits), "csvid")
+    print("%-28s %13s %13s %13s %10s" % ("", "memory", "hit", "miss", "fp rate"))
+
+    # Count the strings too, as a process loading the ids would
+    id_set, memory = allocated(lambda: set(ids(args.ids)))
+    report(
+        "set",
+        memory,
+        per_lookup_us(id_set.__contains__, hits),
+        per_lookup_us(id_set.__contains__, misses),
+    )
+    del id_set
+
+    for fp_rate in fp_rates:
+
+        def build():
+            bloom = BloomFilter.for_capacity(len(present), fp_rate)
+            for s in present:
+                bloom.add(s)
+            return bloom
+
+        bloom, _ = allocated(build)
+        fp = sum(s in bloom for s in misses) / len(misses)
+        report(
+            "bloom %g" % (fp_rate),
+            bloom.nbytes(),
+            per_lookup_us(bloom.__contains__, hits),
+            per_lookup_us(bloom.__contains__, misses),
+            fp,
+        )
+
+    with tempfile.TemporaryDirectory() as directory:
+        journal = os.path.join(directory, "journal.lgr")
+        with open(journal, "w") as f:
+            generate.journal(f, args.journal_size)
+        hits = [
+            "%s.%08d" % (generate.ACCTID, i)
+            for i in range(0, args.journal_size, max(1, args.journal_size // 2000))
+        ]
+        misses = ["%s.X%08d" % (generate.ACCTID, i) for i in range(len(hits))]
+        for fp_rate in [None] + fp_rates[1:2]:
+            idx = IdIndex(journal, os.path.join(directory, "index"), fp_rate=fp_rate)
+            idx.update()
+
+            def check(value):
+                return idx.check_transaction_by_id("ofxid", value)
+
+            report(
+                "index%s" % ("" if fp_rate is None else " + bloom %g" % (fp_rate)),
+                0 if idx.bloom is None else idx.bloom.nbytes(),
+                per_lookup_us(check, hits),
+                per_lookup_us(check, misses),
+            )
+            idx.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,431 @@
+#!/usr/bin/env python
+
+# Copyright (c) 2013-2021 Erik Hetzner
+#
+# This file is part of ledger-autosync
+#
+# ledger-autosync is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# ledger-autosync is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with ledger-autosync. If not, see
+# <http://www.gnu.org/licenses/>.
+
+"""Deterministic generators for benchmark journals, statements and CSVs.
+
+Everything is derived from a seed, so the same arguments always produce
+byte-identical output. Bank transactions are numbered: transaction i of
+account ACCTID has FITID "%08d" % i and is dated i // TXNS_PER_DAY days
+after START, so a journal of n transactions and a statement starting at transaction
+k < n overlap in exactly n - k transactions.
+
+    $ python benchmarks/generate.py DIR [--journal-size N] [--statement-size M]
+"""
+
+import argparse
+import datetime
+import functools
+import os
+import random
+
+FID = "1101"
+ACCTID = "0123456789"
+BROKER_ACCTID = "9876543210"
+ACCOUNT = "Assets:Checking"
+START = datetime.date(2000, 1, 1)
+# Roughly 20 transactions a day: 1M transactions is ~137 years, 1k is 50
+# days.
+TXNS_PER_DAY = 20
+
+EXPENSES = [
+    "Expenses:Groceries",
+    "Expenses:Rent",
+    "Expenses:Utilities",
+    "Expenses:Dining",
+    "Expenses:Travel",
+    "Expenses:Books",
+    "Income:Salary",
+    "Income:Interest",
+]
+WORDS = [
+    "ACME",
+    "GROCERY",
+    "STORE",
+    "MARKET",
+    "ELECTRIC",
+    "WATER",
+    "CAFE",
+    "BOOKS",
+    "AIRLINES",
+    "HOTEL",
+    "PAYROLL",
+    "INTEREST",
+    "PHARMACY",
+    "GAS",
+    "STATION",
+]
+CUSIPS = ["458140100", "G7945E105", "431571108", "19421R200", "98417P105"]
+TICKERS = ["INTC", "SDRL", "HI", "CLCT", "XIN"]
+
+
+@functools.lru_cache(maxsize=None)
+def payees(seed, count=200):
+    rng = random.Random(seed)
+    return [
+        "%s %s #%d" % (rng.choice(WORDS), rng.choice(WORDS), rng.randint(1, 9999))
+        for _ in range(count)
+    ]
+
+
+def txn_date(i, start=START):
+    return start + datetime.timedelta(days=i // TXNS_PER_DAY)
+
+
+def txn_index(date, start=START):
+    """Return the first transaction index dated on or after date."""
+    return max(0, (date - start).days * TXNS_PER_DAY)
+
+
+def bank_txn(i, seed, start=START):
+    """Return (date, payee, amount, account) for bank transaction i."""
+    rng = random.Random("%s.%d" % (seed, i))
+    payee = rng.choice(payees(seed))
+    account = EXPENSES[hash_index(payee, len(EXPENSES))]
+    amount = rng.randint(1, 100000) / 100
+    if not account.startswith("Income"):
+        amount = -amount
+    return (txn_date(i, start), payee, amount, account)
+
+
+def hash_index(s, n):
+    # Stable across interpreters, unlike hash()
+    return sum(s.encode()) % n
+
+
+def fmt_amount(amount):
+    if amount < 0:
+        return "-$%.2f" % (-amount)
+    return "$%.2f" % (amount)
+
+
+def journal(f, size, seed=0):
+    """Write a ledger journal of `size` transactions to the file f.
+
+    Transactions carry an ofxid for ACCTID; every 10th one also has an
+    AutosyncPayee tag, and every 7th one a paypal csvid."""
+    for i in range(size):
+        (date, payee, amount, account) = bank_txn(i, seed)
+        f.write("%s %s\n" % (date.strftime("%Y/%m/%d"), payee))
+        if i % 10 == 0:
+            f.write("    ; AutosyncPayee: %s LONG\n" % (payee))
+        f.write("    %-48s%16s\n" % (ACCOUNT, fmt_amount(amount)))
+        f.write("    ; ofxid: %s.%s.%08d\n" % (FID, ACCTID, i))
+        if i % 7 == 0:
+            f.write("    ; csvid: paypal.PP%08d\n" % (i))
+        f.write("    %-48s%16s\n\n" % (account, fmt_amount(-amount)))
+
+
+OFX_HEADER = """OFXHEADER:100
+DATA:OFXSGML
+VERSION:102
+SECURITY:NONE
+ENCODING:USASCII
+CHARSET:1252
+COMPRESSION:NONE
+OLDFILEUID:NONE
+NEWFILEUID:NONE
+
+"""
+
+
+def ofx_date(date):
+    return date.strftime("%Y%m%d120000.000")
+
+
+def signon():
+    return (
+        "<SIGNONMSGSRSV1><SONRS><STATUS><CODE>0<SEVERITY>INFO</STATUS>"
+        "<DTSERVER>20200101120000.000<LANGUAGE>ENG"
+        "<FI><ORG>BENCH<FID>%s</FI></SONRS></SIGNONMSGSRSV1>" % (FID)
+    )
+
+
+def bank_stmtrs(first, last, seed=0, acctid=ACCTID, start=START):
+    """Return an <STMTRS> aggregate for bank transactions [first, last)."""
+    start_date = ofx_date(txn_date(first, start))
+    end_date = ofx_date(txn_date(max(first, last - 1), start))
+    parts = [
+        "<STMTRS><CURDEF>USD<BANKACCTFROM><BANKID>%s<ACCTID>%s"
+        "<ACCTTYPE>CHECKING</BANKACCTFROM><BANKTRANLIST>"
+        "<DTSTART>%s<DTEND>%s" % (FID, acctid, start_date, end_date)
+    ]
+    balance = 0
+    for i in range(first, last):
+        (date, payee, amount, _) = bank_txn(i, seed, start)
+        balance += amount
+        parts.append(
+            "<STMTTRN><TRNTYPE>%s<DTPOSTED>%s<TRNAMT>%.2f<FITID>%08d"
+            "<NAME>%s<MEMO>%s LONG</STMTTRN>"
+            % (
+                "CREDIT" if amount > 0 else "DEBIT",
+                ofx_date(date),
+                amount,
+                i,
+                payee,
+                payee,
+            )
+        )
+    parts.append(
+        "</BANKTRANLIST><LEDGERBAL><BALAMT>%.2f<DTASOF>%s</LEDGERBAL></STMTRS>"
+        % (balance, end_date)
+    )
+    return "".join(parts)
+
+
+def bank_statement(f, first, last, seed=0):
+    """Write an OFX bank statement of transactions [first, last)."""
+    f.write(OFX_HEADER)
+    f.write("<OFX>%s<BANKMSGSRSV1><STMTTRNRS><TRNUID>0" % (signon()))
+    f.write("<STATUS><CODE>0<SEVERITY>INFO</STATUS>")
+    f.write(bank_stmtrs(first, last, seed))
+    f.write("</STMTTRNRS></BANKMSGSRSV1></OFX>\n")
+
+
+def invstmtrs(first, last, seed=0, acctid=BROKER_ACCTID, start=START):
+    """Return an <INVSTMTRS> aggregate with buys, sells and dividends for
+    transactions [first, last)."""
+    end_date = ofx_date(txn_date(last, start))
+    parts = [
+        "<INVSTMTRS><DTASOF>%s<CURDEF>USD" % (end_date),
+        "<INVACCTFROM><BROKERID>bench<ACCTID>%s</INVACCTFROM>" % (acctid),
+        "<INVTRANLIST><DTSTART>%s<DTEND>%s"
+        % (ofx_date(txn_date(first, start)), end_date),
+    ]
+    for i in range(first, last):
+        rng = random.Random("%s.inv.%d" % (seed, i))
+        cusip = rng.choice(CUSIPS)
+        date = ofx_date(txn_date(i, start))
+        units = rng.randint(1, 10000) / 100
+        price = rng.randint(100, 50000) / 100
+        invtran = "<INVTRAN><FITID>INV%08d<DTTRADE>%s</INVTRAN>" % (i, date)
+        secid = "<SECID><UNIQUEID>%s<UNIQUEIDTYPE>CUSIP</SECID>" % (cusip)
+        kind = i % 3
+        if kind == 0:
+            parts.append(
+                "<BUYSTOCK><INVBUY>%s%s<UNITS>%.2f<UNITPRICE>%.2f<COMMISSION>0"
+                "<FEES>0<TOTAL>%.2f<SUBACCTSEC>CASH<SUBACCTFUND>CASH</INVBUY>"
+                "<BUYTYPE>BUY</BUYSTOCK>"
+                % (invtran, secid, units, price, -units * price)
+            )
+        elif kind == 1:
+            parts.append(
+                "<SELLSTOCK><INVSELL>%s%s<UNITS>%.2f<UNITPRICE>%.2f<COMMISSION>0"
+                "<FEES>0<TOTAL>%.2f<SUBACCTSEC>CASH<SUBACCTFUND>CASH</INVSELL>"
+                "<SELLTYPE>SELL</SELLSTOCK>"
+                % (invtran, secid, -units, price, units * price)
+            )
+        else:
+            parts.append(
+                "<INCOME>%s%s<INCOMETYPE>DIV<TOTAL>%.2f<SUBACCTSEC>CASH"
+                "<SUBACCTFUND>CASH</INCOME>" % (invtran, secid, units)
+            )
+    parts.append("</INVTRANLIST><INVPOSLIST>")
+    for cusip in CUSIPS:
+        parts.append(
+            "<POSSTOCK><INVPOS><SECID><UNIQUEID>%s<UNIQUEIDTYPE>CUSIP</SECID>"
+            "<HELDINACCT>CASH<POSTYPE>LONG<UNITS>100<UNITPRICE>10.00"
+            "<MKTVAL>1000.00<DTPRICEASOF>%s</INVPOS></POSSTOCK>" % (cusip, end_date)
+        )
+    parts.append("</INVPOSLIST></INVSTMTRS>")
+    return "".join(parts)
+
+
+def seclist():
+    parts = ["<SECLISTMSGSRSV1><SECLIST>"]
+    for cusip, ticker in zip(CUSIPS, TICKERS):
+        parts.append(
+            "<STOCKINFO><SECINFO><SECID><UNIQUEID>%s<UNIQUEIDTYPE>CUSIP</SECID>"
+            "<SECNAME>%s INC<TICKER>%s</SECINFO></STOCKINFO>" % (cusip, ticker, ticker)
+        )
+    parts.append("</SECLIST></SECLISTMSGSRSV1>")
+    return "".join(parts)
+
+
+def investment_statement(f, first, last, seed=0):
+    """Write an OFX investment statement of transactions [first, last)."""
+    f.write(OFX_HEADER)
+    f.write("<OFX>%s<INVSTMTMSGSRSV1><INVSTMTTRNRS><TRNUID>0" % (signon()))
+    f.write("<STATUS><CODE>0<SEVERITY>INFO</STATUS>")
+    f.write(invstmtrs(first, last, seed))
+    f.write("</INVSTMTTRNRS></INVSTMTMSGSRSV1>%s</OFX>\n" % (seclist()))
+
+
+def mint_csv(f, first, last, seed=0):
+    f.write(
+        '"Date","Description","Original Description","Amount",'
+        '"Transaction Type","Category","Account Name","Labels","Notes"\n'
+    )
+    for i in range(first, last):
+        (date, payee, amount, account) = bank_txn(i, seed)
+        f.write(
+            '"%s","%s","%s","%.2f","%s","%s","1234","",""\n'
+            % (
+                date.strftime("%m/%d/%Y"),
+                payee,
+                payee,
+                abs(amount),
+                "credit" if amount > 0 else "debit",
+                account.split(":")[-1],
+            )
+        )
+
+
+PAYPAL_FIELDS = [
+    "Date",
+    "Time",
+    "Time Zone",
+    "Name",
+    "Type",
+    "Status",
+    "Currency",
+    "Gross",
+    "Fee",
+    "Net",
+    "From Email Address",
+    "To Email Address",
+    "Transaction ID",
+    "Item Title",
+    "Balance",
+]
+
+
+def paypal_csv(f, first, last, seed=0):
+    f.write(", ".join(PAYPAL_FIELDS) + "\n")
+    for i in range(first, last):
+        (date, payee, amount, _) = bank_txn(i, seed)
+        f.write(
+            '"%s","12:00:00","PDT","%s","Payment Sent","Completed","USD",'
+            '"%.2f","0.00","%.2f","me@example.com","shop%d@example.net",'
+            '"PP%08d","Item %d","0.00"\n'
+            % (date.strftime("%m/%d/%Y"), payee, amount, amount, i % 50, i, i)
+        )
+
+
+def amazon_csv(f, first, last, seed=0):
+    f.write("Order Date,Order ID,Title,Category,Item Total,Currency\n")
+    for i in range(first, last):
+        (date, payee, amount, _) = bank_txn(i, seed)
+        f.write(
+            '%s,%03d-%07d-%07d,"%s",Books,$%.2f,USD\n'
+            % (date.strftime("%m/%d/%y"), i % 1000, i, i, payee.title(), abs(amount))
+        )
+
+
+VENMO_FIELDS = [
+    "Username",
+    "ID",
+    "Datetime",
+    "Type",
+    "Status",
+    "Note",
+    "From",
+    "To",
+    "Amount (total)",
+    "Amount (fee)",
+    "Funding Source",
+    "Destination",
+    "Beginning Balance",
+    "Ending Balance",
+    "Statement Period Venmo Fees",
+    "Year to Date Venmo Fees",
+    "Disclaimer",
+]
+
+
+def venmo_csv(f, first, last, seed=0):
+    f.write(",".join(VENMO_FIELDS) + "\n")
+    f.write('my_username,,,,,,,,,,,,"$0",,,,\n')
+    balance = 0
+    for i in range(first, last):
+        (date, payee, amount, _) = bank_txn(i, seed)
+        balance += amount
+        f.write(
+            ',%d,%sT12:00:00,Payment,Complete,note %d,Me,"%s",%s $%.2f,,,'
+            "Venmo balance,,,,,\n"
+            % (
+                i,
+                date.strftime("%Y-%m-%d"),
+                i,
+                payee,
+                "+" if amount > 0 else "-",
+                abs(amount),
+            )
+        )
+    f.write(',,,,,,,,,,,,,"$%.2f",$0.00,$0.00,\n' % (balance))
+
+
+CSV_GENERATORS = {
+    "mint": mint_csv,
+    "paypal": paypal_csv,
+    "amazon": amazon_csv,
+    "venmo": venmo_csv,
+}
+
+
+def generate(directory, journal_size, statement_size, overlap=0.5, seed=0):
+    """Write a journal and matching statements/CSVs into directory.
+
+    The statements contain `statement_size` transactions ending at the end
+    of the journal and extending past it, so that a fraction `overlap`
+    of them is already in the journal. Returns a dict of name -> path.
+    """
+    first = max(0, journal_size - int(statement_size * overlap))
+    last = first + statement_size
+    paths = {
+        "journal": os.path.join(directory, "journal.ledger"),
+        "bank": os.path.join(directory, "bank.ofx"),
+        "investment": os.path.join(directory, "investment.ofx"),
+    }
+    os.makedirs(directory, exist_ok=True)
+    with open(paths["journal"], "w") as f:
+        journal(f, journal_size, seed)
+    with open(paths["bank"], "w") as f:
+        bank_statement(f, first, last, seed)
+    with open(paths["investment"], "w") as f:
+        investment_statement(f, first, last, seed)
+    for name, generator in CSV_GENERATORS.items():
+        paths[name] = os.path.join(directory, "%s.csv" % (name))
+        with open(paths[name], "w") as f:
+            generator(f, first, last, seed)
+    return paths
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("directory")
+    parser.add_argument("--journal-size", type=int, default=1000)
+    parser.add_argument("--statement-size", type=int, default=500)
+    parser.add_argument("--overlap", type=float, default=0.5)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    for name, path in sorted(
+        generate(
+            args.directory,
+            args.journal_size,
+            args.statement_size,
+            args.overlap,
+            args.seed,
+        ).items()
+    ):
+        print("%-10s %s" % (name, path))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,303 @@
+#!/usr/bin/env python
+
+# Copyright (c) 2013-2021 Erik Hetzner
+#
+# This file is part of ledger-autosync
+#
+# ledger-autosync is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# ledger-autosync is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with ledger-autosync. If not, see
+# <http://www.gnu.org/licenses/>.
+
+"""A fake OFX bank server for offline sync benchmarks and tests.
+
+Answers OFX statement requests (STMTRQ, CCSTMTRQ and INVSTMTRQ, any
+number per request) with statements made by generate.py, restricted to
+the requested DTSTART/DTEND. Each account has `history` transactions,
+the last of which is dated today, so `ledger-autosync --max N` sees
+about N * generate.TXNS_PER_DAY transactions. Latency, random server
+errors, accounts with no transactions and "HttpStatusCode of 400" failures can be
+configured.
+
+ofxclient only speaks HTTPS, so the server uses a self-signed
+certificate for localhost (made with the openssl command line tool).
+Clients must trust it, e.g. by setting SSL_CERT_FILE:
+
+    $ python benchmarks/ofxserver.py --port 8443 --latency 0.2 &
+    $ SSL_CERT_FILE=/tmp/.../cert.pem ledger-autosync -L \\
+          -o benchmarks/ofxclient.ini
+"""
+
+import argparse
+import datetime
+import os
+import random
+import re
+import ssl
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import generate  # noqa: E402
+
+ERROR_400 = "Server error occured.  Received HttpStatusCode of 400"
+
+REQUEST_RE = re.compile(
+    r"<(STMTRQ|CCSTMTRQ|INVSTMTRQ)>(.*?)</\1>", re.DOTALL | re.IGNORECASE
+)
+
+
+def field(name, block):
+    md = re.search(r"<%s>([^<\r\n]*)" % (name), block, re.IGNORECASE)
+    if md is None:
+        return None
+    return md.group(1).strip()
+
+
+def parse_date(value):
+    return datetime.datetime.strptime(value[0:8], "%Y%m%d").date()
+
+
+class FakeBank(object):
+    def __init__(
+        self,
+        history=2000,
+        latency=0.0,
+        error_rate=0.0,
+        empty_accounts=(),
+        fail_accounts=(),
+        seed=0,
+    ):
+        self.history = history
+        self.latency = latency
+        self.error_rate = error_rate
+        self.empty_accounts = set(empty_accounts)
+        self.fail_accounts = set(fail_accounts)
+        self.seed = seed
+        self.rng = random.Random(seed)
+        self.today = datetime.date.today()
+        self.start = self.today - datetime.timedelta(
+            days=(history - 1) // generate.TXNS_PER_DAY
+        )
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.statements = 0
+        self.bytes_sent = 0
+
+    def window(self, block):
+        """Return the [first, last) transaction range requested by block."""
+        dtstart = field("DTSTART", block)
+        dtend = field("DTEND", block)
+        first = 0
+        last = self.history
+        if dtstart:
+            first = min(last, generate.txn_index(parse_date(dtstart), self.start))
+        if dtend:
+            end = parse_date(dtend) + datetime.timedelta(days=1)
+            last = min(last, generate.txn_index(end, self.start))
+        return (first, max(first, last))
+
+    def statement(self, kind, block):
+        acctid = field("ACCTID", block)
+        first, last = self.window(block)
+        if acctid in self.empty_accounts:
+            last = first
+        if kind == "INVSTMTRQ":
+            return generate.invstmtrs(first, last, self.seed, acctid, self.start)
+        stmtrs = generate.bank_stmtrs(first, last, self.seed, acctid, self.start)
+        if kind == "CCSTMTRQ":
+            stmtrs = re.sub(
+                "<BANKACCTFROM>.*?</BANKACCTFROM>",
+                "<CCACCTFROM><ACCTID>%s</CCACCTFROM>" % (acctid),
+                stmtrs,
+            )
+            stmtrs = stmtrs.replace("STMTRS>", "CCSTMTRS>")
+        return stmtrs
+
+    def respond(self, body):
+        """Return (HTTP status, response body) for an OFX request body."""
+        with self.lock:
+            self.requests += 1
+            fail = self.rng.random() < self.error_rate
+        if self.latency:
+            time.sleep(self.latency)
+        requests = REQUEST_RE.findall(body)
+        acctids = [field("ACCTID", block) for (_, block) in requests]
+        if any(acctid in self.fail_accounts for acctid in acctids):
+            return (400, ERROR_400)
+        if fail:
+            return (200, self.envelope(signon_error=True))
+        bank = []
+        cc = []
+        inv = []
+        for kind, block in requests:
+            kind = kind.upper()
+            trnuid = field("TRNUID", body) or "0"
+            stmt = self.statement(kind, block)
+            with self.lock:
+                self.statements += 1
+            status = "<STATUS><CODE>0<SEVERITY>INFO</STATUS>"
+            if kind == "STMTRQ":
+                bank.append(
+                    "<STMTTRNRS><TRNUID>%s%s%s</STMTTRNRS>" % (trnuid, status, stmt)
+                )
+            elif kind == "CCSTMTRQ":
+                cc.append(
+                    "<CCSTMTTRNRS><TRNUID>%s%s%s</CCSTMTTRNRS>" % (trnuid, status, stmt)
+                )
+            else:
+                inv.append(
+                    "<INVSTMTTRNRS><TRNUID>%s%s%s</INVSTMTTRNRS>"
+                    % (trnuid, status, stmt)
+                )
+        msgs = ""
+        if bank:
+            msgs += "<BANKMSGSRSV1>%s</BANKMSGSRSV1>" % ("".join(bank))
+        if cc:
+            msgs += "<CREDITCARDMSGSRSV1>%s</CREDITCARDMSGSRSV1>" % ("".join(cc))
+        if inv:
+            msgs += "<INVSTMTMSGSRSV1>%s</INVSTMTMSGSRSV1>%s" % (
+                "".join(inv),
+                generate.seclist(),
+            )
+        return (200, self.envelope(msgs))
+
+    def envelope(self, msgs="", signon_error=False):
+        signon = generate.signon()
+        if signon_error:
+            signon = signon.replace(
+                "<CODE>0<SEVERITY>INFO",
+                "<CODE>2000<SEVERITY>ERROR<MESSAGE>Simulated server error",
+            )
+        return "%s<OFX>%s%s</OFX>\n" % (generate.OFX_HEADER, signon, msgs)
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        body = self.rfile.read(length).decode("ascii", "ignore")
+        status, response = self.server.bank.respond(body)
+        data = response.encode("ascii")
+        with self.server.bank.lock:
+            self.server.bank.bytes_sent += len(data)
+        self.send_response(status)
+        self.send_header("Content-Type", "application/x-ofx")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def make_certificate(directory):
+    """Create a self-signed certificate for localhost in directory and
+    return (certfile, keyfile)."""
+    certfile = os.path.join(directory, "cert.pem")
+    keyfile = os.path.join(directory, "key.pem")
+    subprocess.run(
+        [
+            "openssl",
+            "req",
+            "-x509",
+            "-newkey",
+            "rsa:2048",
+            "-nodes",
+            "-days",
+            "2",
+            "-subj",
+            "/CN=localhost",
+            "-addext",
+            "subjectAltName=DNS:localhost,IP:127.0.0.1",
+            "-keyout",
+            keyfile,
+            "-out",
+            certfile,
+        ],
+        check=True,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    return (certfile, keyfile)
+
+
+def serve(bank, certfile, keyfile, port=0):
+    """Start the server in a daemon thread; return the HTTPServer, whose
+    server_address holds the port actually used."""
+    server = ThreadingHTTPServer(("localhost", port), Handler)
+    server.daemon_threads = True
+    server.bank = bank
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    context.load_cert_chain(certfile, keyfile)
+    server.socket = context.wrap_socket(server.socket, server_side=True)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
+
+
+def write_config(path, port, template=None):
+    """Write an ofxclient.ini for the fake bank listening on port."""
+    if template is None:
+        template = os.path.join(
+            os.path.dirname(os.path.abspath(__file__)), "ofxclient.ini"
+        )
+    with open(template) as f:
+        config = f.read()
+    with open(path, "w") as f:
+        f.write(
+            config.replace("https://localhost:8443/", "https://localhost:%d/" % (port))
+        )
+    return path
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--port", type=int, default=8443)
+    parser.add_argument("--history", type=int, default=2000)
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--empty", action="append", default=[], metavar="ACCTID")
+    parser.add_argument("--fail-400", action="append", default=[], metavar="ACCTID")
+    parser.add_argument("--certfile")
+    parser.add_argument("--keyfile")
+    args = parser.parse_args()
+    if args.certfile is None:
+        args.certfile, args.keyfile = make_certificate(tempfile.mkdtemp())
+    bank = FakeBank(
+        history=args.history,
+        latency=args.latency,
+        error_rate=args.error_rate,
+        empty_accounts=args.empty,
+        fail_accounts=args.fail_400,
+    )
+    server = serve(bank, args.certfile, args.keyfile, args.port)
+    sys.stderr.write(
+        "Serving on https://localhost:%d/ofx\nexport SSL_CERT_FILE=%s\n"
+        % (server.server_address[1], args.certfile)
+    )
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
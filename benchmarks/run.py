@@ -0,0 +1,210 @@
+#!/usr/bin/env python
+
+# Copyright (c) 2013-2021 Erik Hetzner
+#
+# This file is part of ledger-autosync
+#
+# ledger-autosync is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# ledger-autosync is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with ledger-autosync. If not, see
+# <http://www.gnu.org/licenses/>.
+
+"""Benchmark ledger-autosync against generated journals and statements.
+
+For every available backend (ledger, hledger, ledger python) and for no
+backend at all (-L), measures load_payees, OfxSynchronizer.filter,
+OfxConverter.convert, Transaction.format and end-to-end cli.run on
+the OFX and CSV inputs made by generate.py. Results are compared
+against a stored baseline; a benchmark slower than the baseline by more
+than --tolerance is reported as a regression and makes the script exit
+non-zero.
+
+    $ python benchmarks/run.py [--journal-size N] [--statement-size M]
+    $ python benchmarks/run.py --save   # update benchmarks/baseline.json
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+sys.path.insert(0, HERE)
+
+import generate  # noqa: E402
+
+from ledgerautosync.cli import run  # noqa: E402
+from ledgerautosync.converter import OfxConverter, SecurityList  # noqa: E402
+from ledgerautosync.ledgerwrap import HLedger, Ledger, LedgerPython  # noqa: E402
+from ledgerautosync.sync import OfxSynchronizer  # noqa: E402
+
+BASELINE = os.path.join(HERE, "baseline.json")
+BACKENDS = {"ledger": Ledger, "hledger": HLedger, "python": LedgerPython}
+
+
+def timed(fn, repeat):
+    """Return (best seconds, result) over `repeat` calls of fn()."""
+    best = None
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return (best, result)
+
+
+def mk_backend(name, journal):
+    if name == "none":
+        return None
+    klass = BACKENDS[name]
+    if klass == Ledger:
+        return klass(journal, no_pipe=False)
+    return klass(journal)
+
+
+def bench_backend(name, paths, repeat):
+    results = {}
+    ofx = OfxSynchronizer.parse_file(paths["bank"])
+    txns = ofx.account.statement.transactions
+
+    def fresh():
+        return mk_backend(name, paths["journal"])
+
+    if name != "none":
+        (t, _) = timed(lambda: fresh().load_payees(), repeat)
+        results["load_payees"] = (t, None)
+
+    lgr = fresh()
+    sync = OfxSynchronizer(lgr)
+    (t, new_txns) = timed(lambda: sync.filter(txns, ofx.account.account_id), repeat)
+    results["filter"] = (t, len(txns))
+
+    converter = OfxConverter(
+        account=ofx.account,
+        name=generate.ACCOUNT,
+        ledger=lgr,
+        security_list=SecurityList(ofx),
+    )
+    (t, converted) = timed(lambda: [converter.convert(txn) for txn in new_txns], repeat)
+    results["convert"] = (t, len(new_txns))
+    (t, _) = timed(lambda: [txn.format() for txn in converted], repeat)
+    results["format"] = (t, len(converted))
+
+    if name == "none":
+        ledger_args = ["-L"]
+    else:
+        ledger_args = ["-l", paths["journal"], "--%s" % (name)]
+        if name == "ledger":
+            ledger_args = ["-l", paths["journal"]]
+    for (label, path, extra) in [
+        ("run:bank", paths["bank"], ["-a", generate.ACCOUNT]),
+        ("run:investment", paths["investment"], ["-a", "Assets:Broker"]),
+        ("run:paypal", paths["paypal"], ["-a", "Assets:Paypal"]),
+        ("run:mint", paths["mint"], ["-a", "Assets:Mint"]),
+        ("run:amazon", paths["amazon"], ["-a", "Assets:Amazon"]),
+        ("run:venmo", paths["venmo"], ["-a", "Assets:Venmo"]),
+    ]:
+        with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(
+            io.StringIO()
+        ):
+            (t, _) = timed(lambda: run(ledger_args + extra + [path]), repeat)
+        results[label] = (t, None)
+    return results
+
+
+def available_backends(requested):
+    names = ["none"]
+    for name, klass in BACKENDS.items():
+        if requested and name not in requested:
+            continue
+        if klass.available():
+            names.append(name)
+        else:
+            sys.stderr.write("skipping %s: not available\n" % (name))
+    return names
+
+
+def compare(results, baseline, tolerance):
+    regressions = []
+    for key, seconds in sorted(results.items()):
+        base = baseline.get(key)
+        if base is None:
+            status = "new"
+        elif seconds > base * (1 + tolerance):
+            status = "REGRESSION (%+.0f%%)" % ((seconds / base - 1) * 100)
+            regressions.append(key)
+        else:
+            status = "ok (%+.0f%%)" % ((seconds / base - 1) * 100)
+        print("%-32s %10.2f ms  %s" % (key, seconds * 1000, status))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--journal-size", type=int, default=1000)
+    parser.add_argument("--statement-size", type=int, default=500)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument(
+        "--backend",
+        action="append",
+        choices=sorted(BACKENDS),
+        help="only benchmark this backend (repeatable)",
+    )
+    parser.add_argument("--baseline", default=BASELINE)
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.25,
+        help="allowed slowdown relative to the baseline (default 0.25)",
+    )
+    parser.add_argument(
+        "--save", action="store_true", help="write results as the new baseline"
+    )
+    args = parser.parse_args()
+
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        paths = generate.generate(directory, args.journal_size, args.statement_size)
+        for name in available_backends(args.backend):
+            for bench, (seconds, count) in bench_backend(
+                name, paths, args.repeat
+            ).items():
+                results["%s:%s" % (name, bench)] = round(seconds, 6)
+                if count:
+                    sys.stderr.write(
+                        "%s:%s %.0f txns/s\n" % (name, bench, count / seconds)
+                    )
+
+    key = "%d/%d" % (args.journal_size, args.statement_size)
+    stored = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            stored = json.load(f)
+    regressions = compare(results, stored.get(key, {}), args.tolerance)
+    if args.save:
+        stored[key] = results
+        with open(args.baseline, "w") as f:
+            json.dump(stored, f, indent=2, sort_keys=True)
+            f.write("\n")
+    if regressions and not args.save:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+#!/usr/bin/env python
+
+# Copyright (c) 2013-2021 Erik Hetzner
+#
+# This file is part of ledger-autosync
+#
+# ledger-autosync is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# ledger-autosync is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with ledger-autosync. If not, see
+# <http://www.gnu.org/licenses/>.
+
+"""Measure ledger-autosync cold-start cost.
+
+Reports the cumulative `python -X importtime` cost of importing
+ledgerautosync.cli, the modules that should *not* be loaded on a
+CSV-only run, and the wall-clock time of a CSV import with
+deduplication disabled. Exits non-zero if the CSV run is over budget.
+
+    $ python benchmarks/startup.py [--runs N] [--budget MS]
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Target for `ledger-autosync -L file.csv`, in milliseconds, including
+# interpreter startup.
+CSV_BUDGET_MS = 150
+
+# Heavy modules which a CSV-only run should never import.
+DEFERRED = ["ofxclient", "ofxparse", "bs4", "keyring", "http.client"]
+
+# -L disables deduplication; setting LEDGER_FILE just avoids the
+# warning about not finding a ledger file.
+ENV = dict(os.environ, LEDGER_FILE=os.path.join(ROOT, "fixtures", "empty.lgr"))
+
+
+def import_times(module):
+    """Return {module: cumulative microseconds} from -X importtime."""
+    out = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import %s" % (module)],
+        cwd=ROOT,
+        stderr=subprocess.PIPE,
+        universal_newlines=True,
+        check=True,
+    ).stderr
+    times = {}
+    for line in out.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line[len("import time:") :].split("|")
+        try:
+            times[name.strip()] = int(cumulative)
+        except ValueError:
+            pass  # header line
+    return times
+
+
+def loaded_modules(args):
+    code = (
+        "import sys; from ledgerautosync.cli import run; run(%r); "
+        "sys.stderr.write(' '.join(sys.modules))" % (args,)
+    )
+    out = subprocess.run(
+        [sys.executable, "-c", code],
+        cwd=ROOT,
+        env=ENV,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+        universal_newlines=True,
+        check=True,
+    ).stderr
+    return set(out.split())
+
+
+def wall_time(args, runs):
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run(
+            [sys.executable, "-m", "ledgerautosync.cli"] + args,
+            cwd=ROOT,
+            env=ENV,
+            stdout=subprocess.DEVNULL,
+            check=True,
+        )
+        times.append((time.perf_counter() - start) * 1000)
+    return statistics.median(times)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--budget", type=float, default=CSV_BUDGET_MS)
+    args = parser.parse_args()
+
+    csv_args = ["-L", "-a", "Assets:Paypal", os.path.join("fixtures", "paypal.csv")]
+
+    times = import_times("ledgerautosync.cli")
+    print("import ledgerautosync.cli: %6.1f ms" % (times["ledgerautosync.cli"] / 1000))
+    modules = loaded_modules(csv_args)
+    for name in DEFERRED:
+        print("  %-12s loaded on CSV run: %s" % (name, name in modules))
+    baseline = wall_time(["--help"], args.runs)
+    csv_run = wall_time(csv_args, args.runs)
+    print("ledger-autosync --help:    %6.1f ms" % (baseline))
+    print("ledger-autosync -L x.csv:  %6.1f ms (budget %d ms)" % (csv_run, args.budget))
+    leaked = [name for name in DEFERRED if name in modules]
+    if leaked or csv_run > args.budget:
+        if leaked:
+            print("FAIL: CSV run imported %s" % (", ".join(leaked)))
+        else:
+            print("FAIL: CSV run over budget")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+
+# Copyright (c) 2013-2021 Erik Hetzner
+#
+# This file is part of ledger-autosync
+#
+# ledger-autosync is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# ledger-autosync is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with ledger-autosync. If not, see
+# <http://www.gnu.org/licenses/>.
+
+"""Time `ledger-autosync` syncing every account in ofxclient.ini against
+the fake bank in ofxserver.py, reporting wall time, OFX requests and
+bytes downloaded. Extra arguments are passed to ledger-autosync:
+
+    $ python benchmarks/sync.py --latency 0.2 -- --max 30
+"""
+
+import argparse
+import contextlib
+import io
+import os
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+sys.path.insert(0, HERE)
+
+import ofxserver  # noqa: E402
+
+from ledgerautosync.cli import run  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--history", type=int, default=2000)
+    parser.add_argument("--latency", type=float, default=0.1)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--config", help="ofxclient.ini template")
+    parser.add_argument("autosync_args", nargs="*")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        certfile, keyfile = ofxserver.make_certificate(directory)
+        os.environ["SSL_CERT_FILE"] = certfile
+        bank = ofxserver.FakeBank(
+            history=args.history, latency=args.latency, error_rate=args.error_rate
+        )
+        server = ofxserver.serve(bank, certfile, keyfile)
+        config = ofxserver.write_config(
+            os.path.join(directory, "ofxclient.ini"),
+            server.server_address[1],
+            args.config,
+        )
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()) as output:
+            run(["-L", "-o", config] + args.autosync_args)
+        elapsed = time.perf_counter() - start
+        server.shutdown()
+    print("wall time      %10.1f ms" % (elapsed * 1000))
+    print("requests       %10d" % (bank.requests))
+    print("statements     %10d" % (bank.statements))
+    print("bytes          %10d" % (bank.bytes_sent))
+    print("ofxids written %10d" % (output.getvalue().count("; ofxid:")))
+
+
+if __name__ == "__main__":
+    main()
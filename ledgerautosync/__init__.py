@@ -16,6 +16,28 @@
 # along with ledger-autosync. If not, see
 # <http://www.gnu.org/licenses/>.
 
+import os
+
+
+def cache_dir():
+    """Directory for data that ledger-autosync can safely regenerate."""
+    return os.path.join(
+        os.environ.get(
+            "XDG_CACHE_HOME", os.path.join(os.path.expanduser("~"), ".cache")
+        ),
+        "ledger-autosync",
+    )
+
+
+def data_dir():
+    """Directory for data that ledger-autosync cannot regenerate."""
+    return os.path.join(
+        os.environ.get(
+            "XDG_DATA_HOME", os.path.join(os.path.expanduser("~"), ".local", "share")
+        ),
+        "ledger-autosync",
+    )
+
 
 class EmptyInstitutionException(Exception):
     def __init__(self, value):
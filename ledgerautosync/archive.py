@@ -0,0 +1,262 @@
+# Copyright (c) 2013-2021 Erik Hetzner
+#
+# This file is part of ledger-autosync
+#
+# ledger-autosync is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# ledger-autosync is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with ledger-autosync. If not, see
+# <http://www.gnu.org/licenses/>.
+
+
+"""An archive of downloaded and imported statements, so that their
+transactions can be converted again (e.g. after changing --payee-format
+or a plugin) without downloading them again.
+
+Raw OFX files are stored whole, as ofxparse cannot serialize what it
+parsed; CSV files are stored as their rows. Every transaction gets a
+row keyed by its ofxid or csvid, with its account and date, pointing at
+the statement it came from; a transaction seen in several statements
+points at the latest one.
+"""
+
+import csv
+import datetime
+import hashlib
+import json
+import os
+import sqlite3
+
+from ledgerautosync import profiling
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS statements (
+    id INTEGER PRIMARY KEY,
+    format TEXT NOT NULL,
+    digest TEXT NOT NULL UNIQUE,
+    name TEXT,
+    data BLOB,
+    fieldnames TEXT,
+    dialect TEXT,
+    archived TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS transactions (
+    key TEXT NOT NULL,
+    id TEXT NOT NULL,
+    account TEXT NOT NULL,
+    date TEXT,
+    statement INTEGER NOT NULL REFERENCES statements (id),
+    row TEXT,
+    PRIMARY KEY (key, id)
+);
+CREATE INDEX IF NOT EXISTS transactions_account_date
+    ON transactions (account, date);
+CREATE INDEX IF NOT EXISTS transactions_date ON transactions (date);
+CREATE TABLE IF NOT EXISTS statement_accounts (
+    statement INTEGER NOT NULL REFERENCES statements (id),
+    acctid TEXT NOT NULL,
+    name TEXT NOT NULL,
+    PRIMARY KEY (statement, acctid)
+);
+"""
+
+DIALECT_ATTRS = [
+    "delimiter",
+    "doublequote",
+    "escapechar",
+    "lineterminator",
+    "quotechar",
+    "quoting",
+    "skipinitialspace",
+]
+
+
+def date_string(d):
+    if d is None:
+        return None
+    if isinstance(d, datetime.datetime):
+        d = d.date()
+    return d.isoformat()
+
+
+def dump_dialect(dialect):
+    return json.dumps(dict((a, getattr(dialect, a, None)) for a in DIALECT_ATTRS))
+
+
+def load_dialect(s):
+    return type("ArchivedDialect", (csv.Dialect,), json.loads(s))
+
+
+class Statement(object):
+    """A statement read back from the archive. For OFX statements, data
+    holds the raw file, and for a response to a combined request, names
+    maps the ids of its accounts to the ledger account names they were
+    synced to; for CSV statements, fieldnames and dialect describe the
+    file."""
+
+    def __init__(self, id, format, name, data, fieldnames, dialect, names=None):
+        self.id = id
+        self.format = format
+        self.name = name
+        self.names = names or {}
+        self.data = data
+        self.fieldnames = None
+        if fieldnames is not None:
+            self.fieldnames = json.loads(fieldnames)
+        self.dialect = None
+        if dialect is not None:
+            self.dialect = load_dialect(dialect)
+
+
+class Archive(object):
+    def __init__(self, path):
+        directory = os.path.dirname(os.path.abspath(path))
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self.path = path
+        self.db = sqlite3.connect(path)
+        self.db.executescript(SCHEMA)
+        self.statements = {}
+
+    def add_statement(self, format, digest, name, **columns):
+        self.db.execute(
+            "INSERT OR IGNORE INTO statements "
+            "(format, digest, name, data, fieldnames, dialect, archived) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (
+                format,
+                digest,
+                name,
+                columns.get("data"),
+                columns.get("fieldnames"),
+                columns.get("dialect"),
+                datetime.datetime.now().isoformat(),
+            ),
+        )
+        return self.db.execute(
+            "SELECT id FROM statements WHERE digest = ?", (digest,)
+        ).fetchone()[0]
+
+    def add_transactions(self, key, rows):
+        self.db.executemany(
+            "INSERT OR REPLACE INTO transactions "
+            "(key, id, account, date, statement, row) VALUES (?, ?, ?, ?, ?, ?)",
+            ((key,) + row for row in rows),
+        )
+
+    def add_ofx(self, data, ofx, name=None):
+        """Archive the raw OFX file data, which parsed to ofx. name is the
+        ledger account name it was synced to, if known, or for a response
+        to a combined request a dict mapping account ids to their names."""
+        from ledgerautosync.sync import OfxSynchronizer
+
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+        names = {}
+        if isinstance(name, dict):
+            names = name
+            name = None
+        with profiling.span("archive"), self.db:
+            statement = self.add_statement(
+                "ofx", hashlib.sha256(data).hexdigest(), name, data=data
+            )
+            self.db.executemany(
+                "INSERT OR REPLACE INTO statement_accounts "
+                "(statement, acctid, name) VALUES (?, ?, ?)",
+                [(statement, acctid, names[acctid]) for acctid in sorted(names)],
+            )
+            for account in ofx.accounts:
+                acctid = account.account_id
+                self.add_transactions(
+                    "ofxid",
+                    [
+                        (
+                            "%s.%s" % (acctid, txn.id),
+                            acctid,
+                            date_string(OfxSynchronizer.extract_sort_key(txn)),
+                            statement,
+                            None,
+                        )
+                        for txn in account.statement.transactions
+                    ],
+                )
+
+    def add_csv(self, name, fieldnames, dialect, rows):
+        """Archive the rows of a CSV file imported to the account name.
+        rows is a list of (csvid, date, row) tuples."""
+        encoded = [(csvid, date, json.dumps(row)) for (csvid, date, row) in rows]
+        digest = hashlib.sha256()
+        digest.update(json.dumps([name, fieldnames]).encode("utf-8"))
+        for csvid, _, row in encoded:
+            digest.update(("%s\n" % (row)).encode("utf-8"))
+        with profiling.span("archive"), self.db:
+            statement = self.add_statement(
+                "csv",
+                digest.hexdigest(),
+                name,
+                fieldnames=json.dumps(fieldnames),
+                dialect=dump_dialect(dialect),
+            )
+            self.add_transactions(
+                "csvid",
+                [
+                    (csvid, name, date_string(date), statement, row)
+                    for (csvid, date, row) in encoded
+                ],
+            )
+
+    def statement(self, id):
+        if id not in self.statements:
+            row = self.db.execute(
+                "SELECT id, format, name, data, fieldnames, dialect "
+                "FROM statements WHERE id = ?",
+                (id,),
+            ).fetchone()
+            names = dict(
+                self.db.execute(
+                    "SELECT acctid, name FROM statement_accounts WHERE statement = ?",
+                    (id,),
+                )
+            )
+            self.statements[id] = Statement(*row, names=names)
+        return self.statements[id]
+
+    def transactions(self, since=None, account=None):
+        """Yield (statement, key, id, row) for the archived transactions
+        dated on or after since (all of them if since is None) of account,
+        in order of date. row is the CSV row, or None for OFX
+        transactions."""
+        query = "SELECT statement, key, id, row FROM transactions"
+        conditions = []
+        params = []
+        if since is not None:
+            conditions.append("date >= ?")
+            params.append(date_string(since))
+        if account is not None:
+            # the OFX account id, or the ledger account name
+            conditions.append(
+                "(account = ? OR statement IN "
+                "(SELECT id FROM statements WHERE name = ?) OR EXISTS "
+                "(SELECT 1 FROM statement_accounts AS a WHERE "
+                "a.statement = transactions.statement "
+                "AND a.acctid = transactions.account AND a.name = ?))"
+            )
+            params.extend([account, account, account])
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        query += " ORDER BY date, statement, rowid"
+        for statement, key, id, row in self.db.execute(query, params):
+            if row is not None:
+                row = json.loads(row)
+            yield (self.statement(statement), key, id, row)
+
+    def close(self):
+        self.db.close()
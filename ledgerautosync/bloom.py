@@ -0,0 +1,117 @@
+# Copyright (c) 2013-2021 Erik Hetzner
+#
+# This file is part of ledger-autosync
+#
+# ledger-autosync is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# ledger-autosync is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with ledger-autosync. If not, see
+# <http://www.gnu.org/licenses/>.
+
+"""A Bloom filter over strings, stored in a file that is memory-mapped
+for lookups so that concurrent processes share one copy of it.
+
+A string that was added is always reported as present; a string that
+was not is reported as present with probability close to the false
+positive rate the filter was sized for, as long as no more than its
+capacity was added.
+"""
+
+import hashlib
+import math
+import mmap
+import os
+import struct
+import tempfile
+
+MAGIC = b"LASBLM01"
+HEADER = struct.Struct("<8sQQQd")
+
+
+class BloomFilter(object):
+    def __init__(self, bits, hashes, capacity, fp_rate, data=None):
+        self.bits = bits
+        self.hashes = hashes
+        self.capacity = capacity
+        self.fp_rate = fp_rate
+        if data is None:
+            data = bytearray((bits + 7) // 8)
+        self.data = data
+        self.mmap = None
+
+    @classmethod
+    def for_capacity(cls, capacity, fp_rate):
+        """Return an empty filter sized for `capacity` strings at the false
+        positive rate `fp_rate`, which must be between 0 and 1."""
+        if not 0 < fp_rate < 1:
+            raise ValueError("false positive rate not between 0 and 1: %s" % (fp_rate))
+        capacity = max(1, capacity)
+        bits = max(8, int(math.ceil(-capacity * math.log(fp_rate) / math.log(2) ** 2)))
+        hashes = max(1, int(round(bits / capacity * math.log(2))))
+        return cls(bits, hashes, capacity, fp_rate)
+
+    def positions(self, s):
+        # Kirsch-Mitzenmacher: k positions from two 64-bit hashes
+        digest = hashlib.blake2b(s.encode("utf-8"), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return [(h1 + i * h2) % self.bits for i in range(self.hashes)]
+
+    def add(self, s):
+        for pos in self.positions(s):
+            self.data[pos >> 3] |= 1 << (pos & 7)
+
+    def __contains__(self, s):
+        data = self.data
+        for pos in self.positions(s):
+            if not data[pos >> 3] & (1 << (pos & 7)):
+                return False
+        return True
+
+    def nbytes(self):
+        return len(self.data)
+
+    def write(self, path):
+        fd, tmp_path = tempfile.mkstemp(
+            prefix=".tmp", dir=os.path.dirname(os.path.abspath(path))
+        )
+        with os.fdopen(fd, "wb") as f:
+            f.write(
+                HEADER.pack(MAGIC, self.bits, self.hashes, self.capacity, self.fp_rate)
+            )
+            f.write(self.data)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def open(cls, path, writable=False):
+        """Open the filter written to path. Unless writable, its bits are
+        memory-mapped rather than read."""
+        with open(path, "rb") as f:
+            if writable:
+                buf = f.read()
+                magic, bits, hashes, capacity, fp_rate = HEADER.unpack_from(buf)
+                data = bytearray(buf[HEADER.size :])
+                mapped = None
+            else:
+                mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                magic, bits, hashes, capacity, fp_rate = HEADER.unpack_from(mapped)
+                data = memoryview(mapped)[HEADER.size :]
+        if magic != MAGIC:
+            raise ValueError("%s is not a Bloom filter" % (path))
+        bloom = cls(bits, hashes, capacity, fp_rate, data)
+        bloom.mmap = mapped
+        return bloom
+
+    def close(self):
+        if self.mmap is not None:
+            self.data.release()
+            self.mmap.close()
+            self.mmap = None
@@ -0,0 +1,188 @@
+# Copyright (c) 2013-2021 Erik Hetzner
+#
+# This file is part of ledger-autosync
+#
+# ledger-autosync is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# ledger-autosync is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with ledger-autosync. If not, see
+# <http://www.gnu.org/licenses/>.
+
+
+"""A cache of downloaded OFX responses.
+
+Each response is spooled to disk as it is read, and kept for `ttl`
+seconds under a key naming the accounts and date window it was
+requested for; a sync that is run again within that time (e.g. after
+failing halfway) reads it from the cache instead of downloading it.
+
+The cache also remembers, per key and account, the fingerprint of the
+last response whose statement was converted and printed. A response
+with the same fingerprint holds nothing new for that account, so it
+need not be parsed, deduplicated or converted at all. The fingerprint
+is a sha256 digest of the response bytes, leaving out the few values
+that servers change with every request (the server time and the echoed
+request ids).
+"""
+
+import hashlib
+import os
+import re
+import tempfile
+import time
+
+from ledgerautosync.index import atomic_file
+
+CHUNK_SIZE = 1 << 16
+# responses up to this size are spooled in memory when not cached
+SPOOL_SIZE = 1 << 20
+VOLATILE_RE = re.compile(
+    rb"(<(?:DTSERVER|TRNUID|CLTCOOKIE)>|NEWFILEUID:)[^<\r\n]*", re.IGNORECASE
+)
+
+
+class Fingerprint(object):
+    """Digest of a response, fed in chunks, with VOLATILE_RE values left
+    out."""
+
+    def __init__(self):
+        self.digest = hashlib.sha256()
+        self.pending = b""
+
+    def update(self, chunk):
+        data = self.pending + chunk
+        # Values end at the next tag, so everything before the last "<"
+        # can be masked now; the rest waits for the next chunk.
+        cut = data.rfind(b"<")
+        if cut == -1 and len(data) > CHUNK_SIZE:
+            cut = len(data)
+        if cut <= 0:
+            self.pending = data
+            return
+        self.digest.update(VOLATILE_RE.sub(rb"\1", data[:cut]))
+        self.pending = data[cut:]
+
+    def hexdigest(self):
+        self.digest.update(VOLATILE_RE.sub(rb"\1", self.pending))
+        self.pending = b""
+        return self.digest.hexdigest()
+
+
+def spool(raw, f):
+    """Copy the downloaded response raw (a text or binary file) to the
+    binary file f. Return (fingerprint, size in bytes)."""
+    digest = Fingerprint()
+    size = 0
+    while True:
+        chunk = raw.read(CHUNK_SIZE)
+        if not chunk:
+            break
+        if isinstance(chunk, str):
+            chunk = chunk.encode("utf-8")
+        digest.update(chunk)
+        size += len(chunk)
+        f.write(chunk)
+    return (digest.hexdigest(), size)
+
+
+def spool_temporary(raw):
+    """Spool raw to a temporary file. Return (f, digest, size), f being
+    positioned at its start."""
+    f = tempfile.SpooledTemporaryFile(max_size=SPOOL_SIZE)
+    digest, size = spool(raw, f)
+    f.seek(0)
+    return (f, digest, size)
+
+
+def file_digest(f):
+    digest = Fingerprint()
+    size = 0
+    for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+        digest.update(chunk)
+        size += len(chunk)
+    f.seek(0)
+    return (digest.hexdigest(), size)
+
+
+class StatementCache(object):
+    def __init__(self, directory, ttl):
+        self.directory = directory
+        self.ttl = ttl
+        os.makedirs(directory, exist_ok=True)
+        self.expire()
+
+    @staticmethod
+    def name(key):
+        return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+    def response_path(self, key):
+        return os.path.join(self.directory, self.name(key) + ".ofx")
+
+    def fingerprint_path(self, key, acctid):
+        return os.path.join(
+            self.directory, self.name("%s\n%s" % (key, acctid)) + ".processed"
+        )
+
+    def is_fresh(self, path):
+        try:
+            return time.time() - os.path.getmtime(path) < self.ttl
+        except OSError:
+            return False
+
+    def expire(self):
+        """Remove the cached responses older than the TTL."""
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if name.endswith(".ofx") and not self.is_fresh(path):
+                try:
+                    os.unlink(path)
+                except OSError:
+                    pass
+
+    def get(self, key):
+        """Return (f, digest, size) for the response cached under key, or
+        None if there is none younger than the TTL."""
+        path = self.response_path(key)
+        if not self.is_fresh(path):
+            return None
+        try:
+            f = open(path, "rb")
+        except OSError:
+            return None
+        digest, size = file_digest(f)
+        return (f, digest, size)
+
+    def put(self, key, raw):
+        """Spool the downloaded response raw into the cache under key.
+        Return (f, digest, size) as get does."""
+        path = self.response_path(key)
+        with atomic_file(path, self.directory) as f:
+            digest, size = spool(raw, f)
+        return (open(path, "rb"), digest, size)
+
+    def discard(self, key):
+        try:
+            os.unlink(self.response_path(key))
+        except OSError:
+            pass
+
+    def is_processed(self, key, acctid, digest):
+        """Return True if the statement of account acctid in the response
+        with digest, downloaded under key, was already converted."""
+        try:
+            with open(self.fingerprint_path(key, acctid)) as f:
+                return f.read().strip() == digest
+        except OSError:
+            return False
+
+    def mark_processed(self, key, acctid, digest):
+        with atomic_file(self.fingerprint_path(key, acctid), self.directory) as f:
+            f.write(digest.encode("ascii"))
@@ -0,0 +1,227 @@
+# Copyright (c) 2013-2021 Erik Hetzner
+#
+# This file is part of ledger-autosync
+#
+# ledger-autosync is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# ledger-autosync is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with ledger-autosync. If not, see
+# <http://www.gnu.org/licenses/>.
+
+"""A checkpoint journal for importing several files in one run.
+
+Each input file of the batch goes through three phases, and a line is
+appended to the checkpoint (and synced to disk) as it completes one:
+"started", with the fingerprint of the file and the size of the journal
+the output is appended to, if it is a regular file; "output", once all
+of its output was flushed, with the ids it output and the size of the
+journal then; and "done", once it was recorded in the import registry,
+if any.
+
+If the run is interrupted, the checkpoint tells which files reached the
+journal. Resuming skips them, seeding deduplication with the ids they
+output instead of looking those up again, and continues from the first
+file that is not done. The output of a file that was interrupted is the
+journal after the size recorded when it started; its ids are scanned
+from there.
+"""
+
+import json
+import os
+import stat
+
+from ledgerautosync import LedgerAutosyncException
+from ledgerautosync.index import KEYS, id_values
+from ledgerautosync.journal import Entry, scan
+from ledgerautosync.registry import hash_file
+
+VERSION = 1
+
+
+def fingerprint(path):
+    """Return [size, mtime_ns, digest] of the file at path, or None for
+    standard input."""
+    if path == "-":
+        return None
+    st = os.stat(path)
+    return [st.st_size, st.st_mtime_ns, hash_file(path)[0]]
+
+
+def unchanged(path, known):
+    """Return True if the file at path still has the fingerprint known."""
+    if known is None:
+        return False
+    try:
+        st = os.stat(path)
+    except OSError:
+        return False
+    if [st.st_size, st.st_mtime_ns] == known[:2]:
+        return True
+    return st.st_size == known[0] and hash_file(path)[0] == known[2]
+
+
+def position(f):
+    """Flush the text file f and return [device, inode, size] of the
+    regular file it writes to, or None (e.g. if it is a pipe)."""
+    f.flush()
+    try:
+        st = os.fstat(f.fileno())
+    except (AttributeError, OSError, ValueError):
+        return None
+    if not stat.S_ISREG(st.st_mode):
+        return None
+    return [st.st_dev, st.st_ino, st.st_size]
+
+
+class Checkpoint(object):
+    """The checkpoint at path of importing paths. Unless resuming, a
+    checkpoint left there by another run is replaced."""
+
+    def __init__(self, path, paths, resume=False):
+        self.path = path
+        self.paths = [self.key(p) for p in paths]
+        # key -> the last record of the file
+        self.files = {}
+        # key -> the ids a file cut short had output (see ids)
+        self.partial = {}
+        if resume:
+            self.load()
+        else:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.f = open(path, "a" if resume else "w", encoding="utf-8")
+        if not resume:
+            self.append({"version": VERSION, "paths": self.paths})
+
+    @staticmethod
+    def key(path):
+        if path == "-":
+            return path
+        return os.path.abspath(path)
+
+    def load(self):
+        try:
+            f = open(self.path, encoding="utf-8")
+        except FileNotFoundError:
+            raise LedgerAutosyncException("No checkpoint found at %s" % (self.path))
+        with f:
+            lines = f.read().splitlines()
+        try:
+            header = json.loads(lines[0])
+        except (IndexError, ValueError):
+            header = {}
+        if header.get("version") != VERSION:
+            raise LedgerAutosyncException("Cannot resume from %s" % (self.path))
+        if header["paths"] != self.paths:
+            raise LedgerAutosyncException(
+                "The checkpoint at %s is of importing other files" % (self.path)
+            )
+        for line in lines[1:]:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # cut short when the run was killed
+                continue
+            known = self.files.get(record["file"], {})
+            self.files[record["file"]] = dict(known, **record)
+
+    def append(self, record):
+        self.f.write(json.dumps(record, sort_keys=True) + "\n")
+        self.f.flush()
+        os.fsync(self.f.fileno())
+
+    def phase(self, path):
+        """Return the last phase the file at path completed, or None if it
+        was not started or has changed since."""
+        record = self.files.get(self.key(path))
+        if record is None or not unchanged(path, record["fingerprint"]):
+            return None
+        return record["phase"]
+
+    def ids(self, journal_path=None):
+        """Return the set of (key, value) ids output by the files of the
+        batch so far. If journal_path is the file the output of an
+        interrupted file was appended to, the ids in that output are
+        included."""
+        ids = set()
+        for record in self.files.values():
+            if record["phase"] == "started":
+                if journal_path is not None and record["position"] is not None:
+                    partial = appended_ids(journal_path, record["position"])
+                    self.partial[record["file"]] = partial
+                    ids.update(partial)
+            else:
+                ids.update(tuple(i) for i in record["ids"])
+        return ids
+
+    def start(self, path, position=None):
+        """Record that importing the file at path started, with its output
+        going to the journal at position. A file cut short before is
+        started again where it was then, as its output begins there."""
+        record = {
+            "file": self.key(path),
+            "phase": "started",
+            "fingerprint": fingerprint(path),
+            "position": position,
+        }
+        earlier = self.files.get(record["file"])
+        if (
+            earlier is not None
+            and earlier["phase"] == "started"
+            and earlier["position"] is not None
+            and position is not None
+            and earlier["position"][:2] == position[:2]
+        ):
+            record["position"] = earlier["position"]
+        self.files[record["file"]] = record
+        self.append(record)
+
+    def output(self, path, ids, position=None):
+        """Record that the output of the file at path, of the set ids, has
+        been flushed to the journal, which has now the position given.
+        The ids it output before it was cut short are included."""
+        key = self.key(path)
+        record = {
+            "file": key,
+            "phase": "output",
+            "ids": sorted(set(ids) | self.partial.pop(key, set())),
+            "end": position[2] if position is not None else None,
+        }
+        self.files[record["file"]].update(record)
+        self.append(record)
+
+    def done(self, path):
+        record = {"file": self.key(path), "phase": "done"}
+        self.files[record["file"]].update(record)
+        self.append(record)
+
+    def close(self):
+        self.f.close()
+
+
+def appended_ids(journal_path, position):
+    """Return the ids in the journal at journal_path after the size in
+    position, if it is the file of position, as synchronizers look them
+    up (see index.id_values)."""
+    try:
+        st = os.stat(journal_path)
+    except OSError:
+        return set()
+    device, inode, size = position
+    if (st.st_dev, st.st_ino) != (device, inode) or st.st_size <= size:
+        return set()
+    ids = set()
+    with open(journal_path, "rb") as f:
+        for item in scan(f, journal_path, size):
+            if isinstance(item, Entry):
+                for k, value in item.metadata:
+                    if k in KEYS:
+                        ids.update((k, v) for v in id_values(k, value))
+    return ids
@@ -21,7 +21,9 @@
 
 
 import argparse
+import datetime
 import importlib.util
+import io
 import logging
 import os
 import os.path
@@ -29,18 +31,27 @@ import re
 import sys
 import traceback
 
-from ofxclient.config import OfxConfig
-
-from ledgerautosync import LedgerAutosyncException
+from ledgerautosync import (
+    LedgerAutosyncException,
+    cache_dir,
+    data_dir,
+    metrics,
+    profiling,
+)
 from ledgerautosync.converter import (
     ALL_AUTOSYNC_INITIAL,
     AUTOSYNC_INITIAL,
     UNKNOWN_BANK_ACCOUNT,
+    CsvConverter,
     OfxConverter,
     SecurityList,
+    Transaction,
 )
+from ledgerautosync.inputs import open_inputs
+from ledgerautosync.jobs import map_ordered
 from ledgerautosync.ledgerwrap import HLedger, Ledger, LedgerPython, mk_ledger
 from ledgerautosync.sync import CsvSynchronizer, OfxSynchronizer
+from ledgerautosync.transfers import pair_transfers
 
 
 def find_ledger_file(ledgerrcpath=None):
@@ -61,7 +72,75 @@ found."""
         return None
 
 
-def print_results(converter, ofx, ledger, txns, args):
+def check_fuzzy(matcher, converted, args):
+    """Look for an untagged journal entry that converted may duplicate.
+    Return converted, possibly annotated, or None to suppress it."""
+    if matcher is None or not isinstance(converted, Transaction):
+        return converted
+    match = matcher.match(converted)
+    if match is None:
+        return converted
+    metrics.inc("fuzzy_duplicates")
+    sys.stderr.write(
+        "Possible duplicate: %s %s matches %s\n"
+        % (
+            converted.date.strftime("%Y/%m/%d"),
+            converted.payee,
+            match.describe(),
+        )
+    )
+    if args.fuzzy_duplicates == "suppress":
+        return None
+    metadata = dict(converted.metadata)
+    metadata["possible_duplicate"] = match.location()
+    converted.metadata = metadata
+    return converted
+
+
+def print_item(item, args, output=None, batch_ids=None):
+    """Print item, or write it to output (see run) if that takes it, and
+    record its ids in batch_ids (see record_output)."""
+    text = item
+    if isinstance(item, Transaction):
+        with profiling.span("format"):
+            text = item.format(args.indent)
+    if output is None or not output.write(text, item):
+        print(text)
+    record_output(batch_ids, text)
+
+
+def record_output(batch_ids, text):
+    """Add the ids in text, just output, to the set batch_ids, as the
+    synchronizers look them up, so that the rest of the batch does not
+    output them again. Only output transactions are recorded, and only
+    once a file was read: rows of one file that have the same id (e.g.
+    two equal purchases on a day, whose csvid is a hash of the row) are
+    not duplicates of each other."""
+    if batch_ids is None:
+        return
+    from ledgerautosync.index import KEYS, id_values
+    from ledgerautosync.journal import META_RE
+
+    for line in text.splitlines():
+        md = META_RE.search(line)
+        if md is not None and md.group(1) in KEYS:
+            batch_ids.update((md.group(1), v) for v in id_values(*md.groups()))
+
+
+def output_position(output=None):
+    """Flush output (see run), and return the position of the journal
+    printed to (see checkpoint.position) if there is none."""
+    if output is not None:
+        output.flush()
+        return None
+    from ledgerautosync.checkpoint import position
+
+    return position(sys.stdout)
+
+
+def print_results(
+    converter, account, ledger, txns, args, matcher=None, out=None, output=None
+):
     """
     This function is the final common pathway of program:
 
@@ -69,27 +148,81 @@ def print_results(converter, ofx, ledger, txns, args):
     Print transactions surviving de-duplication filter;
     Print balance assertions if requested;
     Print commodity prices obtained from position statements
+
+    account is the OFX account (one statement of the OFX file). If out is
+    a list, append to it instead of printing.
     """
+    (leading, converted, trailing) = output_items(
+        converter, account, ledger, txns, args, matcher
+    )
+    for items in (leading, converted, trailing):
+        for item in items:
+            if out is None:
+                print_item(item, args, output)
+            else:
+                out.append(item)
+
 
+def output_items(converter, account, ledger, txns, args, matcher=None):
+    """Return the output for account (see print_results) as the items to
+    print before its transactions, an iterator converting the transactions
+    as it goes, and an iterator of the items to print after them."""
+    leading = []
     if args.initial:
         if not (
             ledger.check_transaction_by_id(
                 "ofxid", converter.mk_ofxid(AUTOSYNC_INITIAL)
             )
         ) and not (ledger.check_transaction_by_id("ofxid", ALL_AUTOSYNC_INITIAL)):
-            print(converter.format_initial_balance(ofx.account.statement))
-    for txn in txns:
-        print(converter.convert(txn).format(args.indent))
-    if args.assertions:
-        print(converter.format_balance(ofx.account.statement))
+            leading.append(converter.format_initial_balance(account.statement))
+
+    def convert():
+        for txn in txns:
+            with profiling.span("convert"):
+                converted = converter.convert(txn)
+            converted = check_fuzzy(matcher, converted, args)
+            if converted is not None:
+                yield converted
+
+    def trailing():
+        if args.assertions:
+            yield converter.format_balance(account.statement)
+
+        # if OFX has positions use these to obtain commodity prices
+        # and print "P" records to provide dated/timed valuations
+        # Note that this outputs only the commodity price,
+        # not your position (e.g. # shares), even though this is in the OFX record
+        # (with a security master, only those the journal lacks)
+        prices = None
+        if converter.security_list.master is not None:
+            prices = converter.security_list.master.prices
+        if hasattr(account.statement, "positions"):
+            for pos in account.statement.positions:
+                if prices is None or prices.is_new(
+                    pos.date, converter.maybe_get_ticker(pos.security)
+                ):
+                    yield converter.format_position(pos)
+
+    return (leading, convert(), trailing())
 
-    # if OFX has positions use these to obtain commodity prices
-    # and print "P" records to provide dated/timed valuations
-    # Note that this outputs only the commodity price,
-    # not your position (e.g. # shares), even though this is in the OFX record
-    if hasattr(ofx.account.statement, "positions"):
-        for pos in ofx.account.statement.positions:
-            print(converter.format_position(pos))
+
+def account_items(acct, items, failed):
+    """Yield from items, the output of acct, converted as it is merged
+    with that of other accounts (see sync). If converting fails, report
+    it, add acct to failed and stop."""
+    while True:
+        try:
+            with metrics.labels(account=acct.description):
+                item = next(items)
+        except StopIteration:
+            return
+        except KeyboardInterrupt:
+            raise
+        except BaseException:
+            report_error(acct)
+            failed.append(acct)
+            return
+        yield item
 
 
 def make_ofx_converter(
@@ -145,84 +278,558 @@ def make_ofx_converter(
         )
 
 
-def sync(ledger, accounts, args):
-    sync = OfxSynchronizer(ledger, shortenaccount=args.shortenaccount)
-    for acct in accounts:
-        try:
-            (ofx, txns) = sync.get_new_txns(acct, resync=args.resync, max_days=args.max)
-            if ofx is not None:
-                converter = make_ofx_converter(
-                    account=ofx.account,
-                    name=acct.description,
-                    ledger=ledger,
-                    indent=args.indent,
-                    fid=None,
-                    unknownaccount=args.unknownaccount,
-                    payee_format=args.payee_format,
-                    hardcodeaccount=None,
-                    shortenaccount=args.shortenaccount,
-                    security_list=SecurityList(ofx),
-                    date_format=args.date_format,
-                    infer_account=args.infer_account,
-                )
-                print_results(converter, ofx, ledger, txns, args)
-        except KeyboardInterrupt:
-            raise
-        except BaseException:
-            sys.stderr.write("Caught exception processing %s\n" % (acct.description))
-            traceback.print_exc(file=sys.stderr)
-
+def sync(
+    ledger,
+    accounts,
+    args,
+    index=None,
+    prefilter=None,
+    matcher=None,
+    archive=None,
+    output=None,
+    securities=None,
+):
+    cache = None
+    if args.cache_ttl is not None:
+        from ledgerautosync.cache import StatementCache
 
-def import_ofx(ledger, args):
+        cache = StatementCache(os.path.join(cache_dir(), "statements"), args.cache_ttl)
     sync = OfxSynchronizer(
-        ledger, hardcodeaccount=args.hardcodeaccount, shortenaccount=args.shortenaccount
-    )
-    ofx = OfxSynchronizer.parse_file(args.PATH)
-    txns = sync.filter(ofx.account.statement.transactions, ofx.account.account_id)
-    accountname = args.account
-    if accountname is None:
-        if ofx.account.institution is not None:
-            accountname = "%s:%s" % (
-                ofx.account.institution.organization,
-                ofx.account.account_id,
+        ledger,
+        shortenaccount=args.shortenaccount,
+        date_slack=args.dedup_window,
+        index=index,
+        prefilter=prefilter,
+        archive=archive,
+        cache=cache,
+        securities=securities,
+    )
+    out = None
+    if args.pair_transfers is not None or args.merge_by_date:
+        # hold back all output until every account has been downloaded;
+        # with --merge-by-date, out gets each account's output as an
+        # iterator converting it lazily
+        out = []
+    # brings in http.client; only load it when talking to a bank
+    from ledgerautosync.download import (
+        ConnectionPool,
+        can_combine,
+        group_by_institution,
+    )
+
+    accounts = list(accounts)
+    if args.backfill is not None and args.backfill > args.max:
+        sys.stderr.write(
+            "Backfilling only the last %d days (--max), in one window\n" % (args.max)
+        )
+    pool = ConnectionPool()
+    if args.combine:
+        grouped = group_by_institution(accounts)
+    else:
+        grouped = [[acct] for acct in accounts]
+    # account -> the accounts downloaded with it (at its institution)
+    groups = {}
+    for group in grouped:
+        if len(group) > 1 or (args.backfill is not None and can_combine(group[0])):
+            for acct in group:
+                groups[acct] = group
+        elif args.backfill is not None:
+            sys.stderr.write(
+                "Cannot backfill %s, downloading it as usual\n" % (group[0].description)
             )
+    downloaded = {}
+    synced = []
+    try:
+        for acct in accounts:
+            results = None
+            group = groups.get(acct)
+            if group is not None:
+                # downloaded along with the first account of its group
+                if id(group) not in downloaded:
+                    downloaded[id(group)] = sync_combined(sync, group, pool, args)
+                results = downloaded[id(group)]
+            if sync_account(sync, acct, ledger, args, matcher, out, results, output):
+                synced.append(acct)
+                if out is None:
+                    sync.mark_processed(acct)
+    finally:
+        pool.close()
+    if out is not None:
+        items = out
+        failed = []
+        if args.merge_by_date:
+            from ledgerautosync.ordering import merge_by_date
+
+            items = merge_by_date(
+                [account_items(acct, stream, failed) for (acct, stream) in out]
+            )
+        if args.pair_transfers is not None:
+            items = list(items)
+            with profiling.span("pair_transfers"):
+                paired = pair_transfers(items, args.pair_transfers)
+            metrics.inc("transfers_paired", len(items) - len(paired))
+            items = paired
+        for item in items:
+            print_item(item, args, output)
+        for acct in synced:
+            if acct not in failed:
+                sync.mark_processed(acct)
+
+
+def sync_combined(sync, accts, pool, args):
+    """Download the accounts accts, which are at one institution, with
+    combined requests (in windows, with --backfill). Return the results
+    of OfxSynchronizer.get_new_txns_combined, or None if the server did
+    not accept them."""
+    try:
+        if args.backfill is not None:
+            return sync.backfill(
+                accts, pool, args.backfill, max_days=args.max, jobs=args.jobs
+            )
+        return sync.get_new_txns_combined(
+            accts, pool, resync=args.resync, max_days=args.max
+        )
+    except KeyboardInterrupt:
+        raise
+    except BaseException:
+        sys.stderr.write(
+            "Combined request to %s failed, downloading accounts separately\n"
+            % (accts[0].institution.description)
+        )
+        logging.debug(traceback.format_exc())
+        return None
+
+
+def sync_account(
+    sync, acct, ledger, args, matcher=None, out=None, results=None, output=None
+):
+    """Convert the new transactions of acct, downloading them unless
+    results (from sync_combined) has them. Return True on success."""
+    try:
+        if results is not None:
+            (ofx, account, txns) = results[acct]
         else:
-            accountname = UNKNOWN_BANK_ACCOUNT
-
-    # build SecurityList (including indexing by CUSIP and ticker symbol)
-    security_list = SecurityList(ofx)
-
-    converter = make_ofx_converter(
-        account=ofx.account,
-        name=accountname,
-        ledger=ledger,
-        indent=args.indent,
-        fid=args.fid,
-        unknownaccount=args.unknownaccount,
-        payee_format=args.payee_format,
+            with metrics.labels(account=acct.description):
+                (ofx, txns) = sync.get_new_txns(
+                    acct, resync=args.resync, max_days=args.max
+                )
+            account = ofx.account if ofx is not None else None
+        if ofx is not None:
+            converter = make_ofx_converter(
+                account=account,
+                name=acct.description,
+                ledger=ledger,
+                indent=args.indent,
+                fid=None,
+                unknownaccount=args.unknownaccount,
+                payee_format=args.payee_format,
+                hardcodeaccount=None,
+                shortenaccount=args.shortenaccount,
+                security_list=SecurityList(ofx, sync.securities),
+                date_format=args.date_format,
+                infer_account=args.infer_account,
+            )
+            if args.merge_by_date:
+                from ledgerautosync.ordering import in_date_order
+
+                with metrics.labels(account=acct.description):
+                    items = in_date_order(
+                        *output_items(converter, account, ledger, txns, args, matcher)
+                    )
+                out.append((acct, items))
+            else:
+                with metrics.labels(account=acct.description):
+                    print_results(
+                        converter, account, ledger, txns, args, matcher, out, output
+                    )
+        return True
+    except KeyboardInterrupt:
+        raise
+    except BaseException:
+        report_error(acct)
+        return False
+
+
+def report_error(acct):
+    metrics.inc("errors", account=acct.description)
+    sys.stderr.write("Caught exception processing %s\n" % (acct.description))
+    traceback.print_exc(file=sys.stderr)
+
+
+def import_ofx(
+    ledger,
+    args,
+    index=None,
+    prefilter=None,
+    matcher=None,
+    archive=None,
+    source=None,
+    batch_ids=None,
+    output=None,
+    securities=None,
+):
+    """Import the OFX file args.PATH, or the binary file source if given."""
+    sync = OfxSynchronizer(
+        ledger,
         hardcodeaccount=args.hardcodeaccount,
         shortenaccount=args.shortenaccount,
-        security_list=security_list,
-        date_format=args.date_format,
-        infer_account=args.infer_account,
+        date_slack=args.dedup_window,
+        index=index,
+        prefilter=prefilter,
+        archive=archive,
+        batch_ids=batch_ids,
+        securities=securities,
     )
-    print_results(converter, ofx, ledger, txns, args)
+    ofx = sync.load_file(source or args.PATH, args.account)
+    several = len(ofx.accounts) > 1
+
+    def process(account):
+        txns = sync.filter(account.statement.transactions, account.account_id)
+        converter = make_ofx_converter(
+            account=account,
+            name=ofx_account_name(account, args.account, several),
+            ledger=ledger,
+            indent=args.indent,
+            fid=args.fid,
+            unknownaccount=args.unknownaccount,
+            payee_format=args.payee_format,
+            hardcodeaccount=args.hardcodeaccount,
+            shortenaccount=args.shortenaccount,
+            # build SecurityList (including indexing by CUSIP and ticker
+            # symbol); the file's securities are shared by its statements
+            security_list=SecurityList(ofx, sync.securities),
+            date_format=args.date_format,
+            infer_account=args.infer_account,
+        )
+        if args.merge_by_date:
+            from ledgerautosync.ordering import in_date_order
+
+            return list(
+                in_date_order(
+                    *output_items(converter, account, ledger, txns, args, matcher)
+                )
+            )
+        out = []
+        print_results(converter, account, ledger, txns, args, matcher, out)
+        return out
+
+    def process_labelled(account):
+        with metrics.labels(account=account.account_id):
+            return process(account)
+
+    # Statements are processed concurrently, but printed in file order
+    outs = map_ordered(
+        process_labelled if several else process, ofx.accounts, args.jobs
+    )
+    if args.merge_by_date:
+        from ledgerautosync.ordering import merge_by_date
+
+        outs = [merge_by_date([iter(out) for out in outs])]
+    for out in outs:
+        for item in out:
+            print_item(item, args, output, batch_ids)
+
+
+def ofx_account_name(account, accountname=None, several=False):
+    """Return the ledger account name for the OFX account. With several
+    accounts in one file, a name given with -a is used as a prefix."""
+    if accountname is not None:
+        if several:
+            return "%s:%s" % (accountname, account.account_id)
+        return accountname
+    if account.institution is not None:
+        return "%s:%s" % (account.institution.organization, account.account_id)
+    return UNKNOWN_BANK_ACCOUNT
+
+
+def import_file(
+    ledger,
+    path,
+    args,
+    index=None,
+    prefilter=None,
+    matcher=None,
+    archive=None,
+    registry=None,
+    batch_ids=None,
+    output=None,
+    checkpoint=None,
+    securities=None,
+):
+    """Import the OFX and CSV files in path (see inputs.open_inputs),
+    unless registry shows that it was imported before. Of a CSV file that
+    was appended to since, only the new rows are imported.
+
+    If checkpoint is given, record the phases of the import in it, and
+    skip the phases it shows were completed (see checkpoint.Checkpoint)."""
+    phase = None
+    if checkpoint is not None:
+        phase = checkpoint.phase(path)
+        if phase == "done":
+            sys.stderr.write("Skipping %s: imported before the interruption\n" % (path))
+            metrics.inc("files_skipped", file=path)
+            return
+    state = None
+    offset = 0
+    if registry is not None and path != "-":
+        state = registry.lookup(path)
+        if state.imported and not args.force:
+            sys.stderr.write("Skipping %s: already imported\n" % (path))
+            metrics.inc("files_skipped", file=path)
+            return
+        if not args.force:
+            offset = state.offset
+    if phase != "output":
+        # a file cut short is imported again: the ids it output (see
+        # Checkpoint.ids) keep it from being output twice
+        import_inputs(
+            ledger,
+            path,
+            args,
+            index,
+            prefilter,
+            matcher,
+            archive,
+            offset,
+            batch_ids,
+            output,
+            checkpoint,
+            securities,
+        )
+    if state is not None:
+        registry.record(state)
+    if checkpoint is not None:
+        checkpoint.done(path)
+
+
+def import_inputs(
+    ledger,
+    path,
+    args,
+    index=None,
+    prefilter=None,
+    matcher=None,
+    archive=None,
+    offset=0,
+    batch_ids=None,
+    output=None,
+    checkpoint=None,
+    securities=None,
+):
+    """Import the files in path (see import_file), starting at byte
+    offset of a CSV file."""
+    if checkpoint is not None:
+        checkpoint.start(path, output_position(output))
+        before = set(batch_ids)
+    for source in open_inputs(path):
+        # the import functions take the name of the file as args.PATH
+        file_args = argparse.Namespace(**dict(vars(args), PATH=source.name))
+        if source.path is None:
+            # compressed, in a zip file or standard input: no resuming
+            offset = 0
+        with metrics.labels(file=source.name):
+            if source.format == "csv":
+                import_csv(
+                    ledger,
+                    file_args,
+                    index,
+                    prefilter,
+                    matcher,
+                    archive,
+                    offset,
+                    source.path or source.f,
+                    batch_ids,
+                    output,
+                )
+            else:
+                import_ofx(
+                    ledger,
+                    file_args,
+                    index,
+                    prefilter,
+                    matcher,
+                    archive,
+                    source.path or source.f,
+                    batch_ids,
+                    output,
+                    securities,
+                )
+    if checkpoint is not None:
+        checkpoint.output(path, batch_ids - before, output_position(output))
 
 
-def import_csv(ledger, args):
+def import_csv(
+    ledger,
+    args,
+    index=None,
+    prefilter=None,
+    matcher=None,
+    archive=None,
+    offset=0,
+    source=None,
+    batch_ids=None,
+    output=None,
+):
+    """Import the CSV file args.PATH, or source (a path or a binary file)
+    if given, starting at byte offset."""
     if args.account is None:
         raise Exception("When importing a CSV file, you must specify an account name.")
     sync = CsvSynchronizer(
-        ledger, payee_format=args.payee_format, date_format=args.date_format
-    )
-    txns = sync.parse_file(
-        args.PATH, accountname=args.account, unknownaccount=args.unknownaccount
+        ledger,
+        payee_format=args.payee_format,
+        date_format=args.date_format,
+        date_slack=args.dedup_window,
+        index=index,
+        prefilter=prefilter,
+        archive=archive,
+        batch_ids=batch_ids,
+        processes=args.csv_processes,
+        # the fuzzy matcher needs transactions rather than text
+        fmt=None if matcher is not None else (args.indent, args.assertions),
     )
+    source = source or args.PATH
+    if hasattr(source, "read"):
+        source = io.TextIOWrapper(source)
+    try:
+        txns = sync.parse_file(
+            source,
+            accountname=args.account,
+            unknownaccount=args.unknownaccount,
+            offset=offset,
+        )
+    finally:
+        if hasattr(source, "detach"):
+            # leave the binary file open for whoever opened it
+            source.detach()
     if args.reverse:
         txns = reversed(txns)
-    for txn in txns:
-        if txn is not None:
-            print(txn.format(args.indent, args.assertions))
+    with profiling.span("format"):
+        for txn in txns:
+            txn = check_fuzzy(matcher, txn, args)
+            if txn is None:
+                continue
+            text = txn
+            if isinstance(txn, Transaction):
+                text = txn.format(args.indent, args.assertions)
+            if output is None or not output.write(text, txn):
+                print(text)
+            record_output(batch_ids, text)
+
+
+def reconvert(ledger, args, archive, securities=None):
+    """Print the archived transactions dated on or after --since,
+    converted again with the current options, rules and plugins, and
+    securities (a securities.SecurityMaster) if given. Nothing is
+    downloaded and there is no deduplication."""
+    # statement id -> CSV converter, or for OFX statements a dict of
+    # ofxid -> (converter, transaction)
+    converters = {}
+    for statement, key, id, row in archive.transactions(args.since, args.account):
+        if statement.id not in converters:
+            if statement.format == "ofx":
+                from ofxparse import OfxParser
+
+                with profiling.span("parse"):
+                    ofx = OfxParser.parse(io.BytesIO(statement.data))
+                several = len(ofx.accounts) > 1
+                converters[statement.id] = {}
+                for account in ofx.accounts:
+                    converter = make_ofx_converter(
+                        account=account,
+                        name=statement.names.get(account.account_id)
+                        or ofx_account_name(account, statement.name, several),
+                        ledger=ledger,
+                        indent=args.indent,
+                        fid=args.fid,
+                        unknownaccount=args.unknownaccount,
+                        payee_format=args.payee_format,
+                        hardcodeaccount=args.hardcodeaccount,
+                        shortenaccount=args.shortenaccount,
+                        security_list=SecurityList(ofx, securities),
+                        date_format=args.date_format,
+                        infer_account=args.infer_account,
+                    )
+                    for txn in account.statement.transactions:
+                        converters[statement.id][
+                            "%s.%s" % (account.account_id, txn.id)
+                        ] = (converter, txn)
+            else:
+                converters[statement.id] = CsvConverter.make_converter(
+                    set(statement.fieldnames),
+                    statement.dialect,
+                    ledger=ledger,
+                    name=statement.name,
+                    unknownaccount=args.unknownaccount,
+                    payee_format=args.payee_format,
+                    date_format=args.date_format,
+                )
+        if row is None:
+            converter, row = converters[statement.id][id]
+        else:
+            converter = converters[statement.id]
+        with profiling.span("convert"):
+            converted = converter.convert(row)
+        if converted:
+            print_item(converted, args)
+
+
+def load_rules(path):
+    """Return the (regex, account) rules in the file at path."""
+    rules = []
+    with open(path) as f:
+        for line in f:
+            regex, account = line.strip().split("\t")
+            rules.append((re.compile(regex, re.IGNORECASE), account))
+    return rules
+
+
+def recategorize(ledger_file, args):
+    from ledgerautosync.recategorize import (
+        DEFAULT_FALLBACK_ACCOUNTS,
+        apply_changes,
+        find_changes,
+    )
+
+    rules = []
+    if args.rules and os.path.exists(args.rules):
+        rules = load_rules(args.rules)
+    fallback = DEFAULT_FALLBACK_ACCOUNTS
+    if args.unknownaccount is not None:
+        fallback = fallback + (args.unknownaccount,)
+    changes = find_changes(ledger_file, rules, fallback)
+    for change in changes:
+        sys.stderr.write("%s\n" % (change.describe()))
+    metrics.gauge("postings_recategorized", len(changes))
+    if not args.dry_run:
+        apply_changes(changes)
+
+
+def migrate(ledger_file, args):
+    from ledgerautosync.migrate import MoveIdTag, RenameAccount, ReplaceInIds
+    from ledgerautosync.migrate import migrate as migrate_journal
+
+    rules = [ReplaceInIds(old, new) for (old, new) in args.replace_id]
+    rules.extend(RenameAccount(old, new) for (old, new) in args.rename_account)
+    if args.fix_ofxid:
+        rules.append(MoveIdTag())
+    if not rules:
+        raise LedgerAutosyncException(
+            "migrate needs --replace-id, --rename-account or --fix-ofxid"
+        )
+    index = None
+    if args.index or args.bloom_fp_rate is not None:
+        from ledgerautosync.index import IdIndex
+
+        index = IdIndex(ledger_file, fp_rate=args.bloom_fp_rate)
+        index.update()
+    migration = migrate_journal(ledger_file, rules, index)
+    if index is not None:
+        index.close()
+    metrics.gauge("transactions_migrated", migration.changed)
+    sys.stderr.write(
+        "Rewrote %d transactions in %d files\n"
+        % (migration.changed, len(migration.paths))
+    )
 
 
 def load_plugins(config_dir):
@@ -242,11 +849,43 @@ def load_plugins(config_dir):
             spec.loader.exec_module(module)
 
 
+def parse_date_arg(s):
+    try:
+        return datetime.datetime.strptime(s, "%Y-%m-%d").date()
+    except ValueError:
+        raise argparse.ArgumentTypeError("invalid date: %s" % (s))
+
+
+def parse_rate_arg(s):
+    try:
+        rate = float(s)
+    except ValueError:
+        rate = None
+    if rate is None or not 0 < rate < 1:
+        raise argparse.ArgumentTypeError("invalid rate, not between 0 and 1: %s" % (s))
+    return rate
+
+
+COMMANDS = ("reconvert", "recategorize", "migrate")
+
+
 def run(args=None, config=None):
     if args is None:
         args = sys.argv[1:]
+    command = None
+    if len(args) > 0 and args[0] in COMMANDS:
+        command = args[0]
+        args = args[1:]
 
-    parser = argparse.ArgumentParser(description="Synchronize ledger.")
+    parser = argparse.ArgumentParser(
+        description="Synchronize ledger.",
+        epilog="Run `%(prog)s reconvert [--since DATE]` to convert the \
+transactions in the archive again instead of syncing. Run `%(prog)s \
+recategorize [--dry-run]` to move postings out of Expenses:Misc (and the \
+--unknown-account) according to the current rules and payees. Run \
+`%(prog)s migrate` with --replace-id, --rename-account or --fix-ofxid to \
+rewrite the transactions in your ledger file.",
+    )
     parser.add_argument(
         "-m", "--max", type=int, default=90, help="maximum number of days to process"
     )
@@ -259,9 +898,9 @@ def run(args=None, config=None):
     )
     parser.add_argument(
         "PATH",
-        nargs="?",
-        help="do not sync; import from OFX \
-file",
+        nargs="*",
+        help="do not sync; import from these OFX or CSV files (which may be \
+compressed or in zip files), or - for standard input",
     )
     parser.add_argument(
         "-a",
@@ -413,11 +1052,268 @@ transactions",
         default=True,
         help="disable inference of offset account from payee",
     )
+    parser.add_argument(
+        "--dedup-window",
+        type=int,
+        default=None,
+        dest="dedup_window",
+        metavar="DAYS",
+        help="only look for duplicates among ledger transactions dated \
+within DAYS of the imported transactions",
+    )
+    parser.add_argument(
+        "--index",
+        action="store_true",
+        default=False,
+        help="look up ofxid and csvid tags in an on-disk index of the ledger \
+file, updated incrementally, instead of querying ledger",
+    )
+    parser.add_argument(
+        "--bloom-fp-rate",
+        type=parse_rate_arg,
+        default=None,
+        dest="bloom_fp_rate",
+        metavar="RATE",
+        help="keep a Bloom filter of ofxid and csvid tags with this false \
+positive rate, between 0 and 1 (e.g. 0.01), and skip looking up ids it \
+rules out",
+    )
+    parser.add_argument(
+        "--fuzzy-duplicates",
+        choices=["annotate", "suppress"],
+        default=None,
+        dest="fuzzy_duplicates",
+        help="look for ledger transactions without an ofxid or csvid tag that \
+have the same account and amount as an imported transaction and a date \
+within --fuzzy-days of it; report them, and either tag the imported \
+transaction with possible_duplicate or do not print it",
+    )
+    parser.add_argument(
+        "--fuzzy-days",
+        type=int,
+        default=3,
+        dest="fuzzy_days",
+        metavar="DAYS",
+        help="with --fuzzy-duplicates, how many days apart a transaction and \
+its possible duplicate may be (default 3)",
+    )
+    parser.add_argument(
+        "--pair-transfers",
+        type=int,
+        default=None,
+        dest="pair_transfers",
+        metavar="DAYS",
+        help="when syncing several accounts, merge transactions in different \
+accounts with opposite amounts dated within DAYS of each other into a \
+single transfer",
+    )
+    parser.add_argument(
+        "--archive",
+        nargs="?",
+        const=os.path.join(data_dir(), "archive.sqlite"),
+        default=None,
+        metavar="FILE",
+        help="keep the downloaded or imported statements in this SQLite \
+database (default: %s) so that reconvert can convert them again"
+        % (os.path.join(data_dir(), "archive.sqlite").replace("%", "%%")),
+    )
+    parser.add_argument(
+        "--registry",
+        nargs="?",
+        const=os.path.join(data_dir(), "imported.json"),
+        default=None,
+        metavar="FILE",
+        help="skip input files recorded in this registry (default: %s) as \
+imported, and record the files imported; of CSV files appended to since, only \
+import the new rows" % (os.path.join(data_dir(), "imported.json").replace("%", "%%")),
+    )
+    parser.add_argument(
+        "--force",
+        action="store_true",
+        default=False,
+        help="with --registry, import files even if they were imported before",
+    )
+    parser.add_argument(
+        "--security-master",
+        nargs="?",
+        const=os.path.join(data_dir(), "securities.json"),
+        default=None,
+        dest="security_master",
+        metavar="FILE",
+        help="remember the ticker symbols of securities listed in any OFX \
+statement in this file (default: %s) to convert statements that leave them \
+out, and print only the prices that the ledger does not have yet"
+        % (os.path.join(data_dir(), "securities.json").replace("%", "%%")),
+    )
+    parser.add_argument(
+        "--checkpoint",
+        nargs="?",
+        const=os.path.join(data_dir(), "checkpoint.jsonl"),
+        default=None,
+        metavar="FILE",
+        help="record the progress of importing the files given in this \
+checkpoint (default: %s), so that an interrupted run can be resumed"
+        % (os.path.join(data_dir(), "checkpoint.jsonl").replace("%", "%%")),
+    )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        default=False,
+        help="continue an interrupted run importing the same files from its \
+checkpoint",
+    )
+    parser.add_argument(
+        "--since",
+        type=parse_date_arg,
+        default=None,
+        metavar="DATE",
+        help="with reconvert, only convert transactions dated on or after \
+DATE (YYYY-MM-DD)",
+    )
+    parser.add_argument(
+        "--dry-run",
+        action="store_true",
+        default=False,
+        dest="dry_run",
+        help="with recategorize, only report the changes",
+    )
+    parser.add_argument(
+        "--replace-id",
+        nargs=2,
+        action="append",
+        default=[],
+        dest="replace_id",
+        metavar=("OLD", "NEW"),
+        help="with migrate, replace OLD by NEW in ofxid and csvid tags (may \
+be repeated)",
+    )
+    parser.add_argument(
+        "--rename-account",
+        nargs=2,
+        action="append",
+        default=[],
+        dest="rename_account",
+        metavar=("OLD", "NEW"),
+        help="with migrate, rename account OLD and its subaccounts to NEW \
+(may be repeated)",
+    )
+    parser.add_argument(
+        "--fix-ofxid",
+        action="store_true",
+        default=False,
+        dest="fix_ofxid",
+        help="with migrate, move ofxid tags from the transaction to its \
+first posting, as fix_ofxid.py does",
+    )
+    parser.add_argument(
+        "--backfill",
+        type=int,
+        default=None,
+        metavar="DAYS",
+        help="download all of the last --max days (default 90; a longer \
+window is cut to that) in windows of DAYS days, up to --jobs windows at \
+once, e.g. when adding an account; only bank, credit card and brokerage \
+accounts can be backfilled, others are downloaded as usual",
+    )
+    parser.add_argument(
+        "--cache-ttl",
+        type=int,
+        default=None,
+        dest="cache_ttl",
+        metavar="SECONDS",
+        help="keep downloaded statements in %s for SECONDS seconds, and skip \
+statements identical to the last one converted"
+        % (os.path.join(cache_dir(), "statements").replace("%", "%%")),
+    )
+    parser.add_argument(
+        "--combine",
+        action="store_true",
+        default=False,
+        help="download the accounts at one institution with a single \
+request, instead of one request per account",
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=4,
+        metavar="N",
+        help="process up to N accounts at once (default 4)",
+    )
+    parser.add_argument(
+        "--merge-by-date",
+        action="store_true",
+        default=False,
+        help="print the transactions of all accounts in date order, rather \
+than account by account",
+    )
+    parser.add_argument(
+        "--shard-dir",
+        metavar="DIR",
+        help="write transactions to DIR/ACCOUNT/YEAR.ledger instead of \
+printing them, and include these files from DIR/manifest.ledger",
+    )
+    parser.add_argument(
+        "--insert-into",
+        metavar="FILE",
+        help="insert transactions into the journal FILE, each after the \
+last transaction dated on or before it, instead of printing them",
+    )
+    parser.add_argument(
+        "--csv-processes",
+        type=int,
+        metavar="N",
+        help="convert the rows of a large CSV file in N processes",
+    )
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        default=False,
+        help="print per-phase timings and backend call counts to stderr",
+    )
+    parser.add_argument(
+        "--profile-output",
+        type=str,
+        default=None,
+        dest="profile_output",
+        help="like --profile, and also write profiling data to this file: \
+JSON if it ends in .json, otherwise cProfile stats",
+    )
+    parser.add_argument(
+        "--metrics-file",
+        type=str,
+        default=None,
+        dest="metrics_file",
+        help="write run metrics to this file: JSON if it ends in .json, \
+otherwise in the Prometheus textfile format",
+    )
     args = parser.parse_args(args)
+    args.command = command
     if sys.argv[0][-16:] == "hledger-autosync":
         args.hledger = True
 
+    if args.profile or args.profile_output is not None:
+        profiling.start(args.profile_output)
+    if args.metrics_file:
+        metrics.start()
+    try:
+        with profiling.span("total"):
+            run_with_args(args, config)
+    finally:
+        profiling.stop(sys.stderr, args.profile_output)
+        if args.metrics_file:
+            metrics.stop(args.metrics_file)
+
+
+def run_with_args(args, config=None):
+
     ledger_file = None
+    if args.shard_dir is not None and args.insert_into is not None:
+        raise LedgerAutosyncException(
+            "You cannot specify both --shard-dir and --insert-into"
+        )
+    if args.resume and not args.PATH:
+        raise LedgerAutosyncException("--resume needs the files of the interrupted run")
     if args.ledger and args.no_ledger:
         raise LedgerAutosyncException("You cannot specify a ledger file and -L")
     elif args.ledger:
@@ -427,6 +1323,15 @@ transactions",
     if args.debug:
         logging.basicConfig(level=logging.DEBUG)
 
+    if args.command in ("recategorize", "migrate"):
+        if ledger_file is None or args.no_ledger:
+            raise LedgerAutosyncException("%s needs a ledger file" % (args.command))
+        if args.command == "recategorize":
+            recategorize(ledger_file, args)
+        else:
+            migrate(ledger_file, args)
+        return
+
     if ledger_file is None:
         sys.stderr.write(
             "LEDGER_FILE environment variable not set, and no \
@@ -455,38 +1360,148 @@ All transactions will be printed!\n"
             sys.stderr.write("ledger.so (python)\n")
         exit()
 
+    index = None
+    prefilter = None
+    if (args.index or args.bloom_fp_rate is not None) and ledger is not None:
+        from ledgerautosync.index import IdIndex
+
+        id_index = IdIndex(ledger_file, fp_rate=args.bloom_fp_rate)
+        id_index.update()
+        if args.index:
+            # the index consults its Bloom filter itself
+            index = id_index
+        else:
+            prefilter = id_index
+
+    matcher = None
+    if args.fuzzy_duplicates and ledger_file is not None and not args.no_ledger:
+        from ledgerautosync.fuzzy import FuzzyMatcher
+
+        matcher = FuzzyMatcher(ledger_file, days=args.fuzzy_days)
+
     config_dir = os.environ.get(
         "XDG_CONFIG_HOME", os.path.join(os.path.expanduser("~"), ".config")
     )
 
     if args.rules and os.path.exists(args.rules):
-        with open(args.rules) as f:
-            for line in f:
-                regex, account = line.strip().split("\t")
-                ledger.add_rule(re.compile(regex, re.IGNORECASE), account)
+        for regex, account in load_rules(args.rules):
+            ledger.add_rule(regex, account)
 
     load_plugins(config_dir)
 
-    if args.PATH is None:
-        if config is None:
-            if args.ofxconfig is None:
-                config_file = os.path.join(config_dir, "ofxclient.ini")
-            else:
-                config_file = args.ofxconfig
-            if os.path.exists(config_file):
-                config = OfxConfig(file_name=config_file)
-            else:
-                config = OfxConfig()
-        accounts = config.accounts()
-        if args.account:
-            accounts = [acct for acct in accounts if acct.description == args.account]
-        sync(ledger, accounts, args)
-    else:
-        _, file_extension = os.path.splitext(args.PATH.lower())
-        if file_extension == ".csv":
-            import_csv(ledger, args)
+    securities = None
+    if args.security_master is not None:
+        from ledgerautosync.securities import PriceIndex, SecurityMaster
+
+        securities = SecurityMaster(args.security_master)
+        if ledger is not None:
+            # print only the prices that the journal lacks
+            securities.prices = PriceIndex(ledger_file)
+            securities.prices.update()
+
+    archive = None
+    if args.command == "reconvert":
+        from ledgerautosync.archive import Archive
+
+        path = args.archive or os.path.join(data_dir(), "archive.sqlite")
+        if not os.path.exists(path):
+            raise LedgerAutosyncException("No archive found at %s" % (path))
+        archive = Archive(path)
+        try:
+            reconvert(ledger, args, archive, securities)
+        finally:
+            archive.close()
+            if securities is not None:
+                securities.save()
+        return
+    elif args.archive is not None:
+        from ledgerautosync.archive import Archive
+
+        archive = Archive(args.archive)
+
+    # where to write transactions instead of printing them
+    output = None
+    checkpoint = None
+    if args.shard_dir is not None:
+        from ledgerautosync.shards import ShardedJournal
+
+        output = ShardedJournal(args.shard_dir)
+    elif args.insert_into is not None:
+        from ledgerautosync.offsets import DatedInserter
+
+        output = DatedInserter(args.insert_into)
+    try:
+        if not args.PATH:
+            if config is None:
+                # ofxclient brings in its HTTP and keyring stack; only load it
+                # when we are actually going to talk to a bank.
+                from ofxclient.config import OfxConfig
+
+                if args.ofxconfig is None:
+                    config_file = os.path.join(config_dir, "ofxclient.ini")
+                else:
+                    config_file = args.ofxconfig
+                if os.path.exists(config_file):
+                    config = OfxConfig(file_name=config_file)
+                else:
+                    config = OfxConfig()
+            accounts = config.accounts()
+            if args.account:
+                accounts = [
+                    acct for acct in accounts if acct.description == args.account
+                ]
+            sync(
+                ledger,
+                accounts,
+                args,
+                index,
+                prefilter,
+                matcher,
+                archive,
+                output,
+                securities,
+            )
         else:
-            import_ofx(ledger, args)
+            registry = None
+            if args.registry is not None:
+                from ledgerautosync.registry import ImportRegistry
+
+                registry = ImportRegistry(args.registry)
+            # ids output so far, so that transactions in several of the files
+            # (e.g. overlapping exports in one zip file) are output once
+            batch_ids = set()
+            if args.checkpoint is not None or args.resume:
+                from ledgerautosync.checkpoint import Checkpoint
+
+                checkpoint = Checkpoint(
+                    args.checkpoint or os.path.join(data_dir(), "checkpoint.jsonl"),
+                    args.PATH,
+                    args.resume,
+                )
+                if args.resume:
+                    batch_ids = checkpoint.ids(ledger_file)
+            for path in args.PATH:
+                import_file(
+                    ledger,
+                    path,
+                    args,
+                    index,
+                    prefilter,
+                    matcher,
+                    archive,
+                    registry,
+                    batch_ids,
+                    output,
+                    checkpoint,
+                    securities,
+                )
+    finally:
+        if checkpoint is not None:
+            checkpoint.close()
+        if securities is not None:
+            securities.save()
+        if output is not None:
+            output.close()
 
 
 if __name__ == "__main__":
@@ -23,16 +23,28 @@ import hashlib
 import re
 from decimal import Decimal
 
-from ofxparse.ofxparse import InvestmentTransaction
-from ofxparse.ofxparse import Transaction as OfxTransaction
-
-from ledgerautosync import EmptyInstitutionException
+from ledgerautosync import EmptyInstitutionException, metrics
 
 AUTOSYNC_INITIAL = "autosync_initial"
 ALL_AUTOSYNC_INITIAL = "all.%s" % (AUTOSYNC_INITIAL)
 UNKNOWN_BANK_ACCOUNT = "Assets:Unknown"
 
 
+def __getattr__(name):
+    # ofxparse pulls in BeautifulSoup and lxml, which dominate startup
+    # time. Only import it once something (e.g. a plugin) asks for the
+    # OFX transaction classes, so that CSV imports never pay for it.
+    if name == "InvestmentTransaction":
+        from ofxparse.ofxparse import InvestmentTransaction
+
+        return InvestmentTransaction
+    elif name == "OfxTransaction":
+        from ofxparse.ofxparse import Transaction as OfxTransaction
+
+        return OfxTransaction
+    raise AttributeError("module %r has no attribute %r" % (__name__, name))
+
+
 class EasyEquality(object):
     def __eq__(self, other):
         if isinstance(other, self.__class__):
@@ -57,11 +69,16 @@ class SecurityList(object):
     provides __next__() for Py3
     """
 
-    def __init__(self, ofx):
+    def __init__(self, ofx, master=None):
         securities = []
         if hasattr(ofx, "security_list") and ofx.security_list is not None:
             securities = ofx.security_list
 
+        # the securities.SecurityMaster of securities in other statements
+        self.master = master
+        if master is not None:
+            master.learn(securities)
+
         self.cusip_lut = dict()
         self.ticker_lut = dict()
 
@@ -275,8 +292,10 @@ class Converter(object):
         else:
             account = self.lgr.get_account_by_payee(payee, exclude)
             if account is None:
+                metrics.inc("payee_inference", result="fallback")
                 return self.unknownaccount or "Expenses:Misc"
             else:
+                metrics.inc("payee_inference", result="hit")
                 return account
 
 
@@ -436,11 +455,14 @@ class OfxConverter(Converter):
             return ""
 
     # Return the ticker symbol of the security with CUSIP, if it exists in the
-    # security_list mapping. Otherwise, simply return the CUSIP.
+    # security_list mapping or its security master. Otherwise, simply return
+    # the CUSIP.
     def maybe_get_ticker(self, cusip):
         security = self.security_list.find_cusip(cusip)
         if security and security.ticker:
             return security.ticker
+        elif self.security_list.master is not None:
+            return self.security_list.master.ticker(cusip) or cusip
         else:
             return cusip
 
@@ -448,6 +470,8 @@ class OfxConverter(Converter):
         """
         Convert an OFX Transaction to a Transaction
         """
+        from ofxparse.ofxparse import InvestmentTransaction
+        from ofxparse.ofxparse import Transaction as OfxTransaction
 
         ofxid = self.mk_ofxid(txn.id)
         metadata = {}
@@ -613,6 +637,12 @@ class OfxConverter(Converter):
 
 
 class CsvConverter(Converter):
+    # Whether the rows of a large file can be converted in several
+    # processes, each with a converter of its own that has no ledger (so
+    # no account or payee is inferred from it) and sees only some of the
+    # rows. A converter may set this to True if it needs neither.
+    PARALLEL = False
+
     @staticmethod
     def make_converter(fieldset, dialect, name=None, **kwargs):
         for klass in CsvConverter.descendants():
@@ -636,6 +666,11 @@ class CsvConverter(Converter):
             h.update(("%s=%s\n" % (key, row[key])).encode("utf-8"))
         return h.hexdigest()
 
+    # Return the date of the transaction in row, used to restrict
+    # duplicate checks to nearby ledger transactions. None if unknown.
+    def get_date(self, row):
+        return None
+
     def __init__(
         self,
         dialect,
@@ -663,6 +698,8 @@ class CsvConverter(Converter):
 
 
 class PaypalConverter(CsvConverter):
+    PARALLEL = True
+
     FIELDSET = {
         "Currency",
         "Date",
@@ -686,6 +723,9 @@ class PaypalConverter(CsvConverter):
     def get_csv_id(self, row):
         return "paypal.%s" % (Converter.clean_id(row["Transaction ID"]))
 
+    def get_date(self, row):
+        return datetime.datetime.strptime(row["Date"], "%m/%d/%Y")
+
     def convert(self, row):
         if (
             (row["Status"] != "Completed")
@@ -719,7 +759,7 @@ class PaypalConverter(CsvConverter):
                     posting.clone_inverted("Expenses:Misc"),
                 ]
             return Transaction(
-                date=datetime.datetime.strptime(row["Date"], "%m/%d/%Y"),
+                date=self.get_date(row),
                 payee=self.format_payee(row),
                 postings=postings,
                 date_format=self.date_format,
@@ -730,6 +770,8 @@ class PaypalConverter(CsvConverter):
 
 
 class PaypalAlternateConverter(CsvConverter):
+    PARALLEL = True
+
     FIELDSET = {"Date", "Name", "Type", "Status", "Amount"}
 
     def __init__(self, *args, **kwargs):
@@ -745,6 +787,9 @@ class PaypalAlternateConverter(CsvConverter):
             Decimal(re.sub(r"\$", "", row["Amount"])), currency, reverse=reverse
         )
 
+    def get_date(self, row):
+        return datetime.datetime.strptime(row["Date"], "%m/%d/%Y")
+
     def convert(self, row):
         if (
             (row["Status"] != "Completed")
@@ -764,7 +809,7 @@ class PaypalAlternateConverter(CsvConverter):
             else:
                 posting2_account = "Expenses:Misc"
             return Transaction(
-                date=datetime.datetime.strptime(row["Date"], "%m/%d/%Y"),
+                date=self.get_date(row),
                 payee=self.format_payee(row),
                 postings=[posting, posting.clone_inverted(posting2_account)],
                 date_format=self.date_format,
@@ -772,6 +817,8 @@ class PaypalAlternateConverter(CsvConverter):
 
 
 class AmazonConverter(CsvConverter):
+    PARALLEL = True
+
     FIELDSET = {"Currency", "Title", "Order Date", "Order ID"}
 
     def __init__(self, *args, **kwargs):
@@ -789,6 +836,9 @@ class AmazonConverter(CsvConverter):
     def get_csv_id(self, row):
         return "amazon.%s" % (Converter.clean_id(row["Order ID"]))
 
+    def get_date(self, row):
+        return datetime.datetime.strptime(row["Order Date"], "%m/%d/%y")
+
     def convert(self, row):
         posting = Posting(
             self.name,
@@ -801,7 +851,7 @@ class AmazonConverter(CsvConverter):
         )
 
         return Transaction(
-            date=datetime.datetime.strptime(row["Order Date"], "%m/%d/%y"),
+            date=self.get_date(row),
             payee=row["Title"],
             postings=[posting, posting.clone_inverted("Expenses:Misc")],
             date_format=self.date_format,
@@ -809,6 +859,8 @@ class AmazonConverter(CsvConverter):
 
 
 class MintConverter(CsvConverter):
+    PARALLEL = True
+
     FIELDSET = {
         "Date",
         "Amount",
@@ -824,6 +876,9 @@ class MintConverter(CsvConverter):
     def mk_amount(self, row, reverse=False):
         return Amount(Decimal(row["Amount"]), "$", reverse=reverse)
 
+    def get_date(self, row):
+        return datetime.datetime.strptime(row["Date"], "%m/%d/%Y")
+
     def convert(self, row):
         account = self.name
         if account is None:
@@ -843,7 +898,7 @@ class MintConverter(CsvConverter):
             ]
 
         return Transaction(
-            date=datetime.datetime.strptime(row["Date"], "%m/%d/%Y"),
+            date=self.get_date(row),
             payee=row["Description"],
             postings=postings,
             date_format=self.date_format,
@@ -852,6 +907,8 @@ class MintConverter(CsvConverter):
 
 # Simple.com
 class SimpleConverter(CsvConverter):
+    PARALLEL = True
+
     FIELDSET = {
         "Date",
         "Recorded at",
@@ -875,6 +932,9 @@ class SimpleConverter(CsvConverter):
     def __init__(self, *args, **kwargs):
         super(SimpleConverter, self).__init__(*args, **kwargs)
 
+    def get_date(self, row):
+        return datetime.datetime.strptime(row["Date"], "%Y/%m/%d")
+
     def convert(self, row):
         amount = abs(float(row["Amount"]))
         reverse = row["Amount"][0] == "-"
@@ -893,7 +953,7 @@ class SimpleConverter(CsvConverter):
             posting_metadata["memo"] = row["Memo"]
 
         return Transaction(
-            date=datetime.datetime.strptime(row["Date"], "%Y/%m/%d"),
+            date=self.get_date(row),
             payee=row["Description"],
             postings=[
                 Posting(
@@ -928,11 +988,20 @@ class VenmoConverter(CsvConverter):
         ]
     )
 
+    # The balance assertion row is dated by the rows before it
+    PARALLEL = False
+
     def __init__(self, *args, **kwargs):
         # Initialize max date to be used for balance assertion
         self.max_date = datetime.datetime.min
         super(VenmoConverter, self).__init__(*args, **kwargs)
 
+    def get_date(self, row):
+        # Statement level rows have no ID and no date
+        if not row["ID"]:
+            return None
+        return datetime.datetime.strptime(row["Datetime"], "%Y-%m-%dT%H:%M:%S")
+
     def convert(self, row):
 
         # Venmo has a hierarchical structure with some rows containing
@@ -981,7 +1050,7 @@ class VenmoConverter(CsvConverter):
                 payee = row["From"]
             else:
                 payee = row["To"]
-        date = datetime.datetime.strptime(row["Datetime"], "%Y-%m-%dT%H:%M:%S")
+        date = self.get_date(row)
         if date > self.max_date:
             self.max_date = date
 
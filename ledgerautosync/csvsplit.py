@@ -0,0 +1,175 @@
+# Copyright (c) 2013-2021 Erik Hetzner
+#
+# This file is part of ledger-autosync
+#
+# ledger-autosync is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# ledger-autosync is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with ledger-autosync. If not, see
+# <http://www.gnu.org/licenses/>.
+
+"""Converting one large CSV file in several processes.
+
+The file is cut into byte ranges that each start at a record, and each
+range is read and converted by a process of its own, with a converter
+of the same class built from the same dialect and header. The results
+come back in the order of the file.
+
+Converted transactions are sent back formatted when possible, as
+unpickling Transaction objects costs about as much as converting them.
+
+A record may span lines when a quoted field contains a newline, so a
+newline only ends a record if it follows an even number of quote
+characters. A quote in the middle of an unquoted field, which the csv
+module reads as an ordinary character, throws this count off.
+"""
+
+import csv
+import io
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+from ledgerautosync.converter import Transaction
+
+# Approximate size of a range, small enough that a process can hold
+# the range it reads in memory
+RANGE_SIZE = 16 * 1024 * 1024
+CHUNK_SIZE = 1024 * 1024
+
+DIALECT_ATTRIBUTES = (
+    "delimiter",
+    "doublequote",
+    "escapechar",
+    "lineterminator",
+    "quotechar",
+    "quoting",
+    "skipinitialspace",
+    "strict",
+)
+
+
+def can_split(dialect):
+    """Return True if the records of a file in dialect can be found by
+    counting quote characters, i.e. no escape character can hide one."""
+    return not dialect.escapechar
+
+
+def split(f, start, quotechar, size=None):
+    """Return the (start, end) byte ranges, of about size bytes each, that
+    cover the binary file f from offset start (the start of a record) to
+    its end. Each range ends after the newline ending a record. If
+    quotechar is None, every newline ends a record."""
+    if size is None:
+        size = RANGE_SIZE
+    quote = quotechar.encode("ascii") if quotechar else None
+    ranges = []
+    range_start = start
+    # offset of the start of chunk; whether it is within a quoted field
+    pos = start
+    quoted = False
+    f.seek(start)
+    while True:
+        chunk = f.read(CHUNK_SIZE)
+        if not chunk:
+            break
+        i = 0
+        while True:
+            newline = chunk.find(b"\n", max(i, range_start + size - pos))
+            if newline < 0:
+                break
+            if quote is not None and chunk.count(quote, i, newline) % 2:
+                quoted = not quoted
+            i = newline + 1
+            if not quoted:
+                ranges.append((range_start, pos + i))
+                range_start = pos + i
+        if quote is not None and chunk.count(quote, i) % 2:
+            quoted = not quoted
+        pos += len(chunk)
+    if range_start < pos:
+        ranges.append((range_start, pos))
+    return ranges
+
+
+def dialect_attributes(dialect):
+    return dict(
+        (name, getattr(dialect, name))
+        for name in DIALECT_ATTRIBUTES
+        if hasattr(dialect, name)
+    )
+
+
+def convert_range(job):
+    """Return a list of (csvid, date, converted, row) for the records in a
+    range of a CSV file. row is None unless the job asks for rows;
+    converted is formatted if the job has the (indent, assertions) to
+    format it with."""
+    path, start, end, klass, attributes, fieldnames, kwargs, fmt, keep_rows = job
+    dialect = type("dialect", (csv.Dialect,), attributes)
+    converter = klass(dialect, **kwargs)
+    with open(path, "rb") as f:
+        f.seek(start)
+        data = f.read(end - start)
+    # decoded like the file is when read by a single process
+    reader = csv.DictReader(
+        io.TextIOWrapper(io.BytesIO(data)), fieldnames=fieldnames, dialect=dialect
+    )
+    retval = []
+    for row in reader:
+        converted = converter.convert(row)
+        if fmt is not None and isinstance(converted, Transaction):
+            converted = converted.format(*fmt)
+        retval.append(
+            (
+                converter.get_csv_id(row),
+                converter.get_date(row),
+                converted,
+                row if keep_rows else None,
+            )
+        )
+    return retval
+
+
+def get_context():
+    """Return the multiprocessing context to convert in, or None if it is
+    not available. Processes are forked so that they have the converter
+    classes of plugins as well."""
+    if "fork" not in multiprocessing.get_all_start_methods():
+        return None
+    return multiprocessing.get_context("fork")
+
+
+def convert(
+    path, ranges, converter, fieldnames, kwargs, processes, fmt=None, keep_rows=False
+):
+    """Yield (csvid, date, converted, row) for each record in ranges of the
+    CSV file at path, converting them in up to processes processes with
+    converters like converter (which must be PARALLEL), built with
+    kwargs."""
+    jobs = [
+        (
+            path,
+            start,
+            end,
+            type(converter),
+            dialect_attributes(converter.dialect),
+            fieldnames,
+            kwargs,
+            fmt,
+            keep_rows,
+        )
+        for (start, end) in ranges
+    ]
+    with ProcessPoolExecutor(
+        max_workers=min(processes, len(jobs)), mp_context=get_context()
+    ) as executor:
+        for records in executor.map(convert_range, jobs):
+            yield from records
@@ -0,0 +1,228 @@
+# Copyright (c) 2013-2021 Erik Hetzner
+#
+# This file is part of ledger-autosync
+#
+# ledger-autosync is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# ledger-autosync is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with ledger-autosync. If not, see
+# <http://www.gnu.org/licenses/>.
+
+
+"""Downloading statements for several accounts at one institution with
+a single OFX request.
+
+ofxclient's Account.download signs on, requests one statement and
+opens a new HTTPS connection every time. Accounts that share an
+institution (and credentials) can instead be asked for in one request
+with a statement request block per account; the response is split back
+per account by its account id. Connections are kept open in a
+ConnectionPool and reused for later requests to the same host.
+"""
+
+import datetime
+import logging
+import threading
+from http.client import HTTPException, HTTPSConnection
+from io import StringIO
+from urllib.parse import urlsplit
+
+# idle connections kept per host
+MAX_IDLE_CONNECTIONS = 4
+
+
+class ConnectionPool(object):
+    """Idle HTTPS connections, kept by host."""
+
+    def __init__(self, timeout=60):
+        self.timeout = timeout
+        self.idle = {}
+        self.lock = threading.Lock()
+
+    def get(self, host):
+        with self.lock:
+            connections = self.idle.get(host)
+            if connections:
+                return (connections.pop(), True)
+        return (HTTPSConnection(host, timeout=self.timeout), False)
+
+    def put(self, host, connection):
+        with self.lock:
+            connections = self.idle.setdefault(host, [])
+            if len(connections) < MAX_IDLE_CONNECTIONS:
+                connections.append(connection)
+                return
+        connection.close()
+
+    def post(self, url, query):
+        """POST the OFX query to url and return the response body. A
+        reused connection the server has since closed is replaced by a
+        new one."""
+        parts = urlsplit(url)
+        host = parts.netloc
+        selector = parts.path or "/"
+        if parts.query:
+            selector = "%s?%s" % (selector, parts.query)
+        while True:
+            connection, reused = self.get(host)
+            try:
+                response = self.request(connection, host, selector, query)
+            except (HTTPException, OSError):
+                connection.close()
+                if not reused:
+                    raise
+                logging.debug("Connection to %s was closed, reconnecting." % (host))
+                continue
+            if response.will_close:
+                connection.close()
+            else:
+                self.put(host, connection)
+            return response.data
+
+    @staticmethod
+    def request(connection, host, selector, query):
+        body = query.encode("ascii", "ignore")
+        if host == "ofx.discovercard.com":
+            # Discover requires a particular ordering of headers (see
+            # ofxclient's Client.post)
+            connection.putrequest(
+                "POST", selector, skip_host=True, skip_accept_encoding=True
+            )
+            connection.putheader("Content-Type", "application/x-ofx")
+            connection.putheader("Host", host)
+            connection.putheader("Content-Length", len(body))
+            connection.putheader("Connection", "Keep-Alive")
+            connection.endheaders(body)
+        else:
+            connection.request(
+                "POST",
+                selector,
+                body,
+                {
+                    "Content-type": "application/x-ofx",
+                    "Accept": "*/*, application/x-ofx",
+                    "User-Agent": "httpclient",
+                },
+            )
+        response = connection.getresponse()
+        response.data = response.read().decode("ascii", "ignore")
+        return response
+
+    def close(self):
+        with self.lock:
+            for connections in self.idle.values():
+                for connection in connections:
+                    connection.close()
+            self.idle = {}
+
+
+def can_combine(acct):
+    """Return True if acct is an ofxclient account whose statement request
+    we know how to build."""
+    from ofxclient.account import BankAccount, BrokerageAccount, CreditCardAccount
+
+    return isinstance(acct, (BankAccount, BrokerageAccount, CreditCardAccount))
+
+
+def institution_key(acct):
+    """Accounts with the same key can be requested together: they are at
+    the same server and share a sign-on."""
+    inst = acct.institution
+    return (inst.url, inst.id, inst.org, inst.username)
+
+
+def group_by_institution(accounts):
+    """Return a list of lists of accounts, one per institution, in the
+    order of the first account of each. Accounts that cannot be combined
+    are in groups of their own."""
+    groups = []
+    by_key = {}
+    for acct in accounts:
+        if not can_combine(acct):
+            groups.append([acct])
+            continue
+        key = institution_key(acct)
+        if key in by_key:
+            by_key[key].append(acct)
+        else:
+            by_key[key] = [acct]
+            groups.append(by_key[key])
+    return groups
+
+
+def statement_request(client, acct, as_of, until=None):
+    """Return (message set, transaction request) for a statement of acct
+    since as_of and, if given, until `until` (both in YYYYMMDD format)."""
+    from ofxclient.account import BankAccount, BrokerageAccount
+    from ofxclient.client import LINE_ENDING, _field
+
+    if isinstance(acct, BankAccount):
+        message = client._bareq(
+            acct.number, as_of, acct.account_type, acct.routing_number
+        )
+    elif isinstance(acct, BrokerageAccount):
+        message = client._invstreq(acct.broker_id, acct.number, as_of)
+    else:
+        message = client._ccreq(acct.number, as_of)
+    if until is not None:
+        dtstart = _field("DTSTART", as_of)
+        message = message.replace(
+            dtstart, LINE_ENDING.join([dtstart, _field("DTEND", until)])
+        )
+    # _bareq and friends wrap the request in its own message set, e.g.
+    # <BANKMSGSRQV1><STMTTRNRQ>...</STMTTRNRQ></BANKMSGSRQV1>. A message
+    # set may only appear once per request, so unwrap it.
+    lines = message.split(LINE_ENDING)
+    return (lines[0][1:-1], LINE_ENDING.join(lines[1:-1]))
+
+
+def combined_query(accts, as_of, until=None):
+    """Return the OFX request for statements of all of accts, which must
+    be at one institution, since as_of and until `until`."""
+    from ofxclient.client import LINE_ENDING, _tag
+
+    client = accts[0].institution.client()
+    message_sets = {}
+    order = []
+    for acct in accts:
+        message_set, request = statement_request(client, acct, as_of, until)
+        if message_set not in message_sets:
+            message_sets[message_set] = []
+            order.append(message_set)
+        message_sets[message_set].append(request)
+    return client.authenticated_query(
+        LINE_ENDING.join(_tag(name, *message_sets[name]) for name in order)
+    )
+
+
+def response_key(accts, days, until_days=None):
+    """Return the statement cache key for a download of accts."""
+    return "%s:%d:%s" % (
+        ",".join(sorted(str(acct.local_id()) for acct in accts)),
+        days,
+        until_days or 0,
+    )
+
+
+def days_ago(days):
+    return (datetime.datetime.now() - datetime.timedelta(days=days)).strftime("%Y%m%d")
+
+
+def download(accts, days, pool, until_days=None):
+    """Download statements of the last `days` days for all of accts, which
+    must be at one institution, in one request. If until_days is given,
+    only download up to that many days ago. Return the response as a
+    file-like object, as Account.download does."""
+    until = None
+    if until_days is not None:
+        until = days_ago(until_days)
+    query = combined_query(accts, days_ago(days), until)
+    return StringIO(pool.post(accts[0].institution.url, query))
@@ -0,0 +1,171 @@
+# Copyright (c) 2013-2021 Erik Hetzner
+#
+# This file is part of ledger-autosync
+#
+# ledger-autosync is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# ledger-autosync is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with ledger-autosync. If not, see
+# <http://www.gnu.org/licenses/>.
+
+"""Find transactions that were entered by hand (or imported by other
+means) and so lack an ofxid or csvid tag.
+
+Postings of untagged journal transactions are put in buckets keyed by
+(account, amount, commodity, date). A new transaction is matched against
+the buckets of its first posting (the account being synced) for each
+date within `days` of it, so a lookup costs the same however long the
+account's history; if there are several entries, the one with the most
+similar payee wins, then the closest date. Each journal entry matches at
+most one new transaction.
+"""
+
+import datetime
+import difflib
+import re
+import threading
+from decimal import Decimal, InvalidOperation
+
+from ledgerautosync import journal, profiling
+
+AMOUNT_RE = re.compile(
+    r"^(-?)\s*([^-\d\s.,()]*)\s*(-?)\s*(\d[\d,]*(?:\.\d+)?)\s*"
+    r'("[^"]*"|[^-\d()+*/"]*)$'
+)
+
+
+def parse_amount(s):
+    """Return (number, commodity) for a ledger amount string such as
+    "-$1,234.50" or "20.00 USD", ignoring any price or balance assertion,
+    or None if it cannot be parsed."""
+    s = re.split(r"[@=]", s, 1)[0].strip()
+    md = AMOUNT_RE.match(s)
+    if md is None:
+        return None
+    try:
+        number = Decimal(md.group(4).replace(",", ""))
+    except InvalidOperation:
+        return None
+    if md.group(1) or md.group(3):
+        number = -number
+    return (number, (md.group(2) or md.group(5)).strip('"'))
+
+
+def entry_amounts(entry):
+    """Return (account, number, commodity) for each posting of entry,
+    inferring an elided amount if there is exactly one."""
+    amounts = []
+    elided = None
+    total = Decimal(0)
+    commodities = set()
+    for account, amount in entry.postings:
+        if amount is None:
+            if elided is not None:
+                return []
+            elided = account
+            continue
+        parsed = parse_amount(amount)
+        if parsed is None:
+            return []
+        amounts.append((account, parsed[0], parsed[1]))
+        total += parsed[0]
+        commodities.add(parsed[1])
+    if elided is not None and len(commodities) == 1:
+        amounts.append((elided, -total, commodities.pop()))
+    return amounts
+
+
+def normalize_payee(payee):
+    return " ".join(re.sub(r"[^a-z0-9]+", " ", (payee or "").lower()).split())
+
+
+def to_date(d):
+    if isinstance(d, datetime.datetime):
+        return d.date()
+    return d
+
+
+class Match(object):
+    def __init__(self, txn, entry, similarity):
+        self.txn = txn
+        self.entry = entry
+        self.similarity = similarity
+
+    def location(self):
+        return "%s:%d" % (self.entry.path, self.entry.line)
+
+    def describe(self):
+        return "%s %s (%s:%d)" % (
+            self.entry.date.strftime("%Y/%m/%d"),
+            self.entry.payee,
+            self.entry.path,
+            self.entry.line,
+        )
+
+
+class FuzzyMatcher(object):
+    def __init__(self, journal_path, days=3, keys=("ofxid", "csvid")):
+        self.days = days
+        # (account, number, commodity, date) -> [entry, ...]
+        self.buckets = {}
+        self.used = set()
+        self.lock = threading.Lock()
+        with profiling.span("fuzzy_index"):
+            for entry in journal.entries(journal_path):
+                if any(key in keys for (key, _) in entry.metadata):
+                    continue
+                for account, number, commodity in entry_amounts(entry):
+                    key = (account, number, commodity, entry.date)
+                    self.buckets.setdefault(key, []).append(entry)
+
+    def match(self, txn):
+        """Return a Match for the converted Transaction txn, or None."""
+        if not txn.postings:
+            return None
+        posting = txn.postings[0]
+        number = posting.amount.number
+        if posting.amount.reverse:
+            number = -number
+        date = to_date(txn.date)
+        candidates = []
+        for days in range(-self.days, self.days + 1):
+            key = (
+                posting.account,
+                number,
+                posting.amount.currency,
+                date + datetime.timedelta(days=days),
+            )
+            candidates.extend(self.buckets.get(key, ()))
+        if not candidates:
+            return None
+        with self.lock:
+            return self.best_match(txn, candidates)
+
+    def best_match(self, txn, candidates):
+        date = to_date(txn.date)
+        payee = normalize_payee(txn.payee)
+        best = None
+        best_score = None
+        for entry in candidates:
+            if id(entry) in self.used:
+                continue
+            distance = abs((entry.date - date).days)
+            similarity = difflib.SequenceMatcher(
+                None, payee, normalize_payee(entry.payee)
+            ).ratio()
+            score = (similarity, -distance)
+            if best_score is None or score > best_score:
+                best = entry
+                best_score = score
+        if best is None:
+            return None
+        self.used.add(id(best))
+        return Match(txn, best, best_score[0])
@@ -0,0 +1,525 @@
+# Copyright (c) 2013-2021 Erik Hetzner
+#
+# This file is part of ledger-autosync
+#
+# ledger-autosync is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# ledger-autosync is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with ledger-autosync. If not, see
+# <http://www.gnu.org/licenses/>.
+
+"""An on-disk index of the ofxid and csvid tags in a journal.
+
+The index is partitioned by month. Each month is an immutable segment:
+a file of sorted 64-bit hashes of "key=value" strings, followed by the
+offsets of the exact strings in a sidecar file. Both are memory-mapped
+and binary searched on lookup, and only the segments overlapping the
+requested date window are opened, so lookups cost the same however long
+the journal is. Optionally, a Bloom filter of every id is kept as
+well; it answers most lookups of ids that are not in the journal without
+touching the segments.
+
+When the journal has only grown since the last run, just the appended
+bytes are scanned and their ids are added to a small head file, which
+is merged into the segments once it reaches HEAD_LIMIT entries. Any
+other change to the journal (or to an included file) rebuilds the
+index.
+"""
+
+import bisect
+import datetime
+import hashlib
+import json
+import logging
+import mmap
+import os
+import shutil
+import tempfile
+import threading
+from array import array
+
+from ledgerautosync import cache_dir, profiling
+from ledgerautosync.bloom import BloomFilter
+from ledgerautosync.converter import Converter
+from ledgerautosync.journal import Entry, Include, scan
+
+VERSION = 2
+KEYS = ("ofxid", "csvid")
+MAGIC = b"LASIDX01"
+HEAD_LIMIT = 4096
+# Bytes before the previous end of a file that must be unchanged for it
+# to be considered appended to
+TAIL_CHECK = 4096
+
+
+def id_hash(s):
+    return int.from_bytes(
+        hashlib.blake2b(s.encode("utf-8"), digest_size=8).digest(), "little"
+    )
+
+
+def id_string(key, value):
+    """Return the indexed string for looking up tag key with value."""
+    return "%s=%s" % (key, Converter.clean_id(value))
+
+
+def id_values(key, value):
+    """Return the values a synchronizer may look up the id value of
+    metadata tag key by.
+
+    Synchronizers look up ofxids without their leading FID, and the csvids
+    of some converters (e.g. Mint's "mint.<hash>") without their prefix;
+    ledger and hledger match tag values as regexps, so this finds the full
+    id. Such ids are given both with and without their first component."""
+    values = [value]
+    if key in KEYS and "." in value:
+        values.append(value.split(".", 1)[1])
+    return values
+
+
+def index_ids(key, value):
+    """Return the strings to index for a metadata tag (see id_values)."""
+    return ["%s=%s" % (key, v) for v in id_values(key, value)]
+
+
+def month(date):
+    return "%04d-%02d" % (date.year, date.month)
+
+
+def months(window):
+    """Return the months overlapping the (begin, end) window, end
+    exclusive, as YYYY-MM strings."""
+    begin, end = window
+    retval = []
+    year, mon = (begin.year, begin.month)
+    while (year, mon) <= (end.year, end.month):
+        retval.append("%04d-%02d" % (year, mon))
+        year, mon = (year + (mon == 12), mon % 12 + 1)
+    return retval
+
+
+class Segment(object):
+    """A memory-mapped month segment."""
+
+    def __init__(self, path):
+        self.path = path
+        with open(path + ".idx", "rb") as f:
+            self.idx_map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        with open(path + ".ids", "rb") as f:
+            self.ids_map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.idx_map[0:8] != MAGIC:
+            raise ValueError("%s.idx is not an index segment" % (path))
+        view = memoryview(self.idx_map)
+        self.count = view[8:16].cast("Q")[0]
+        start = 16 + 8 * self.count
+        self.hashes = view[16:start].cast("Q")
+        self.offsets = view[start : start + 8 * (self.count + 1)].cast("Q")
+
+    def __contains__(self, s):
+        h = id_hash(s)
+        i = bisect.bisect_left(self.hashes, h)
+        data = s.encode("utf-8")
+        while i < self.count and self.hashes[i] == h:
+            if self.ids_map[self.offsets[i] : self.offsets[i + 1]] == data:
+                return True
+            i += 1
+        return False
+
+    def ids(self):
+        return [
+            self.ids_map[self.offsets[i] : self.offsets[i + 1]].decode("utf-8")
+            for i in range(self.count)
+        ]
+
+    def close(self):
+        self.hashes.release()
+        self.offsets.release()
+        self.idx_map.close()
+        self.ids_map.close()
+
+    @staticmethod
+    def write(path, ids):
+        """Write a segment for the ids to path.idx and path.ids."""
+        entries = sorted((id_hash(s), s.encode("utf-8")) for s in set(ids))
+        hashes = array("Q", [h for (h, _) in entries])
+        offsets = array("Q", [0])
+        for _, data in entries:
+            offsets.append(offsets[-1] + len(data))
+        header = array("Q", [len(entries)])
+        directory = os.path.dirname(path)
+        with atomic_file(path + ".ids", directory) as f:
+            for _, data in entries:
+                f.write(data)
+        with atomic_file(path + ".idx", directory) as f:
+            f.write(MAGIC)
+            f.write(header.tobytes())
+            f.write(hashes.tobytes())
+            f.write(offsets.tobytes())
+
+
+class atomic_file(object):
+    """Write to a temporary file, renamed over path on success. If path
+    exists, its permissions are kept."""
+
+    def __init__(self, path, directory):
+        self.path = path
+        self.directory = directory
+
+    def __enter__(self):
+        fd, self.tmp_path = tempfile.mkstemp(prefix=".tmp", dir=self.directory)
+        self.f = os.fdopen(fd, "wb")
+        return self.f
+
+    def __exit__(self, exc_type, exc, tb):
+        self.f.close()
+        if exc_type is None:
+            if os.path.exists(self.path):
+                shutil.copymode(self.path, self.tmp_path)
+            os.replace(self.tmp_path, self.path)
+        else:
+            os.unlink(self.tmp_path)
+        return False
+
+
+class IdIndex(object):
+    """Index of the ofxid/csvid tags of the journal at journal_path.
+
+    Call update() before looking up ids with check_transaction_by_id(),
+    which has the same interface as the ledger backends' method. If
+    fp_rate is given, a Bloom filter with that false positive rate is
+    kept alongside the index."""
+
+    def __init__(self, journal_path, directory=None, fp_rate=None):
+        self.journal_path = os.path.abspath(journal_path)
+        if directory is None:
+            name = hashlib.blake2b(
+                self.journal_path.encode("utf-8"), digest_size=8
+            ).hexdigest()
+            directory = os.path.join(cache_dir(), "index", name)
+        self.directory = directory
+        self.segments = {}
+        # segment_names(), kept while the segments are not rewritten
+        self.names = None
+        self.head = {}
+        self.state = None
+        self.fp_rate = fp_rate
+        self.bloom = None
+        self.lock = threading.Lock()
+
+    # Persistent state
+
+    def state_path(self):
+        return os.path.join(self.directory, "state.json")
+
+    def head_path(self):
+        return os.path.join(self.directory, "head")
+
+    def bloom_path(self):
+        return os.path.join(self.directory, "bloom")
+
+    def segment_path(self, name):
+        return os.path.join(self.directory, name)
+
+    def segment_names(self):
+        return sorted(
+            name[:-4]
+            for name in os.listdir(self.directory)
+            if name.endswith(".idx") and not name.startswith(".")
+        )
+
+    def load_state(self):
+        try:
+            with open(self.state_path()) as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if state.get("version") != VERSION:
+            return None
+        return state
+
+    def save_state(self):
+        with atomic_file(self.state_path(), self.directory) as f:
+            f.write(json.dumps(self.state, indent=1, sort_keys=True).encode("utf-8"))
+
+    def load_head(self):
+        self.head = {}
+        try:
+            with open(self.head_path(), encoding="utf-8") as f:
+                for line in f:
+                    name, s = line.rstrip("\n").split("\t", 1)
+                    self.head.setdefault(name, set()).add(s)
+        except OSError:
+            pass
+
+    # Building
+
+    @staticmethod
+    def file_state(path, size, last_date):
+        with open(path, "rb") as f:
+            f.seek(max(0, size - TAIL_CHECK))
+            tail = f.read(min(size, TAIL_CHECK))
+        st = os.stat(path)
+        return {
+            "size": size,
+            "mtime_ns": st.st_mtime_ns,
+            "tail": hashlib.blake2b(tail, digest_size=16).hexdigest(),
+            "last_date": last_date,
+        }
+
+    @staticmethod
+    def is_unchanged(path, info):
+        try:
+            st = os.stat(path)
+        except OSError:
+            return False
+        return st.st_size == info["size"] and st.st_mtime_ns == info["mtime_ns"]
+
+    @staticmethod
+    def is_appended(path, info):
+        try:
+            st = os.stat(path)
+            if st.st_size < info["size"]:
+                return False
+            with open(path, "rb") as f:
+                f.seek(max(0, info["size"] - TAIL_CHECK))
+                tail = f.read(min(info["size"], TAIL_CHECK))
+        except OSError:
+            return False
+        return hashlib.blake2b(tail, digest_size=16).hexdigest() == info["tail"]
+
+    def scan_file(self, path, found, offset=0, last_date=None):
+        """Scan path from offset, adding (month, id) pairs to found and
+        scanning included files. Return the date of the last entry."""
+        entry_date = None
+        if last_date is not None:
+            entry_date = datetime.date.fromisoformat(last_date)
+        # Guards against include cycles; replaced once the file is done
+        self.state["files"][path] = None
+        with open(path, "rb") as f:
+            for item in scan(f, path, offset, entry_date):
+                if isinstance(item, Entry):
+                    last_date = item.date.isoformat()
+                    for key, value in item.metadata:
+                        if key in KEYS:
+                            for s in index_ids(key, value):
+                                found.append((month(item.date), s))
+                elif isinstance(item, Include):
+                    for included in item.paths():
+                        if included not in self.state["files"]:
+                            self.scan_file(included, found)
+            size = f.tell()
+        self.state["files"][path] = self.file_state(path, size, last_date)
+        return last_date
+
+    def rebuild(self):
+        logging.debug("Rebuilding id index for %s" % (self.journal_path))
+        self.close()
+        os.makedirs(self.directory, exist_ok=True)
+        for name in os.listdir(self.directory):
+            os.unlink(os.path.join(self.directory, name))
+        self.state = {"version": VERSION, "files": {}}
+        self.head = {}
+        found = []
+        self.scan_file(self.journal_path, found)
+        by_month = {}
+        for name, s in found:
+            by_month.setdefault(name, []).append(s)
+        for name, ids in by_month.items():
+            Segment.write(self.segment_path(name), ids)
+        if self.fp_rate is not None:
+            self.rebuild_bloom()
+        self.save_state()
+
+    def update(self):
+        """Bring the index up to date with the journal."""
+        with profiling.span("index"):
+            self.update_segments()
+            self.names = self.segment_names()
+            if self.fp_rate is not None:
+                self.bloom = BloomFilter.open(self.bloom_path())
+
+    def update_segments(self):
+        self.state = self.load_state()
+        if self.state is None or self.journal_path not in self.state["files"]:
+            return self.rebuild()
+        self.load_head()
+        appended = []
+        for path, info in list(self.state["files"].items()):
+            if info is None:
+                return self.rebuild()
+            if self.is_unchanged(path, info):
+                continue
+            if not self.is_appended(path, info):
+                return self.rebuild()
+            appended.append((path, info))
+        found = []
+        for path, info in appended:
+            self.scan_file(path, found, info["size"], info["last_date"])
+        if found:
+            with open(self.head_path(), "a", encoding="utf-8") as f:
+                for name, s in found:
+                    f.write("%s\t%s\n" % (name, s))
+                    self.head.setdefault(name, set()).add(s)
+            if sum(len(ids) for ids in self.head.values()) >= HEAD_LIMIT:
+                self.merge()
+        if self.fp_rate is not None:
+            self.update_bloom([s for (_, s) in found])
+        elif found and "bloom_count" in self.state:
+            # The filter is now missing ids, don't use it later
+            del self.state["bloom_count"]
+            os.unlink(self.bloom_path())
+        if appended or self.fp_rate is not None:
+            self.save_state()
+
+    def replace_ids(self, replaced, paths):
+        """Bring the (up to date) index in line with a rewrite of the files
+        at paths that changed ids but did not add or remove transactions,
+        without scanning them again. replaced is a list of (date, key, old
+        value, new value) tuples."""
+        self.close()
+        if self.head:
+            self.merge()
+        by_month = {}
+        for date, key, old, new in replaced:
+            by_month.setdefault(month(date), []).append(
+                (index_ids(key, old), index_ids(key, new))
+            )
+        for name, changes in by_month.items():
+            path = self.segment_path(name)
+            ids = set()
+            if os.path.exists(path + ".idx"):
+                segment = Segment(path)
+                ids.update(segment.ids())
+                segment.close()
+            for old_ids, new_ids in changes:
+                ids.difference_update(old_ids)
+                ids.update(new_ids)
+            Segment.write(path, ids)
+        self.names = self.segment_names()
+        for path in paths:
+            info = self.state["files"].get(path)
+            if info is not None:
+                self.state["files"][path] = self.file_state(
+                    path, os.path.getsize(path), info["last_date"]
+                )
+        if replaced and "bloom_count" in self.state:
+            # Ids cannot be removed from a Bloom filter
+            if self.fp_rate is None:
+                del self.state["bloom_count"]
+                os.unlink(self.bloom_path())
+            else:
+                self.rebuild_bloom()
+        self.save_state()
+
+    # Bloom filter
+
+    def all_ids(self):
+        ids = []
+        for name in self.segment_names():
+            segment = Segment(self.segment_path(name))
+            ids.extend(segment.ids())
+            segment.close()
+        for head_ids in self.head.values():
+            ids.extend(head_ids)
+        return ids
+
+    def rebuild_bloom(self):
+        ids = self.all_ids()
+        # Leave room for appends until the next rebuild
+        bloom = BloomFilter.for_capacity(2 * len(ids), self.fp_rate)
+        for s in ids:
+            bloom.add(s)
+        bloom.write(self.bloom_path())
+        self.state["bloom_count"] = len(ids)
+
+    def update_bloom(self, new_ids):
+        try:
+            bloom = BloomFilter.open(self.bloom_path(), writable=True)
+        except (OSError, ValueError):
+            bloom = None
+        if "bloom_count" not in self.state:
+            bloom = None
+        count = self.state.get("bloom_count", 0) + len(new_ids)
+        if bloom is None or bloom.fp_rate != self.fp_rate or count > bloom.capacity:
+            return self.rebuild_bloom()
+        if new_ids:
+            for s in new_ids:
+                bloom.add(s)
+            bloom.write(self.bloom_path())
+            self.state["bloom_count"] = count
+
+    def might_contain(self, key, value):
+        """Return False if key=value is certainly not in the journal. Always
+        True when there is no Bloom filter.
+
+        The filter holds the strings of index_ids, so value may be looked up
+        without its prefix, as with check_transaction_by_id."""
+        if self.bloom is None:
+            return True
+        if id_string(key, value) in self.bloom:
+            profiling.count("bloom:maybe")
+            return True
+        profiling.count("bloom:absent")
+        return False
+
+    def merge(self):
+        """Merge the head into the month segments."""
+        self.close()
+        for name, ids in self.head.items():
+            path = self.segment_path(name)
+            if os.path.exists(path + ".idx"):
+                segment = Segment(path)
+                ids = ids.union(segment.ids())
+                segment.close()
+            Segment.write(path, ids)
+        self.head = {}
+        os.unlink(self.head_path())
+        self.names = self.segment_names()
+
+    # Lookup
+
+    def segment(self, name):
+        with self.lock:
+            if name not in self.segments:
+                path = self.segment_path(name)
+                if os.path.exists(path + ".idx"):
+                    self.segments[name] = Segment(path)
+                else:
+                    self.segments[name] = None
+            return self.segments[name]
+
+    def check_transaction_by_id(self, key, value, window=None):
+        if not self.might_contain(key, value):
+            return False
+        s = id_string(key, value)
+        if window is None:
+            if self.names is None:
+                self.names = self.segment_names()
+            names = self.names + list(self.head)
+        else:
+            names = months(window)
+        for name in names:
+            if s in self.head.get(name, ()):
+                return True
+            segment = self.segment(name)
+            if segment is not None and s in segment:
+                return True
+        return False
+
+    def close(self):
+        for segment in self.segments.values():
+            if segment is not None:
+                segment.close()
+        self.segments = {}
+        self.names = None
+        if self.bloom is not None:
+            self.bloom.close()
+            self.bloom = None
@@ -0,0 +1,101 @@
+# Copyright (c) 2013-2021 Erik Hetzner
+#
+# This file is part of ledger-autosync
+#
+# ledger-autosync is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# ledger-autosync is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with ledger-autosync. If not, see
+# <http://www.gnu.org/licenses/>.
+
+
+"""Opening the files to import.
+
+A PATH given on the command line may be an OFX or CSV file, such a file
+compressed with gzip, bzip2 or xz, a zip archive of such files, or "-"
+for standard input. Compression and the format of the contents are
+recognized by their first bytes, not by the file name, and files are
+decompressed as they are read, without temporary files (except for a
+zip archive read from standard input, which must be spooled to be
+read).
+"""
+
+import importlib
+import re
+import shutil
+import sys
+import tempfile
+
+# (magic bytes, module whose open() decompresses a file object); the
+# modules are only imported when needed
+COMPRESSIONS = (
+    (b"\x1f\x8b", "gzip"),
+    (b"BZh", "bz2"),
+    (b"\xfd7zXZ\x00", "lzma"),
+)
+ZIP_MAGIC = b"PK\x03\x04"
+OFX_RE = re.compile(rb"^(?:\xef\xbb\xbf)?\s*(?:OFXHEADER|<\?xml|<\?OFX|<OFX)", re.I)
+# zip archives made on macOS carry resource forks in this directory
+ZIP_IGNORE_RE = re.compile(r"(^|/)(__MACOSX/|\.)")
+SPOOL_SIZE = 1 << 24
+
+
+class Input(object):
+    """A file to import. f is a binary file object for its contents;
+    format is "ofx" or "csv". path is set if f is a plain file on disk,
+    which can be reopened and seeked in."""
+
+    def __init__(self, name, f, format, path=None):
+        self.name = name
+        self.f = f
+        self.format = format
+        self.path = path
+
+
+def detect_format(f):
+    if OFX_RE.match(f.peek(512)[:512]):
+        return "ofx"
+    return "csv"
+
+
+def open_inputs(path):
+    """Yield an Input for each file to import from path. The file object
+    of each is only valid until the next one is yielded."""
+    if path == "-":
+        yield from inputs(sys.stdin.buffer, "-")
+        return
+    with open(path, "rb") as f:
+        yield from inputs(f, path, path)
+
+
+def inputs(f, name, path=None):
+    magic = f.peek(8)[:8]
+    for prefix, module in COMPRESSIONS:
+        if magic.startswith(prefix):
+            with importlib.import_module(module).open(f) as decompressed:
+                yield from inputs(decompressed, name)
+            return
+    if magic.startswith(ZIP_MAGIC):
+        import zipfile
+
+        if not f.seekable():
+            spooled = tempfile.SpooledTemporaryFile(max_size=SPOOL_SIZE)
+            shutil.copyfileobj(f, spooled)
+            spooled.seek(0)
+            f = spooled
+        with zipfile.ZipFile(f) as archive:
+            for info in archive.infolist():
+                if info.is_dir() or ZIP_IGNORE_RE.search(info.filename):
+                    continue
+                with archive.open(info) as member:
+                    yield from inputs(member, "%s:%s" % (name, info.filename))
+        return
+    yield Input(name, f, detect_format(f), path)
@@ -0,0 +1,45 @@
+# Copyright (c) 2013-2021 Erik Hetzner
+#
+# This file is part of ledger-autosync
+#
+# ledger-autosync is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# ledger-autosync is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with ledger-autosync. If not, see
+# <http://www.gnu.org/licenses/>.
+
+
+"""Running independent pieces of work (accounts, statements) in threads.
+
+Most of the time is spent waiting on the network or on ledger
+subprocesses, so threads are enough. Backends serialize the queries
+that share state with their own lock.
+"""
+
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+
+
+def map_ordered(fn, items, jobs=1):
+    """Yield fn(item) for each of items, in order, running up to jobs calls
+    at once. Each call runs in a copy of the caller's context, so that
+    e.g. metrics labels still apply."""
+    items = list(items)
+    if jobs is None or jobs <= 1 or len(items) <= 1:
+        for item in items:
+            yield fn(item)
+        return
+    with ThreadPoolExecutor(max_workers=min(jobs, len(items))) as executor:
+        futures = [
+            executor.submit(contextvars.copy_context().run, fn, item) for item in items
+        ]
+        for future in futures:
+            yield future.result()
@@ -0,0 +1,212 @@
+# Copyright (c) 2013-2021 Erik Hetzner
+#
+# This file is part of ledger-autosync
+#
+# ledger-autosync is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# ledger-autosync is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with ledger-autosync. If not, see
+# <http://www.gnu.org/licenses/>.
+
+"""A streaming scanner for ledger journal files.
+
+This is not a ledger parser: it only finds what ledger-autosync needs
+without running ledger, i.e. dated transactions (with their byte
+offsets in the file, payee, postings and metadata tags), include
+directives and the date and commodity of price directives. Amounts are
+not interpreted.
+"""
+
+import datetime
+import glob
+import os
+import re
+
+DATE_RE = re.compile(
+    r"^(?:(\d{4})[/.-])?(\d{1,2})[/.-](\d{1,2})(?:=(\S+))?(?:\s+(.*?))?\s*$"
+)
+STATE_CODE_RE = re.compile(r"^(?:[*!]\s*)?(?:\(([^)]*)\)\s*)?")
+META_RE = re.compile(r";\s*([^\s:;]+):\s*(.*?)\s*$")
+POSTING_SEP_RE = re.compile(r"\t|  ")
+INCLUDE_RE = re.compile(r"^!?include\s+(.+?)\s*$")
+YEAR_RE = re.compile(r"^(?:Y|year|apply year)\s+(\d{4})\s*$")
+BLOCK_RE = re.compile(r"^(comment|test)\b")
+PRICE_RE = re.compile(
+    r"^P\s+(?:(\d{4})[/.-])?(\d{1,2})[/.-](\d{1,2})(?:\s+\d{1,2}:\d{2}(?::\d{2})?)?"
+    r'\s+("[^"]*"|[^\s"]+)'
+)
+
+
+class Entry(object):
+    """A dated transaction. offset and end delimit its bytes in the file,
+    without trailing blank lines; line is the (1-based) line number of its
+    first line."""
+
+    def __init__(self, path, offset, date, payee, code=None, line=None):
+        self.path = path
+        self.offset = offset
+        self.line = line
+        self.end = offset
+        self.date = date
+        self.payee = payee
+        self.code = code
+        # (key, value) pairs of metadata tags, in order
+        self.metadata = []
+        # (account, amount) pairs; amount is the unparsed string or None
+        self.postings = []
+        # byte offset of the line of each posting
+        self.posting_offsets = []
+
+    def get(self, key):
+        for k, v in self.metadata:
+            if k == key:
+                return v
+        return None
+
+    def __repr__(self):
+        return "<Entry %s %s %s@%d>" % (self.date, self.payee, self.path, self.offset)
+
+
+class Include(object):
+    def __init__(self, path, offset, target):
+        self.path = path
+        self.offset = offset
+        self.target = target
+
+    def paths(self):
+        """Return the files this directive includes, in order."""
+        target = os.path.expanduser(self.target)
+        if not os.path.isabs(target):
+            target = os.path.join(os.path.dirname(self.path), target)
+        if glob.has_magic(target):
+            return sorted(glob.glob(target))
+        return [target]
+
+
+class Price(object):
+    """A price directive: the price of commodity on date."""
+
+    def __init__(self, path, offset, date, commodity):
+        self.path = path
+        self.offset = offset
+        self.date = date
+        self.commodity = commodity
+
+
+def parse_date(md, default_year):
+    year = md.group(1)
+    if year is None:
+        if default_year is None:
+            return None
+        year = default_year
+    try:
+        return datetime.date(int(year), int(md.group(2)), int(md.group(3)))
+    except ValueError:
+        return None
+
+
+def scan(f, path=None, offset=0, entry_date=None, lineno=1):
+    """Yield the Entry, Include and Price objects in binary file f,
+    starting at offset.
+
+    When starting in the middle of a file (e.g. to scan what was appended
+    since the last run), entry_date is the date of the transaction that
+    offset may continue: metadata found before the next transaction
+    header is attributed to a new Entry with that date and offset. lineno
+    is the line number at offset."""
+    f.seek(offset)
+    default_year = None
+    entry = None
+    if entry_date is not None:
+        entry = Entry(path, offset, entry_date, None, line=lineno)
+    in_block = None
+    pos = offset
+    lineno -= 1
+    for raw in f:
+        line_start = pos
+        pos += len(raw)
+        lineno += 1
+        line = raw.decode("utf-8", "replace").rstrip("\r\n")
+        if in_block is not None:
+            if line.startswith("end " + in_block):
+                in_block = None
+            continue
+        if line[:1] in (" ", "\t"):
+            if entry is None:
+                continue
+            if line.strip():
+                entry.end = pos
+            md = META_RE.search(line)
+            if md is not None:
+                entry.metadata.append((md.group(1), md.group(2)))
+            posting = line.split(";", 1)[0].strip().lstrip("*! ")
+            if posting:
+                parts = POSTING_SEP_RE.split(posting, 1)
+                amount = None
+                if len(parts) > 1 and parts[1].strip():
+                    amount = parts[1].strip()
+                entry.postings.append((parts[0], amount))
+                entry.posting_offsets.append(line_start)
+            continue
+        if entry is not None:
+            yield entry
+            entry = None
+        if not line or line[0] in ";#%|*":
+            continue
+        md = PRICE_RE.match(line)
+        if md is not None:
+            date = parse_date(md, default_year)
+            if date is not None:
+                yield Price(path, line_start, date, md.group(4).strip('"'))
+            continue
+        md = DATE_RE.match(line)
+        if md is not None:
+            date = parse_date(md, default_year)
+            if date is not None:
+                rest = md.group(5) or ""
+                state_code = STATE_CODE_RE.match(rest)
+                entry = Entry(
+                    path,
+                    line_start,
+                    date,
+                    rest[state_code.end() :].split(" ; ")[0].strip(),
+                    state_code.group(1),
+                    lineno,
+                )
+                entry.end = pos
+                md = META_RE.search(rest)
+                if md is not None:
+                    entry.metadata.append((md.group(1), md.group(2)))
+            continue
+        md = INCLUDE_RE.match(line)
+        if md is not None:
+            yield Include(path, line_start, md.group(1))
+            continue
+        md = YEAR_RE.match(line)
+        if md is not None:
+            default_year = md.group(1)
+            continue
+        md = BLOCK_RE.match(line)
+        if md is not None:
+            in_block = md.group(1)
+    if entry is not None:
+        yield entry
+
+
+def entries(path, follow_includes=True):
+    """Yield the Entry objects of the journal at path, following includes."""
+    with open(path, "rb") as f:
+        for item in scan(f, path):
+            if isinstance(item, Entry):
+                yield item
+            elif isinstance(item, Include) and follow_includes:
+                for included in item.paths():
+                    yield from entries(included)
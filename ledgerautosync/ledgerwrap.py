@@ -18,18 +18,63 @@
 
 
 import csv
+import json
 import logging
 import os
 import re
-import subprocess
-from queue import Empty, Queue
 from shutil import which as find_executable
-from subprocess import PIPE, Popen
-from threading import Thread
 
+from ledgerautosync import cache_dir, metrics, profiling
 from ledgerautosync.converter import Converter
 
-csv.register_dialect("ledger", delimiter=",", quoting=csv.QUOTE_ALL, escapechar="\\")
+
+def ledger_dialect():
+    """Register (once) and return the csv dialect used to read ledger
+    output."""
+    if "ledger" not in csv.list_dialects():
+        csv.register_dialect(
+            "ledger", delimiter=",", quoting=csv.QUOTE_ALL, escapechar="\\"
+        )
+    return "ledger"
+
+
+def executable_version(name):
+    """Return the output of `name --version`, or None if `name` is not in
+    $PATH.
+
+    Spawning the executable costs more than the rest of startup, so the
+    result is cached on disk, keyed by the resolved executable path and
+    its mtime: upgrading (or replacing) the binary invalidates the entry.
+    """
+    path = find_executable(name)
+    if path is None:
+        return None
+    path = os.path.realpath(path)
+    try:
+        key = "%s:%d" % (path, os.stat(path).st_mtime_ns)
+    except OSError:
+        return None
+    cache_file = os.path.join(cache_dir(), "backends.json")
+    cache = {}
+    try:
+        with open(cache_file) as f:
+            cache = json.load(f)
+    except (OSError, ValueError):
+        pass
+    if key not in cache:
+        from subprocess import PIPE, Popen
+
+        profiling.count("spawn:%s" % (name))
+        cache[key] = Popen(
+            [path, "--version"], stdout=PIPE, universal_newlines=True
+        ).communicate()[0]
+        try:
+            os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+            with open(cache_file, "w") as f:
+                json.dump(cache, f)
+        except OSError:
+            logging.debug("Could not write backend cache %s" % (cache_file))
+    return cache[key]
 
 
 def mk_ledger(ledger_file):
@@ -61,6 +106,20 @@ class MetaLedger(object):
     def available():
         return False
 
+    @staticmethod
+    def window_args(window, fmt="%Y-%m-%d"):
+        """Return the --begin/--end arguments restricting a query to the
+        (begin, end) date window, end exclusive."""
+        if window is None:
+            return []
+        begin, end = window
+        return ["--begin", begin.strftime(fmt), "--end", end.strftime(fmt)]
+
+    @staticmethod
+    def record_query(kind):
+        profiling.count("query:%s" % (kind))
+        metrics.inc("backend_queries", kind=kind)
+
     def add_payee(self, payee, account):
         if payee not in self.payees:
             self.payees[payee] = []
@@ -68,18 +127,23 @@ class MetaLedger(object):
             self.payees[payee].append(account)
 
     def filter_accounts(self, accts, exclude):
-        accts_filtered = [a for a in accts if a != exclude]
+        # exclude is an account name or a set of them
+        if isinstance(exclude, str):
+            exclude = (exclude,)
+        accts_filtered = [a for a in accts if a not in exclude]
         if accts_filtered:
             return accts_filtered[-1]
         else:
             return None
 
     def get_account_by_payee(self, payee, exclude):
-        for regex, account in self.rules:
-            if regex.match(payee):
-                return account
+        with profiling.span("rules"):
+            for regex, account in self.rules:
+                if regex.match(payee):
+                    return account
 
-        self.load_payees()
+        with self.lock:
+            self.load_payees()
         return self.filter_accounts(self.payees.get(payee, []), exclude)
 
     def add_rule(self, regex, account):
@@ -88,16 +152,18 @@ class MetaLedger(object):
     def __init__(self):
         self.payees = None
         self.rules = []
+        # Serializes queries that share state (the ledger pipe, the python
+        # journal, the payee cache) when accounts are processed in threads
+        from threading import RLock
+
+        self.lock = RLock()
 
 
 class Ledger(MetaLedger):
     @staticmethod
     def available():
-        return (find_executable("ledger") is not None) and (
-            Popen(
-                ["ledger", "--version"], stdout=PIPE, universal_newlines=True
-            ).communicate()[0]
-        ).startswith("Ledger 3")
+        version = executable_version("ledger")
+        return version is not None and version.startswith("Ledger 3")
 
     def __init__(self, ledger_file=None, no_pipe=True):
         if find_executable("ledger") is None:
@@ -120,6 +186,11 @@ class Ledger(MetaLedger):
         if ledger_file is not None:
             self.args += ["-f", ledger_file]
         if self.use_pipe:
+            from queue import Queue
+            from subprocess import PIPE, Popen
+            from threading import Thread
+
+            profiling.count("spawn:ledger")
             self.p = Popen(
                 self.args,
                 bufsize=1,
@@ -133,6 +204,8 @@ class Ledger(MetaLedger):
             self.t.daemon = True  # thread dies with the program
             self.t.start()
             # read output until prompt
+            from queue import Empty
+
             try:
                 self.q.get(True, 5)
             except Empty:
@@ -153,27 +226,39 @@ class Ledger(MetaLedger):
         return [quote(s) for s in a]
 
     def run(self, cmd):
+        import subprocess
+
         if self.use_pipe:
-            self.p.stdin.write("csv ")
-            self.p.stdin.write(" ".join(Ledger.pipe_quote(cmd)))
-            self.p.stdin.write("\n")
-            logging.debug(" ".join(Ledger.pipe_quote(cmd)))
-            try:
-                return csv.reader(self.q.get(True, 5), dialect="ledger")
-            except Empty:
-                logging.error("Could not get prompt from ledger!")
-                exit(1)
+            from queue import Empty
+
+            with self.lock:
+                self.p.stdin.write("csv ")
+                self.p.stdin.write(" ".join(Ledger.pipe_quote(cmd)))
+                self.p.stdin.write("\n")
+                logging.debug(" ".join(Ledger.pipe_quote(cmd)))
+                try:
+                    output = self.q.get(True, 5)
+                except Empty:
+                    logging.error("Could not get prompt from ledger!")
+                    exit(1)
+            return csv.reader(output, dialect=ledger_dialect())
         else:
             cmd = self.args + ["csv"] + cmd
             if os.name == "nt":
                 cmd = MetaLedger.windows_clean(cmd)
+            profiling.count("spawn:ledger")
             return csv.reader(
                 subprocess.check_output(cmd, universal_newlines=True).splitlines(),
-                dialect="ledger",
+                dialect=ledger_dialect(),
             )
 
-    def check_transaction_by_id(self, key, value):
-        q = ["-E", "meta", "%s=%s" % (key, Converter.clean_id(value))]
+    def check_transaction_by_id(self, key, value, window=None):
+        self.record_query("check_transaction_by_id")
+        q = self.window_args(window) + [
+            "-E",
+            "meta",
+            "%s=%s" % (key, Converter.clean_id(value)),
+        ]
         try:
             next(self.run(q))
             return True
@@ -182,12 +267,15 @@ class Ledger(MetaLedger):
 
     def load_payees(self):
         if self.payees is None:
-            self.payees = {}
-            r = self.run(["show", "--actual"])
-            for line in r:
-                self.add_payee(line[2], line[3])
+            self.record_query("load_payees")
+            with profiling.span("load_payees"):
+                self.payees = {}
+                r = self.run(["show", "--actual"])
+                for line in r:
+                    self.add_payee(line[2], line[3])
 
     def get_autosync_payee(self, payee, account):
+        self.record_query("get_autosync_payee")
         q = [
             account,
             "--last",
@@ -236,14 +324,23 @@ class LedgerPython(MetaLedger):
 
     def load_payees(self):
         if self.payees is None:
-            self.payees = {}
-            for xact in self.journal:
-                for post in xact.posts():
-                    self.add_payee(xact.payee, post.reported_account().fullname())
-
-    def check_transaction_by_id(self, key, value):
-        q = self.journal.query('-E meta %s="%s"' % (key, Converter.clean_id(value)))
-        return len(q) > 0
+            self.record_query("load_payees")
+            with profiling.span("load_payees"):
+                self.payees = {}
+                for xact in self.journal:
+                    for post in xact.posts():
+                        self.add_payee(xact.payee, post.reported_account().fullname())
+
+    def check_transaction_by_id(self, key, value, window=None):
+        self.record_query("check_transaction_by_id")
+        with self.lock:
+            q = self.journal.query(
+                " ".join(
+                    self.window_args(window)
+                    + ['-E meta %s="%s"' % (key, Converter.clean_id(value))]
+                )
+            )
+            return len(q) > 0
 
     def get_autosync_payee(self, payee, account):
         logging.error("payee lookup not implemented for LedgerPython, using raw payee")
@@ -273,23 +370,34 @@ class HLedger(MetaLedger):
         super(HLedger, self).__init__()
 
     def run(self, cmd):
+        import subprocess
+
         cmd = HLedger.quote(self.args + cmd)
         if os.name == "nt":
             cmd = MetaLedger.windows_clean(cmd)
         logging.debug(" ".join(cmd))
+        profiling.count("spawn:hledger")
         return subprocess.check_output(cmd, universal_newlines=True)
 
-    def check_transaction_by_id(self, key, value):
+    def check_transaction_by_id(self, key, value, window=None):
+        self.record_query("check_transaction_by_id")
         cmd = ["reg", "tag:%s=%s" % (key, Converter.clean_id(value))]
+        if window is not None:
+            cmd.append(
+                "date:%s..%s"
+                % (window[0].strftime("%Y-%m-%d"), window[1].strftime("%Y-%m-%d"))
+            )
         return self.run(cmd) != ""
 
     def load_payees(self):
         if self.payees is None:
-            self.payees = {}
-            cmd = ["reg", "-O", "csv", "--real"]
-            r = csv.DictReader(self.run(cmd).splitlines())
-            for line in r:
-                self.add_payee(line["description"], line["account"])
+            self.record_query("load_payees")
+            with profiling.span("load_payees"):
+                self.payees = {}
+                cmd = ["reg", "-O", "csv", "--real"]
+                r = csv.DictReader(self.run(cmd).splitlines())
+                for line in r:
+                    self.add_payee(line["description"], line["account"])
 
     def get_autosync_payee(self, payee, account):
         logging.error("payee lookup not implemented for HLedger, using raw payee")
@@ -0,0 +1,148 @@
+# Copyright (c) 2013-2021 Erik Hetzner
+#
+# This file is part of ledger-autosync
+#
+# ledger-autosync is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# ledger-autosync is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with ledger-autosync. If not, see
+# <http://www.gnu.org/licenses/>.
+
+"""Per-run metrics, written with --metrics-file.
+
+Values describe a single run, so every metric is exported as a gauge.
+Instrumentation points call inc() or gauge(); the account or file being
+processed is attached as labels by wrapping the work in labels(...),
+so that code deep in the backends does not need to know about it.
+Like the profiling hooks, these calls do nothing unless metrics have
+been enabled with start().
+"""
+
+import contextvars
+import json
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+PREFIX = "ledgerautosync_"
+
+HELP = {
+    "run_seconds": "Wall time of the whole run.",
+    "run_timestamp_seconds": "Unix time at which the run finished.",
+    "errors": "Exceptions caught while processing an account or file.",
+    "download_seconds": "Time spent downloading statements.",
+    "download_bytes": "Size of downloaded statements.",
+    "transactions_seen": "Transactions in the statement or file.",
+    "transactions_new": "Transactions not found in the ledger.",
+    "transactions_deduplicated": "Transactions already in the ledger.",
+    "payee_inference": "Offset account lookups, by result (hit or fallback).",
+    "backend_queries": "Queries made to the ledger backend, by kind.",
+}
+
+_labels = contextvars.ContextVar("ledgerautosync_metric_labels", default=())
+_metrics = None
+_lock = threading.Lock()
+
+
+class Metrics(object):
+    def __init__(self):
+        # (name, labels) -> value, where labels is a sorted tuple of pairs
+        self.values = {}
+        self.start_time = time.time()
+
+    def key(self, name, labels):
+        merged = dict(_labels.get())
+        merged.update(labels)
+        return (name, tuple(sorted(merged.items())))
+
+    def as_list(self):
+        return [
+            {"name": PREFIX + name, "labels": dict(labels), "value": value}
+            for (name, labels), value in sorted(self.values.items())
+        ]
+
+    def format_prometheus(self):
+        lines = []
+        last_name = None
+        for (name, labels), value in sorted(self.values.items()):
+            if name != last_name:
+                if name in HELP:
+                    lines.append("# HELP %s%s %s" % (PREFIX, name, HELP[name]))
+                lines.append("# TYPE %s%s gauge" % (PREFIX, name))
+                last_name = name
+            label_str = ""
+            if labels:
+                label_str = "{%s}" % (
+                    ",".join('%s="%s"' % (k, escape(v)) for k, v in labels)
+                )
+            lines.append("%s%s%s %s" % (PREFIX, name, label_str, value))
+        return "\n".join(lines) + "\n"
+
+
+def escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def inc(name, value=1, **labels):
+    if _metrics is not None:
+        key = _metrics.key(name, labels)
+        with _lock:
+            _metrics.values[key] = _metrics.values.get(key, 0) + value
+
+
+def gauge(name, value, **labels):
+    if _metrics is not None:
+        _metrics.values[_metrics.key(name, labels)] = value
+
+
+@contextmanager
+def labels(**kwargs):
+    """Attach labels (e.g. account=...) to metrics recorded in this block."""
+    token = _labels.set(tuple(sorted(dict(_labels.get(), **kwargs).items())))
+    try:
+        yield
+    finally:
+        _labels.reset(token)
+
+
+def start():
+    global _metrics
+    _metrics = Metrics()
+    return _metrics
+
+
+def stop(path):
+    """Disable metrics and write them to path, as JSON if path ends in
+    .json, otherwise in the Prometheus textfile format.
+
+    The file is replaced atomically so that a collector never reads a
+    partially written file."""
+    global _metrics
+    metrics = _metrics
+    _metrics = None
+    if metrics is None:
+        return
+    end_time = time.time()
+    metrics.values[("run_seconds", ())] = round(end_time - metrics.start_time, 6)
+    metrics.values[("run_timestamp_seconds", ())] = int(end_time)
+    if path.endswith(".json"):
+        data = json.dumps({"metrics": metrics.as_list()}, indent=2)
+    else:
+        data = metrics.format_prometheus()
+    (fd, tmp_path) = tempfile.mkstemp(
+        prefix=".metrics", dir=os.path.dirname(os.path.abspath(path))
+    )
+    with os.fdopen(fd, "w") as f:
+        f.write(data)
+    os.chmod(tmp_path, 0o644)
+    os.replace(tmp_path, path)
@@ -0,0 +1,186 @@
+# Copyright (c) 2013-2021 Erik Hetzner
+#
+# This file is part of ledger-autosync
+#
+# ledger-autosync is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# ledger-autosync is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with ledger-autosync. If not, see
+# <http://www.gnu.org/licenses/>.
+
+
+"""Rewrite every transaction of a journal according to a list of rules,
+e.g. to reshape ofxids after switching to --shorten-account, or to
+rename accounts.
+
+Each rule is a MigrationRule: it gets the lines of one transaction and
+returns them, changed or not. Each journal file (and included file) is
+scanned once to compute the changes, which are then written in a single
+pass; see rewrite.apply_edits. If an IdIndex is given, it is updated
+with the ids that changed rather than rebuilt.
+"""
+
+import mmap
+import os
+import re
+
+from ledgerautosync import profiling
+from ledgerautosync.index import KEYS
+from ledgerautosync.journal import META_RE, Entry, Include, scan
+from ledgerautosync.rewrite import apply_edits, digest, replace_account
+
+POSTING_RE = re.compile(rb"^\s+(?:[*!]\s*)?([^\s;][^;\t]*?)(?:\t|  |\s*;|\s*$)")
+
+
+def is_comment(line):
+    return line.lstrip()[:1] in (b";", b"#", b"%", b"|", b"*")
+
+
+class MigrationRule(object):
+    def rewrite(self, lines):
+        """Return the lines (bytes, without line endings) of a transaction,
+        rewritten. lines[0] is the transaction header."""
+        return lines
+
+
+class MoveIdTag(MigrationRule):
+    """Move an id tag found right after the transaction header below the
+    first posting, where versions of ledger-autosync before 1.0.0 failed
+    to put it (this is what fix_ofxid.py did)."""
+
+    def __init__(self, keys=("ofxid",)):
+        self.keys = keys
+
+    def rewrite(self, lines):
+        if len(lines) < 3 or is_comment(lines[2]):
+            return lines
+        md = META_RE.search(lines[1].decode("utf-8", "replace"))
+        if md is None or md.group(1) not in self.keys or not is_comment(lines[1]):
+            return lines
+        return [lines[0], lines[2], lines[1]] + lines[3:]
+
+
+class RenameAccount(MigrationRule):
+    """Rename the account old, and its subaccounts, to new."""
+
+    def __init__(self, old, new):
+        self.old = old
+        self.new = new
+
+    def rewrite(self, lines):
+        retval = [lines[0]]
+        for line in lines[1:]:
+            md = POSTING_RE.match(line)
+            if md is not None and not is_comment(line):
+                account = md.group(1).decode("utf-8")
+                if account == self.old or account.startswith(self.old + ":"):
+                    renamed = self.new + account[len(self.old) :]
+                    line = replace_account(line, account, renamed) or line
+            retval.append(line)
+        return retval
+
+
+class ReplaceInIds(MigrationRule):
+    """Replace old by new in the values of the id tags, e.g. an account
+    number by its last 4 digits when switching to --shorten-account, or
+    "OLDFID." by "NEWFID." after an institution changed its FID."""
+
+    def __init__(self, old, new, keys=KEYS):
+        self.old = old
+        self.new = new
+        self.keys = keys
+
+    def rewrite(self, lines):
+        retval = [lines[0]]
+        for line in lines[1:]:
+            text = line.decode("utf-8", "replace")
+            md = META_RE.search(text)
+            if md is not None and md.group(1) in self.keys and self.old in md.group(2):
+                value = md.group(2).replace(self.old, self.new)
+                line = (text[: md.start(2)] + value + text[md.end(2) :]).encode("utf-8")
+            retval.append(line)
+        return retval
+
+
+def id_tags(lines):
+    tags = []
+    for line in lines:
+        md = META_RE.search(line.decode("utf-8", "replace"))
+        if md is not None and md.group(1) in KEYS:
+            tags.append((md.group(1), md.group(2)))
+    return tags
+
+
+class Migration(object):
+    def __init__(self, rules):
+        self.rules = rules
+        self.changed = 0
+        # (date, key, old value, new value) of the ids that changed
+        self.replaced = []
+        self.paths = []
+
+    def rewrite_entry(self, entry, data):
+        lines = data.split(b"\n")
+        # keep the line ending after the last line out of the rules' way
+        last = lines.pop() if lines[-1] == b"" else None
+        new_lines = lines
+        for rule in self.rules:
+            new_lines = rule.rewrite(new_lines)
+        if new_lines == lines:
+            return None
+        old_tags = id_tags(lines)
+        new_tags = id_tags(new_lines)
+        if len(old_tags) == len(new_tags):
+            for (key, old), (_, new) in zip(old_tags, new_tags):
+                if old != new:
+                    self.replaced.append((entry.date, key, old, new))
+        if last is not None:
+            new_lines.append(last)
+        return b"\n".join(new_lines)
+
+    def migrate_file(self, path, seen):
+        seen.add(path)
+        if os.path.getsize(path) == 0:
+            return
+        edits = []
+        included = []
+        with open(path, "rb") as f, mmap.mmap(
+            f.fileno(), 0, access=mmap.ACCESS_READ
+        ) as m:
+            for item in scan(f, path):
+                if isinstance(item, Include):
+                    included.extend(item.paths())
+                elif isinstance(item, Entry):
+                    data = m[item.offset : item.end]
+                    new = self.rewrite_entry(item, data)
+                    if new is not None:
+                        edits.append((item.offset, item.end, new))
+            expected = digest(m) if edits else None
+        if edits:
+            apply_edits(path, edits, expected)
+            self.changed += len(edits)
+            self.paths.append(path)
+        for other in included:
+            if other not in seen:
+                self.migrate_file(other, seen)
+
+
+def migrate(journal_path, rules, index=None):
+    """Apply rules to the journal at journal_path and the files it
+    includes. If index is an IdIndex, it must be up to date; it is
+    updated in place. Return the Migration, which records what
+    changed."""
+    migration = Migration(rules)
+    with profiling.span("migrate"):
+        migration.migrate_file(journal_path, set())
+        if index is not None and migration.paths:
+            index.replace_ids(migration.replaced, migration.paths)
+    return migration
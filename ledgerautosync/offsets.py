@@ -0,0 +1,255 @@
+# Copyright (c) 2013-2021 Erik Hetzner
+#
+# This file is part of ledger-autosync
+#
+# ledger-autosync is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# ledger-autosync is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with ledger-autosync. If not, see
+# <http://www.gnu.org/licenses/>.
+
+"""Inserting transactions into a journal file in date order.
+
+An OffsetIndex keeps the date, start and end offset of every transaction
+of one file (not of the files it includes), in file order, in
+~/.cache/ledger-autosync/offsets. Like the id index, it only scans what
+was appended to the file since the last run, and rebuilds after any
+other change.
+
+A DatedInserter collects the transactions of a run and inserts them
+all in one pass over the file (see rewrite.apply_edits), each after the
+last transaction dated on or before it. The offset index is then
+updated from the edits, without scanning the file again.
+"""
+
+import bisect
+import datetime
+import hashlib
+import io
+import json
+import os
+import re
+from array import array
+
+from ledgerautosync import cache_dir, profiling
+from ledgerautosync.converter import Transaction
+from ledgerautosync.index import IdIndex, atomic_file
+from ledgerautosync.journal import Entry, scan
+from ledgerautosync.rewrite import apply_edits
+
+VERSION = 1
+PRICE_RE = re.compile(r"^P\s+(\d{4})[/.-](\d{1,2})[/.-](\d{1,2})")
+
+
+def to_date(d):
+    if isinstance(d, datetime.datetime):
+        return d.date()
+    return d
+
+
+def text_date(text, item=None):
+    """Return the date of the transaction or price directive text
+    (formatted from item, if given), and whether it is a transaction.
+    Return (None, False) if it is neither."""
+    if isinstance(item, Transaction):
+        return (to_date(item.date), True)
+    md = PRICE_RE.match(text)
+    if md is not None:
+        try:
+            return (datetime.date(*map(int, md.groups())), False)
+        except ValueError:
+            return (None, False)
+    for entry in scan(io.BytesIO(text.encode("utf-8"))):
+        if isinstance(entry, Entry):
+            return (entry.date, True)
+    return (None, False)
+
+
+class OffsetIndex(object):
+    def __init__(self, path, directory=None):
+        self.path = os.path.abspath(path)
+        if directory is None:
+            name = hashlib.blake2b(self.path.encode("utf-8"), digest_size=8).hexdigest()
+            directory = os.path.join(cache_dir(), "offsets", name)
+        self.directory = directory
+        self.state = None
+        # date ordinals, start and end offsets of the transactions
+        self.dates = array("q")
+        self.starts = array("q")
+        self.ends = array("q")
+
+    def state_path(self):
+        return os.path.join(self.directory, "state.json")
+
+    def offsets_path(self):
+        return os.path.join(self.directory, "offsets")
+
+    def load(self):
+        try:
+            with open(self.state_path()) as f:
+                state = json.load(f)
+            if state.get("version") != VERSION:
+                return False
+            offsets = array("q")
+            with open(self.offsets_path(), "rb") as f:
+                offsets.frombytes(f.read())
+        except (OSError, ValueError):
+            return False
+        count = state["count"]
+        if len(offsets) != 3 * count:
+            return False
+        self.state = state
+        self.dates = offsets[:count]
+        self.starts = offsets[count : 2 * count]
+        self.ends = offsets[2 * count :]
+        return True
+
+    def save(self):
+        os.makedirs(self.directory, exist_ok=True)
+        last_date = None
+        if self.dates:
+            last_date = datetime.date.fromordinal(self.dates[-1]).isoformat()
+        self.state = dict(
+            IdIndex.file_state(self.path, os.path.getsize(self.path), last_date),
+            version=VERSION,
+            count=len(self.dates),
+        )
+        with atomic_file(self.offsets_path(), self.directory) as f:
+            f.write(self.dates.tobytes())
+            f.write(self.starts.tobytes())
+            f.write(self.ends.tobytes())
+        with atomic_file(self.state_path(), self.directory) as f:
+            f.write(json.dumps(self.state, indent=1, sort_keys=True).encode("utf-8"))
+
+    def scan(self, offset=0, last_date=None):
+        """Add the transactions from offset on. If last_date is given, what
+        is at offset may continue the last transaction."""
+        entry_date = None
+        if last_date is not None:
+            entry_date = datetime.date.fromisoformat(last_date)
+        with open(self.path, "rb") as f:
+            for item in scan(f, self.path, offset, entry_date):
+                if not isinstance(item, Entry):
+                    continue
+                if item.payee is None and item.offset == offset and self.ends:
+                    # the continuation of the last transaction
+                    self.ends[-1] = max(self.ends[-1], item.end)
+                    continue
+                self.dates.append(item.date.toordinal())
+                self.starts.append(item.offset)
+                self.ends.append(item.end)
+
+    def update(self):
+        """Bring the index up to date with the file."""
+        with profiling.span("offsets"):
+            if not self.load():
+                return self.rebuild()
+            if IdIndex.is_unchanged(self.path, self.state):
+                return
+            if not IdIndex.is_appended(self.path, self.state):
+                return self.rebuild()
+            self.scan(self.state["size"], self.state["last_date"])
+            self.save()
+
+    def rebuild(self):
+        self.dates = array("q")
+        self.starts = array("q")
+        self.ends = array("q")
+        self.scan()
+        self.save()
+
+    def insert(self, items):
+        """Insert items, a list of (date, text, is_transaction) tuples, into
+        the (up to date) file, and update the index to match."""
+        if not items:
+            return
+        # the latest date so far, by transaction
+        latest = array("q")
+        for ordinal in self.dates:
+            latest.append(max(ordinal, latest[-1]) if latest else ordinal)
+        size = os.path.getsize(self.path)
+        insertions = []
+        for date, text, is_transaction in sorted(items, key=lambda item: item[0]):
+            data = text.encode("utf-8")
+            if not data.endswith(b"\n"):
+                data += b"\n"
+            i = bisect.bisect_right(latest, date.toordinal())
+            if i == 0 and self.starts:
+                insertion = (self.starts[0], b"", data, b"\n")
+            elif i == 0:
+                insertion = (size, b"\n" if size else b"", data, b"")
+            else:
+                insertion = (self.ends[i - 1], b"\n", data, b"")
+            insertions.append(insertion + (date, is_transaction))
+        apply_edits(
+            self.path,
+            [
+                (pos, pos, prefix + data + suffix)
+                for (pos, prefix, data, suffix, _, _) in insertions
+            ],
+        )
+        # apply_edits keeps the order of insertions at the same offset
+        insertions.sort(key=lambda insertion: insertion[0])
+        dates = array("q")
+        starts = array("q")
+        ends = array("q")
+        shift = 0
+        j = 0
+        for i in range(len(self.dates) + 1):
+            while j < len(insertions) and (
+                i == len(self.dates) or insertions[j][0] <= self.starts[i]
+            ):
+                pos, prefix, data, suffix, date, is_transaction = insertions[j]
+                if is_transaction:
+                    start = pos + shift + len(prefix)
+                    dates.append(date.toordinal())
+                    starts.append(start)
+                    ends.append(start + len(data.rstrip(b"\r\n")) + 1)
+                shift += len(prefix) + len(data) + len(suffix)
+                j += 1
+            if i < len(self.dates):
+                dates.append(self.dates[i])
+                starts.append(self.starts[i] + shift)
+                ends.append(self.ends[i] + shift)
+        self.dates = dates
+        self.starts = starts
+        self.ends = ends
+        self.save()
+
+
+class DatedInserter(object):
+    """Collects output for inserting into the journal file at path when
+    closed."""
+
+    def __init__(self, path, directory=None):
+        self.index = OffsetIndex(path, directory)
+        self.items = []
+
+    def write(self, text, item=None):
+        """Queue text, formatted from item if given, for insertion. Return
+        False if it is neither a transaction nor a price directive."""
+        if not text:
+            return True
+        date, is_transaction = text_date(text, item)
+        if date is None:
+            return False
+        self.items.append((date, text, is_transaction))
+        return True
+
+    def flush(self):
+        """Insert the output queued so far."""
+        if self.items:
+            self.index.update()
+            self.index.insert(self.items)
+            self.items = []
+
+    def close(self):
+        self.flush()
@@ -0,0 +1,75 @@
+# Copyright (c) 2013-2021 Erik Hetzner
+#
+# This file is part of ledger-autosync
+#
+# ledger-autosync is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# ledger-autosync is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with ledger-autosync. If not, see
+# <http://www.gnu.org/licenses/>.
+
+"""Printing the output of several accounts in date order.
+
+The output of each account is turned into an iterator of (date, item)
+pairs in date order, converting its transactions lazily, and these are
+merged with a heap, so that no more than one item per account is held
+at a time. Items on the same date keep the order of the accounts.
+"""
+
+import datetime
+import heapq
+
+from ledgerautosync.converter import Transaction
+from ledgerautosync.offsets import text_date, to_date
+
+
+def item_date(item):
+    """Return the date of an output item: a Transaction, or formatted text
+    such as a balance assertion or price directive. None if unknown."""
+    if isinstance(item, Transaction):
+        return to_date(item.date)
+    return text_date(item)[0]
+
+
+def dated(items, default):
+    """Yield (date, item) for items, skipping empty ones. An item without a
+    date takes that of the item before it, or default."""
+    date = default
+    for item in items:
+        if not item:
+            continue
+        date = item_date(item) or date
+        yield (date, item)
+
+
+def first(pair):
+    return pair[0]
+
+
+def in_date_order(leading, transactions, trailing):
+    """Return an iterator of (date, item) pairs over the output of one
+    account (see cli.output_items) in date order. transactions, which are
+    converted as they are needed, must be in date order already. An
+    initial balance goes before the transactions on its date, and a
+    balance assertion or price directive after them."""
+    return heapq.merge(
+        dated(leading, datetime.date.min),
+        dated(transactions, datetime.date.min),
+        sorted(dated(trailing, datetime.date.max), key=first),
+        key=first,
+    )
+
+
+def merge_by_date(streams):
+    """Yield the items of streams (from in_date_order), in date order. On
+    the same date, the items of earlier streams go first."""
+    for _, item in heapq.merge(*streams, key=first):
+        yield item
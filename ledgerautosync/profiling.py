@@ -0,0 +1,154 @@
+# Copyright (c) 2013-2021 Erik Hetzner
+#
+# This file is part of ledger-autosync
+#
+# ledger-autosync is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# ledger-autosync is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with ledger-autosync. If not, see
+# <http://www.gnu.org/licenses/>.
+
+"""Lightweight phase timers and counters, enabled with --profile.
+
+Code (including plugins) marks phases with
+
+    with profiling.span("download"):
+        ...
+
+and counts events, such as backend queries or subprocess spawns, with
+profiling.count("query:load_payees"). When profiling is disabled, span()
+returns a shared no-op context manager and count() returns immediately.
+"""
+
+import json
+import time
+
+
+class _NullSpan(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class _Span(object):
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.profiler.add_time(self.name, time.perf_counter() - self.start)
+        return False
+
+
+class Profiler(object):
+    def __init__(self):
+        # name -> [calls, total seconds]
+        self.spans = {}
+        # kind -> count
+        self.counters = {}
+        self.cprofile = None
+        from threading import Lock
+
+        self.lock = Lock()
+
+    def add_time(self, name, seconds):
+        with self.lock:
+            entry = self.spans.setdefault(name, [0, 0.0])
+            entry[0] += 1
+            entry[1] += seconds
+
+    def add_count(self, kind, n):
+        with self.lock:
+            self.counters[kind] = self.counters.get(kind, 0) + n
+
+    def as_dict(self):
+        return {
+            "spans": {
+                name: {"calls": calls, "seconds": seconds}
+                for name, (calls, seconds) in self.spans.items()
+            },
+            "counters": dict(self.counters),
+        }
+
+    def format_summary(self):
+        lines = ["%-32s %8s %12s %10s" % ("phase", "calls", "total ms", "mean ms")]
+        for name, (calls, seconds) in sorted(
+            self.spans.items(), key=lambda item: -item[1][1]
+        ):
+            lines.append(
+                "%-32s %8d %12.1f %10.2f"
+                % (name, calls, seconds * 1000, seconds * 1000 / calls)
+            )
+        if self.counters:
+            lines.append("")
+            lines.append("%-32s %8s" % ("counter", "count"))
+            for kind in sorted(self.counters):
+                lines.append("%-32s %8d" % (kind, self.counters[kind]))
+        return "\n".join(lines) + "\n"
+
+
+_profiler = None
+
+
+def enabled():
+    return _profiler is not None
+
+
+def span(name):
+    """Return a context manager timing the enclosed block as phase `name`."""
+    if _profiler is None:
+        return _NULL_SPAN
+    return _Span(_profiler, name)
+
+
+def count(kind, n=1):
+    """Add `n` to the counter `kind`, e.g. "spawn:ledger"."""
+    if _profiler is not None:
+        _profiler.add_count(kind, n)
+
+
+def start(dump_path=None):
+    """Enable profiling. If dump_path is given and does not end in .json,
+    also run cProfile and dump its stats there at the end of the run."""
+    global _profiler
+    _profiler = Profiler()
+    if dump_path is not None and not dump_path.endswith(".json"):
+        import cProfile
+
+        _profiler.cprofile = cProfile.Profile()
+        _profiler.cprofile.enable()
+    return _profiler
+
+
+def stop(stream, dump_path=None):
+    """Disable profiling, write the summary table to `stream`, and write
+    the JSON or cProfile dump if requested."""
+    global _profiler
+    profiler = _profiler
+    _profiler = None
+    if profiler is None:
+        return
+    if profiler.cprofile is not None:
+        profiler.cprofile.disable()
+        profiler.cprofile.dump_stats(dump_path)
+    elif dump_path is not None:
+        with open(dump_path, "w") as f:
+            json.dump(profiler.as_dict(), f, indent=2, sort_keys=True)
+    stream.write(profiler.format_summary())
@@ -0,0 +1,167 @@
+# Copyright (c) 2013-2021 Erik Hetzner
+#
+# This file is part of ledger-autosync
+#
+# ledger-autosync is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# ledger-autosync is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with ledger-autosync. If not, see
+# <http://www.gnu.org/licenses/>.
+
+
+"""Move postings out of fallback accounts (Expenses:Misc, or the
+--unknown-account) using the current rules and payee index.
+
+The journal is scanned once to find the postings to fallback accounts
+and to build the payee -> account index that the converters use when
+syncing; the lines of those postings are then rewritten in one pass
+over each file, unless it changed since it was scanned.
+"""
+
+import hashlib
+import mmap
+
+from ledgerautosync import journal, profiling
+from ledgerautosync.ledgerwrap import MetaLedger
+from ledgerautosync.rewrite import apply_edits, digest, read_line, replace_account
+
+DEFAULT_FALLBACK_ACCOUNTS = ("Expenses:Misc",)
+
+
+class JournalPayees(MetaLedger):
+    """The rules and payee index of a ledger backend, with the payees read
+    from a journal scan instead of queried from ledger. Postings to
+    accounts in `ignore` are not indexed."""
+
+    def __init__(self, rules=(), ignore=()):
+        super(JournalPayees, self).__init__()
+        self.payees = {}
+        self.rules = list(rules)
+        self.ignore = set(ignore)
+
+    def load_payees(self):
+        pass
+
+    def add_entry(self, entry):
+        for account, _ in entry.postings:
+            if account not in self.ignore:
+                self.add_payee(entry.payee, account)
+
+
+class Change(object):
+    """Moving the posting at offset of entry from account old to new.
+    digest is that of the file of entry when it was scanned."""
+
+    def __init__(self, entry, offset, old, new, digest=None):
+        self.entry = entry
+        self.offset = offset
+        self.old = old
+        self.new = new
+        self.digest = digest
+
+    def describe(self):
+        return "%s:%d %s %s: %s -> %s" % (
+            self.entry.path,
+            self.entry.line,
+            self.entry.date.strftime("%Y/%m/%d"),
+            self.entry.payee,
+            self.old,
+            self.new,
+        )
+
+
+class HashingReader(object):
+    """A binary file for journal.scan, hashing the lines it reads."""
+
+    def __init__(self, f):
+        self.f = f
+        self.hash = hashlib.sha256()
+
+    def seek(self, offset):
+        self.f.seek(offset)
+
+    def __iter__(self):
+        for line in self.f:
+            self.hash.update(line)
+            yield line
+
+
+def scan_entries(path, digests):
+    """Yield the entries of the journal at path, following includes, and
+    set digests[path] of each file to the digest of what was scanned."""
+    with open(path, "rb") as f:
+        reader = HashingReader(f)
+        for item in journal.scan(reader, path):
+            if isinstance(item, journal.Entry):
+                yield item
+            elif isinstance(item, journal.Include):
+                for included in item.paths():
+                    yield from scan_entries(included, digests)
+        digests[path] = reader.hash.hexdigest()
+
+
+def find_changes(journal_path, rules=(), fallback=DEFAULT_FALLBACK_ACCOUNTS):
+    """Return the Change for each posting to a fallback account of the
+    journal at journal_path that the rules or the payee index assign to
+    another account."""
+    fallback = set(fallback)
+    payees = JournalPayees(rules, ignore=fallback)
+    candidates = []
+    # path -> digest of the file as scanned
+    digests = {}
+    with profiling.span("scan"):
+        for entry in scan_entries(journal_path, digests):
+            payees.add_entry(entry)
+            if any(account in fallback for (account, _) in entry.postings):
+                candidates.append(entry)
+    changes = []
+    with profiling.span("rules"):
+        for entry in candidates:
+            if not entry.payee:
+                continue
+            accounts = set(account for (account, _) in entry.postings)
+            new = payees.get_account_by_payee(entry.payee, accounts | fallback)
+            if new is None or new in fallback or new in accounts:
+                continue
+            for (account, _), offset in zip(entry.postings, entry.posting_offsets):
+                if account in fallback:
+                    changes.append(
+                        Change(entry, offset, account, new, digests[entry.path])
+                    )
+    return changes
+
+
+def apply_changes(changes):
+    """Rewrite the posting lines of changes, one pass per file. A file
+    that changed since find_changes scanned it is not rewritten."""
+    by_path = {}
+    for change in changes:
+        by_path.setdefault(change.entry.path, []).append(change)
+    for path, file_changes in by_path.items():
+        edits = []
+        expected = file_changes[0].digest
+        with open(path, "rb") as f, mmap.mmap(
+            f.fileno(), 0, access=mmap.ACCESS_READ
+        ) as m:
+            if expected is None:
+                expected = digest(m)
+            elif digest(m) != expected:
+                raise ValueError("%s changed since it was read" % (path))
+            for change in file_changes:
+                line = read_line(m, change.offset)
+                replaced = replace_account(line, change.old, change.new)
+                if replaced is None:
+                    raise ValueError(
+                        "%s changed since it was read (offset %d)"
+                        % (path, change.offset)
+                    )
+                edits.append((change.offset, change.offset + len(line), replaced))
+        apply_edits(path, edits, expected)
@@ -0,0 +1,140 @@
+# Copyright (c) 2013-2021 Erik Hetzner
+#
+# This file is part of ledger-autosync
+#
+# ledger-autosync is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# ledger-autosync is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with ledger-autosync. If not, see
+# <http://www.gnu.org/licenses/>.
+
+
+"""A registry of the input files that have been imported.
+
+For each imported path, the registry keeps its size, modification time
+and the sha256 digest of its contents, and it keeps the digests of all
+imported files. A file whose size and modification time have not
+changed is known to be imported without reading it; a file with the
+digest of an imported one (e.g. a copy under another name) is known to
+be imported after hashing it.
+
+Exports that are only ever appended to (as some banks' CSV downloads
+are) are recognized too: if the first `offset` bytes of a file are the
+file imported earlier from the same path, only the rest of it needs to
+be imported.
+"""
+
+import hashlib
+import json
+import os
+
+from ledgerautosync.index import atomic_file
+
+VERSION = 1
+CHUNK_SIZE = 1 << 16
+
+
+class FileState(object):
+    """What the registry knows about an input file. If imported, all of
+    it has been imported before; otherwise the bytes before offset
+    have."""
+
+    def __init__(self, path, size, mtime_ns, digest=None, imported=False, offset=0):
+        self.path = path
+        self.size = size
+        self.mtime_ns = mtime_ns
+        self.digest = digest
+        self.imported = imported
+        self.offset = offset
+
+
+def hash_file(path, offset=0):
+    """Return (digest of the whole file, digest of its first offset
+    bytes), reading the file once."""
+    digest = hashlib.sha256()
+    prefix = None
+    position = 0
+    with open(path, "rb") as f:
+        while True:
+            if position == offset:
+                prefix = digest.hexdigest()
+            size = CHUNK_SIZE
+            if position < offset:
+                size = min(size, offset - position)
+            chunk = f.read(size)
+            if not chunk:
+                break
+            digest.update(chunk)
+            position += len(chunk)
+    return (digest.hexdigest(), prefix)
+
+
+class ImportRegistry(object):
+    def __init__(self, path):
+        self.path = path
+        self.files = {}
+        self.digests = set()
+        try:
+            with open(path) as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            return
+        if state.get("version") == VERSION:
+            self.files = state["files"]
+            self.digests = set(state["digests"])
+
+    def save(self):
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+        state = {
+            "version": VERSION,
+            "files": self.files,
+            "digests": sorted(self.digests),
+        }
+        with atomic_file(self.path, directory) as f:
+            f.write(json.dumps(state, indent=1, sort_keys=True).encode("utf-8"))
+
+    def lookup(self, path):
+        """Return the FileState of the file at path."""
+        path = os.path.abspath(path)
+        st = os.stat(path)
+        state = FileState(path, st.st_size, st.st_mtime_ns)
+        known = self.files.get(path)
+        if (
+            known is not None
+            and known["size"] == st.st_size
+            and known["mtime_ns"] == st.st_mtime_ns
+        ):
+            state.digest = known["digest"]
+            state.imported = True
+            state.offset = st.st_size
+            return state
+        offset = 0
+        if known is not None and known["size"] < st.st_size:
+            offset = known["size"]
+        state.digest, prefix = hash_file(path, offset)
+        if state.digest in self.digests:
+            state.imported = True
+            state.offset = st.st_size
+        elif offset > 0 and prefix == known["digest"]:
+            state.offset = offset
+        return state
+
+    def record(self, state):
+        """Record that the file of state has been imported completely, and
+        save the registry."""
+        self.files[state.path] = {
+            "size": state.size,
+            "mtime_ns": state.mtime_ns,
+            "digest": state.digest,
+        }
+        self.digests.add(state.digest)
+        self.save()
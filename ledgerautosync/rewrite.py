@@ -0,0 +1,109 @@
+# Copyright (c) 2013-2021 Erik Hetzner
+#
+# This file is part of ledger-autosync
+#
+# ledger-autosync is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# ledger-autosync is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with ledger-autosync. If not, see
+# <http://www.gnu.org/licenses/>.
+
+
+"""Rewriting parts of journal files in place.
+
+A rewrite is a list of edits, each replacing a byte range of the file.
+The file is memory-mapped and copied once, with the edits applied, to a
+temporary file in the same directory that is then renamed over it, so
+that a failure leaves the journal untouched.
+"""
+
+import hashlib
+import mmap
+import os
+import re
+
+from ledgerautosync import profiling
+from ledgerautosync.index import atomic_file
+
+
+def read_line(m, offset):
+    """Return the line of the mapped file m at offset, without its line
+    ending."""
+    end = m.find(b"\n", offset)
+    if end == -1:
+        end = len(m)
+    return m[offset:end].rstrip(b"\r")
+
+
+def replace_account(line, old, new):
+    """Return the posting line (bytes) with its account old replaced by
+    new, keeping the amount where it was if possible, or None if the line
+    does not post to old."""
+    # the account ends at two spaces, a tab, a comment or the line end
+    pattern = rb"^(\s+(?:[*!]\s*)?)(%s)((?:\t|  )\s*|\s*(?=;)|\s*$)(.*)$" % (
+        re.escape(old.encode("utf-8"))
+    )
+    md = re.match(pattern, line)
+    if md is None:
+        return None
+    new = new.encode("utf-8")
+    separator = md.group(3)
+    if md.group(4) and not md.group(4).startswith(b";"):
+        if b"\t" not in separator:
+            width = len(separator) + len(md.group(2)) - len(new)
+            separator = b" " * max(2, width)
+    elif not md.group(4):
+        separator = b""
+    return md.group(1) + new + separator + md.group(4)
+
+
+def digest(m):
+    return hashlib.sha256(m).hexdigest()
+
+
+def apply_edits(path, edits, expected_digest=None):
+    """Replace byte ranges of the file at path. edits is a list of
+    (start, end, data) tuples with non-overlapping ranges.
+
+    If expected_digest is given, the file must still have that digest
+    (i.e. not have changed since the edits were computed from it). The
+    new file is read back and checked before it replaces the old one."""
+    edits = sorted(edits, key=lambda edit: edit[:2])
+    if not edits:
+        return
+    directory = os.path.dirname(os.path.abspath(path))
+    replacement = atomic_file(path, directory)
+    with profiling.span("rewrite"), open(path, "rb") as f, mmap.mmap(
+        f.fileno(), 0, access=mmap.ACCESS_READ
+    ) as m:
+        if expected_digest is not None and digest(m) != expected_digest:
+            raise ValueError("%s changed while it was being rewritten" % (path))
+        written = hashlib.sha256()
+        with replacement as out:
+            view = memoryview(m)
+            try:
+                pos = 0
+                for start, end, data in edits:
+                    if start < pos:
+                        raise ValueError("Overlapping edits at offset %d" % (start))
+                    for chunk in (view[pos:start], data):
+                        out.write(chunk)
+                        written.update(chunk)
+                    pos = end
+                out.write(view[pos:])
+                written.update(view[pos:])
+            finally:
+                view.release()
+            out.flush()
+            os.fsync(out.fileno())
+            with open(replacement.tmp_path, "rb") as check:
+                if hashlib.sha256(check.read()).hexdigest() != written.hexdigest():
+                    raise ValueError("Error writing %s" % (path))
@@ -0,0 +1,195 @@
+# Copyright (c) 2013-2021 Erik Hetzner
+#
+# This file is part of ledger-autosync
+#
+# ledger-autosync is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# ledger-autosync is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with ledger-autosync. If not, see
+# <http://www.gnu.org/licenses/>.
+
+"""A security master: what ledger-autosync learned about securities.
+
+OFX statements name securities by CUSIP, and give their ticker symbols
+in a list of securities (SECLIST), which some statements leave out or
+give only in part. The SecurityMaster keeps the CUSIP and ticker of
+every security listed in any statement converted, in
+~/.local/share/ledger-autosync/securities.json, so that later
+statements are converted with the ticker too.
+
+A PriceIndex keeps the date and commodity of the price directives in a
+journal (and the files it includes), in ~/.cache/ledger-autosync/prices.
+Like the id index, it only scans what was appended to the files since
+the last run, and rebuilds after any other change. It tells which price
+points of a statement's positions are new.
+"""
+
+import datetime
+import hashlib
+import json
+import os
+import threading
+
+from ledgerautosync import cache_dir, profiling
+from ledgerautosync.index import IdIndex, atomic_file
+from ledgerautosync.journal import Include, Price, scan
+
+VERSION = 1
+
+
+def to_date(d):
+    if isinstance(d, datetime.datetime):
+        return d.date()
+    return d
+
+
+class SecurityMaster(object):
+    def __init__(self, path):
+        self.path = path
+        # CUSIP -> ticker
+        self.tickers = {}
+        self.changed = False
+        self.lock = threading.Lock()
+        # the PriceIndex of the journal, if there is one
+        self.prices = None
+        try:
+            with open(path) as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            return
+        if state.get("version") == VERSION:
+            self.tickers = state["tickers"]
+
+    def learn(self, securities):
+        """Record the CUSIP and ticker of securities (from a SECLIST)."""
+        with self.lock:
+            for sec in securities:
+                if sec.uniqueid and sec.ticker:
+                    if self.tickers.get(sec.uniqueid) != sec.ticker:
+                        self.tickers[sec.uniqueid] = sec.ticker
+                        self.changed = True
+
+    def ticker(self, cusip):
+        """Return the ticker of the security with cusip, or None."""
+        return self.tickers.get(cusip)
+
+    def cusip(self, ticker):
+        """Return the CUSIP of the security with ticker, or None."""
+        for cusip, known in self.tickers.items():
+            if known == ticker:
+                return cusip
+        return None
+
+    def save(self):
+        if not self.changed:
+            return
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+        state = {"version": VERSION, "tickers": self.tickers}
+        with atomic_file(self.path, directory) as f:
+            f.write(json.dumps(state, indent=1, sort_keys=True).encode("utf-8"))
+        self.changed = False
+
+
+class PriceIndex(object):
+    """Index of the price directives of the journal at journal_path. Call
+    update() before is_new()."""
+
+    def __init__(self, journal_path, directory=None):
+        self.journal_path = os.path.abspath(journal_path)
+        if directory is None:
+            directory = os.path.join(cache_dir(), "prices")
+        self.directory = directory
+        name = hashlib.blake2b(
+            self.journal_path.encode("utf-8"), digest_size=8
+        ).hexdigest()
+        self.path = os.path.join(directory, name + ".json")
+        self.state = None
+        # commodity -> set of dates
+        self.prices = {}
+        # (commodity, date) pairs found new since
+        self.found = set()
+        self.lock = threading.Lock()
+
+    def load(self):
+        try:
+            with open(self.path) as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            return False
+        if state.get("version") != VERSION or self.journal_path not in state["files"]:
+            return False
+        self.state = state
+        self.prices = {}
+        for commodity, dates in state["prices"].items():
+            self.prices[commodity] = set(datetime.date.fromisoformat(d) for d in dates)
+        return True
+
+    def save(self):
+        os.makedirs(self.directory, exist_ok=True)
+        self.state["prices"] = dict(
+            (commodity, sorted(d.isoformat() for d in dates))
+            for (commodity, dates) in self.prices.items()
+        )
+        with atomic_file(self.path, self.directory) as f:
+            f.write(json.dumps(self.state, indent=1, sort_keys=True).encode("utf-8"))
+
+    def scan_file(self, path, offset=0):
+        """Add the prices in path from offset on, scanning included files."""
+        # Guards against include cycles; replaced once the file is done
+        self.state["files"][path] = None
+        with open(path, "rb") as f:
+            for item in scan(f, path, offset):
+                if isinstance(item, Price):
+                    self.prices.setdefault(item.commodity, set()).add(item.date)
+                elif isinstance(item, Include):
+                    for included in item.paths():
+                        if included not in self.state["files"]:
+                            self.scan_file(included)
+            size = f.tell()
+        self.state["files"][path] = IdIndex.file_state(path, size, None)
+
+    def rebuild(self):
+        self.state = {"version": VERSION, "files": {}}
+        self.prices = {}
+        self.scan_file(self.journal_path)
+        self.save()
+
+    def update(self):
+        """Bring the index up to date with the journal."""
+        with profiling.span("prices"):
+            if not self.load():
+                return self.rebuild()
+            appended = []
+            for path, info in list(self.state["files"].items()):
+                if info is None:
+                    return self.rebuild()
+                if IdIndex.is_unchanged(path, info):
+                    continue
+                if not IdIndex.is_appended(path, info):
+                    return self.rebuild()
+                appended.append((path, info))
+            for path, info in appended:
+                self.scan_file(path, info["size"])
+            if appended:
+                self.save()
+
+    def is_new(self, date, commodity):
+        """Return True if the journal has no price of commodity on date (of
+        a datetime), and no price was found new for it before."""
+        date = to_date(date)
+        with self.lock:
+            if date in self.prices.get(commodity, ()):
+                return False
+            if (commodity, date) in self.found:
+                return False
+            self.found.add((commodity, date))
+            return True
@@ -0,0 +1,143 @@
+# Copyright (c) 2013-2021 Erik Hetzner
+#
+# This file is part of ledger-autosync
+#
+# ledger-autosync is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# ledger-autosync is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with ledger-autosync. If not, see
+# <http://www.gnu.org/licenses/>.
+
+"""Writing output to a journal sharded by account and year.
+
+Each transaction is appended to DIR/<account>/<year>.ledger, where the
+components of the (first posting's) account name are nested
+directories, e.g. DIR/Assets/Checking/2021.ledger, and price
+directives to DIR/prices/<year>.ledger. DIR/manifest.ledger includes
+every shard; include it from the main journal.
+
+Shards and the manifest are only ever appended to, so that the id index
+(see index.py) scans just the new transactions of the shards written
+to and leaves the others alone.
+"""
+
+import io
+import os
+import re
+
+from ledgerautosync.converter import Transaction
+from ledgerautosync.journal import Entry, Include, scan
+
+MANIFEST = "manifest.ledger"
+PRICE_RE = re.compile(r"^P\s+(\d{4})[/.-]")
+UNSAFE_RE = re.compile(r"[/\\\x00]")
+
+
+def account_path(account):
+    """Return the relative directory for the shards of account."""
+    parts = []
+    for part in account.split(":"):
+        part = UNSAFE_RE.sub("_", part.strip())
+        if part in ("", ".", ".."):
+            part = "_"
+        parts.append(part)
+    return os.path.join(*parts)
+
+
+def shard_name(text, item=None):
+    """Return the path, relative to the shard directory, of the shard for
+    the transaction or price directive text (formatted from item, if
+    given), or None if it is neither."""
+    if isinstance(item, Transaction) and item.postings:
+        return os.path.join(
+            account_path(item.postings[0].account), "%d.ledger" % (item.date.year)
+        )
+    md = PRICE_RE.match(text)
+    if md is not None:
+        return os.path.join("prices", "%s.ledger" % (md.group(1)))
+    for entry in scan(io.BytesIO(text.encode("utf-8"))):
+        if isinstance(entry, Entry) and entry.postings:
+            return os.path.join(
+                account_path(entry.postings[0][0]), "%d.ledger" % (entry.date.year)
+            )
+    return None
+
+
+class ShardedJournal(object):
+    def __init__(self, directory):
+        self.directory = directory
+        self.manifest = os.path.join(directory, MANIFEST)
+        # shard name -> open file
+        self.files = {}
+        self.included = set()
+        if os.path.exists(self.manifest):
+            with open(self.manifest, "rb") as f:
+                for item in scan(f, self.manifest):
+                    if isinstance(item, Include):
+                        self.included.add(item.target)
+
+    def write(self, text, item=None):
+        """Append text, formatted from item if given, to its shard. Return
+        False if text has no shard (see shard_name)."""
+        if not text:
+            return True
+        name = shard_name(text, item)
+        if name is None:
+            return False
+        if name not in self.files:
+            self.files[name] = self.open(name)
+        self.files[name].write(text + "\n")
+        return True
+
+    def open(self, name):
+        path = os.path.join(self.directory, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        missing_newline = lacks_newline(path)
+        f = open(path, "a", encoding="utf-8")
+        if missing_newline:
+            f.write("\n")
+        target = name.replace(os.sep, "/")
+        if target not in self.included:
+            append_line(self.manifest, "include %s" % (target))
+            self.included.add(target)
+        return f
+
+    def flush(self):
+        for f in self.files.values():
+            f.flush()
+
+    def close(self):
+        for f in self.files.values():
+            f.close()
+        self.files = {}
+
+
+def lacks_newline(path):
+    """Return True if the file at path does not end with a newline, unless
+    it is empty or does not exist."""
+    try:
+        with open(path, "rb") as f:
+            f.seek(0, os.SEEK_END)
+            if f.tell() == 0:
+                return False
+            f.seek(-1, os.SEEK_END)
+            return f.read(1) != b"\n"
+    except FileNotFoundError:
+        return False
+
+
+def append_line(path, line):
+    """Append line to the file at path, on a line of its own."""
+    missing_newline = lacks_newline(path)
+    with open(path, "a", encoding="utf-8") as f:
+        if missing_newline:
+            f.write("\n")
+        f.write(line + "\n")
@@ -17,32 +17,133 @@
 # <http://www.gnu.org/licenses/>.
 
 
-import codecs
 import csv
+import datetime
+import io
 import logging
+import time
 
-from ofxparse import OfxParser, OfxParserException
-
+from ledgerautosync import metrics, profiling
+from ledgerautosync.cache import spool_temporary
 from ledgerautosync.converter import CsvConverter
+from ledgerautosync.jobs import map_ordered
+
+# times a backfill window that failed is downloaded again
+BACKFILL_RETRIES = 2
+SERVER_ERROR = b"Server error occured.  Received HttpStatusCode of 400"
 
 
 class Synchronizer(object):
-    def __init__(self, lgr):
+    def __init__(
+        self,
+        lgr,
+        date_slack=None,
+        index=None,
+        prefilter=None,
+        archive=None,
+        batch_ids=None,
+    ):
         self.lgr = lgr
+        self.date_slack = date_slack
+        self.index = index
+        self.prefilter = prefilter
+        self.archive = archive
+        self.batch_ids = batch_ids
+
+    def check_id(self, key, value, window=None):
+        """Look up an ofxid or csvid in the id index if there is one,
+        otherwise by querying the ledger.
+
+        If there is a prefilter (e.g. an IdIndex with a Bloom filter),
+        ids it rules out are not looked up at all. If batch_ids is a set,
+        the ids in it are considered synced: whoever outputs transactions
+        adds theirs (e.g. so that the same rows in another file of the
+        batch are not output again; see cli.record_output)."""
+        if self.batch_ids is not None and (key, value) in self.batch_ids:
+            return True
+        if self.prefilter is not None and not self.prefilter.might_contain(key, value):
+            return False
+        if self.index is not None:
+            return self.index.check_transaction_by_id(key, value, window)
+        return self.lgr.check_transaction_by_id(key, value, window)
+
+    def date_window(self, dates):
+        """Return the (begin, end) range of ledger dates, end exclusive, in
+        which to look for transactions dated `dates`, or None to look in
+        the whole ledger.
+
+        The window is only used if a date slack was given: ledger
+        transactions may be dated a few days away from the statement (e.g.
+        after editing them by hand), and the slack must cover that."""
+        dates = [
+            d.date() if isinstance(d, datetime.datetime) else d
+            for d in dates
+            if d is not None
+        ]
+        if self.date_slack is None or not dates:
+            return None
+        slack = datetime.timedelta(days=self.date_slack)
+        return (min(dates) - slack, max(dates) + slack + datetime.timedelta(days=1))
 
 
 class OfxSynchronizer(Synchronizer):
-    def __init__(self, lgr, hardcodeaccount=None, shortenaccount=None):
+    def __init__(
+        self,
+        lgr,
+        hardcodeaccount=None,
+        shortenaccount=None,
+        date_slack=None,
+        index=None,
+        prefilter=None,
+        archive=None,
+        cache=None,
+        batch_ids=None,
+        securities=None,
+    ):
         self.hardcodeaccount = hardcodeaccount
         self.shortenaccount = shortenaccount
-        super(OfxSynchronizer, self).__init__(lgr)
+        self.cache = cache
+        # the securities.SecurityMaster to convert statements with
+        self.securities = securities
+        # account -> (cache key, digest) of the response its new
+        # transactions came from, until they are marked as processed
+        self.fetched = {}
+        super(OfxSynchronizer, self).__init__(
+            lgr,
+            date_slack=date_slack,
+            index=index,
+            prefilter=prefilter,
+            archive=archive,
+            batch_ids=batch_ids,
+        )
 
     @staticmethod
     def parse_file(path):
-        with open(path, "rb") as ofx_file:
+        from ofxparse import OfxParser
+
+        if hasattr(path, "read"):
+            with profiling.span("parse"):
+                return OfxParser.parse(path)
+        with open(path, "rb") as ofx_file, profiling.span("parse"):
             return OfxParser.parse(ofx_file)
 
-    def is_txn_synced(self, acctid, txn):
+    def load_file(self, path, name=None):
+        """Parse the OFX file at path (or the binary file path), archiving
+        it if there is an archive. name is the ledger account it is
+        imported to, if given."""
+        if self.archive is None:
+            return self.parse_file(path)
+        if hasattr(path, "read"):
+            data = path.read()
+        else:
+            with open(path, "rb") as f:
+                data = f.read()
+        ofx = self.parse_file(io.BytesIO(data))
+        if hasattr(ofx, "account"):
+            self.archive.add_ofx(data, ofx, name)
+        return ofx
+
+    def is_txn_synced(self, acctid, txn, window=None):
         if self.lgr is None:
             # User called with --no-ledger
             # All transactions are considered "synced" in this case.
@@ -57,7 +158,7 @@ class OfxSynchronizer(Synchronizer):
                 acctid_to_use = acctid[-4:]
                 txnid_to_use = txnid_to_use.replace(acctid, acctid_to_use)
             ofxid = "%s.%s" % (acctid_to_use, txnid_to_use)
-            return self.lgr.check_transaction_by_id("ofxid", ofxid)
+            return self.check_id("ofxid", ofxid, window)
 
     # Filter out comment transactions. These have an amount of 0 and the same
     # datetime as the previous transactions.
@@ -95,39 +196,145 @@ class OfxSynchronizer(Synchronizer):
             sorted_txns = txns
         else:
             sorted_txns = sorted(txns, key=OfxSynchronizer.extract_sort_key)
-        retval = [txn for txn in sorted_txns if not (self.is_txn_synced(acctid, txn))]
+        window = self.date_window(
+            [OfxSynchronizer.extract_sort_key(txn) for txn in sorted_txns]
+        )
+        with profiling.span("dedup"):
+            retval = [
+                txn
+                for txn in sorted_txns
+                if not (self.is_txn_synced(acctid, txn, window))
+            ]
+        metrics.gauge("transactions_seen", len(txns))
+        metrics.gauge("transactions_new", len(retval))
+        metrics.gauge("transactions_deduplicated", len(txns) - len(retval))
         return self.filter_comment_txns(retval)
 
-    def get_new_txns(self, acct, max_days=999999, resync=False):
-        if resync or (max_days < 7):
-            days = max_days
-        else:
-            days = 7
-        last_txns_len = 0
-        while True:
-            logging.debug(
-                "Downloading %d days of transactions for %s (max_days=%d)."
-                % (days, acct.description, max_days)
-            )
-            raw = acct.download(days=days)
+    def fetch(self, key, download):
+        """Return (f, digest) for the response of download(), which returns
+        it as a file-like object. If there is a statement cache, it is
+        taken from the cache if it has a fresh response under key, and
+        stored there otherwise. f is a binary file, at its start; digest
+        is the sha256 of its contents."""
+        if self.cache is not None:
+            cached = self.cache.get(key)
+            if cached is not None:
+                metrics.inc("cache_hits")
+                return cached[0:2]
+        start = time.perf_counter()
+        with profiling.span("download"):
+            raw = download()
+            if self.cache is not None:
+                f, digest, size = self.cache.put(key, raw)
+            else:
+                f, digest, size = spool_temporary(raw)
+        metrics.inc("download_seconds", time.perf_counter() - start)
+        metrics.inc("download_bytes", size)
+        return (f, digest)
 
-            if raw.read() == "Server error occured.  Received HttpStatusCode of 400":
-                raise Exception("Error connecting to account %s" % (acct.description))
-            raw.seek(0)
-            ofx = None
+    def is_processed(self, key, acct, digest):
+        """Return True if the statement of acct in the response with
+        digest was already converted in an earlier run."""
+        return self.cache is not None and self.cache.is_processed(
+            key, acct.number, digest
+        )
+
+    def mark_processed(self, acct):
+        """Record that the new transactions of acct have been output, so
+        that an identical response is skipped next time."""
+        fetched = self.fetched.pop(acct, None)
+        if self.cache is not None and fetched is not None:
+            key, digest = fetched
+            self.cache.mark_processed(key, acct.number, digest)
+
+    def parse_download(self, f, key, description):
+        """Parse the OFX response in binary file f, downloaded under key for
+        description (an account or institution). Return the parsed OFX,
+        or None if the response was empty. A response that is an error is
+        removed from the statement cache."""
+        from ofxparse import OfxParser, OfxParserException
+
+        try:
+            if f.read(len(SERVER_ERROR) + 1) == SERVER_ERROR:
+                raise Exception("Error connecting to account %s" % (description))
+            f.seek(0)
             try:
-                ofx = OfxParser.parse(raw)
+                with profiling.span("parse"):
+                    ofx = OfxParser.parse(f)
             except OfxParserException as ex:
                 if ex.message == "The ofx file is empty!":
-                    return (ofx, [])
+                    return None
                 else:
                     raise ex
             if ofx.signon is not None:
                 if ofx.signon.severity == "ERROR":
                     raise Exception(
                         "Error returned from server for %s: %s"
-                        % (acct.description, ofx.signon.message)
+                        % (description, ofx.signon.message)
                     )
+            return ofx
+        except BaseException:
+            if self.cache is not None:
+                self.cache.discard(key)
+            raise
+
+    @staticmethod
+    def account_names(accts):
+        """Return the archive names (see Archive.add_ofx) of the accounts
+        accts downloaded with one request: their descriptions, as for
+        accounts downloaded on their own."""
+        return dict((acct.number, acct.description) for acct in accts)
+
+    def archive_response(self, f, ofx, name=None):
+        if self.archive is not None and ofx.accounts:
+            f.seek(0)
+            self.archive.add_ofx(f.read(), ofx, name)
+
+    @staticmethod
+    def is_done(txns_len, new_txns_len, last_txns_len, days, max_days):
+        """Return True if a statement of txns_len transactions, new_txns_len
+        of them new, downloaded for `days` days goes back far enough."""
+        if (txns_len > 0) and (last_txns_len == txns_len):
+            # not getting more txns than last time; we have
+            # reached the beginning
+            logging.debug("Not getting more txns than last time, done.")
+            return True
+        elif (txns_len > new_txns_len) or (days >= max_days):
+            # got more txns than were new or hit max_days, we've
+            # reached a stopping point
+            if days >= max_days:
+                logging.debug("Hit max days.")
+            else:
+                logging.debug("Got some stale txns.")
+            return True
+        return False
+
+    def get_new_txns(self, acct, max_days=999999, resync=False):
+        from ledgerautosync import download
+
+        if resync or (max_days < 7):
+            days = max_days
+        else:
+            days = 7
+        last_txns_len = 0
+        while True:
+            logging.debug(
+                "Downloading %d days of transactions for %s (max_days=%d)."
+                % (days, acct.description, max_days)
+            )
+            key = download.response_key([acct], days)
+            f, digest = self.fetch(key, lambda: acct.download(days=days))
+            if self.is_processed(key, acct, digest):
+                f.close()
+                logging.debug("Statement of %s is unchanged." % (acct.description))
+                metrics.inc("statements_unchanged")
+                return (None, [])
+            with f:
+                ofx = self.parse_download(f, key, acct.description)
+                if ofx is not None:
+                    self.archive_response(f, ofx, acct.description)
+            if ofx is None:
+                return (ofx, [])
             if not (hasattr(ofx, "account")):
                 # some banks return this for no txns
                 if days >= max_days:
@@ -146,18 +353,10 @@ class OfxSynchronizer(Synchronizer):
                 new_txns = self.filter(txns, ofx.account.account_id)
                 logging.debug("txns: %d" % (len(txns)))
                 logging.debug("new txns: %d" % (len(new_txns)))
-                if (len(txns) > 0) and (last_txns_len == len(txns)):
-                    # not getting more txns than last time; we have
-                    # reached the beginning
-                    logging.debug("Not getting more txns than last time, done.")
-                    return (ofx, new_txns)
-                elif (len(txns) > len(new_txns)) or (days >= max_days):
-                    # got more txns than were new or hit max_days, we've
-                    # reached a stopping point
-                    if days >= max_days:
-                        logging.debug("Hit max days.")
-                    else:
-                        logging.debug("Got some stale txns.")
+                if self.is_done(
+                    len(txns), len(new_txns), last_txns_len, days, max_days
+                ):
+                    self.fetched[acct] = (key, digest)
                     return (ofx, new_txns)
                 else:
                     # all txns were new, increase how far back we go
@@ -167,52 +366,372 @@ class OfxSynchronizer(Synchronizer):
                     logging.debug("Increasing days ago to %d." % (days))
                     last_txns_len = len(txns)
 
+    def get_new_txns_combined(self, accts, pool, max_days=999999, resync=False):
+        """Like get_new_txns, for several accounts at one institution. Each
+        download is one request for all the accounts that need to go
+        further back, made over a connection from pool.
+
+        Return a dict mapping each of accts to (ofx, account, new_txns),
+        where account is the statement of acct in the response ofx, or to
+        (None, None, None) if there is nothing to convert. An account the
+        server leaves out of a combined response is downloaded on its own
+        (see get_new_txns)."""
+        from ledgerautosync import download
+
+        if resync or (max_days < 7):
+            days = max_days
+        else:
+            days = 7
+        description = accts[0].institution.description
+        last_txns_len = dict((acct.number, 0) for acct in accts)
+        results = {}
+        missing = []
+        pending = list(accts)
+        while pending:
+            logging.debug(
+                "Downloading %d days of transactions for %d accounts at %s "
+                "(max_days=%d)." % (days, len(pending), description, max_days)
+            )
+            key = download.response_key(pending, days)
+            f, digest = self.fetch(key, lambda: download.download(pending, days, pool))
+            unchanged = [
+                acct for acct in pending if self.is_processed(key, acct, digest)
+            ]
+            if len(unchanged) == len(pending):
+                f.close()
+                logging.debug("Statements of %s are unchanged." % (description))
+                metrics.inc("statements_unchanged", len(unchanged))
+                ofx = None
+            else:
+                with f:
+                    ofx = self.parse_download(f, key, description)
+                    if ofx is not None:
+                        self.archive_response(f, ofx, self.account_names(pending))
+            if ofx is None:
+                for acct in pending:
+                    results[acct] = (None, None, None)
+                break
+            # split the response back per account
+            statements = dict((account.account_id, account) for account in ofx.accounts)
+            unfinished = []
+            for acct in pending:
+                if acct in unchanged:
+                    logging.debug("Statement of %s is unchanged." % (acct.description))
+                    metrics.inc("statements_unchanged")
+                    results[acct] = (None, None, None)
+                    continue
+                account = statements.get(acct.number)
+                if account is None:
+                    missing.append(acct)
+                    continue
+                txns = account.statement.transactions
+                with metrics.labels(account=acct.description):
+                    new_txns = self.filter(txns, account.account_id)
+                logging.debug(
+                    "%s: txns: %d, new txns: %d"
+                    % (acct.description, len(txns), len(new_txns))
+                )
+                if self.is_done(
+                    len(txns), len(new_txns), last_txns_len[acct.number], days, max_days
+                ):
+                    results[acct] = (ofx, account, new_txns)
+                    self.fetched[acct] = (key, digest)
+                else:
+                    last_txns_len[acct.number] = len(txns)
+                    unfinished.append(acct)
+            pending = unfinished
+            days = min(days * 2, max_days)
+            if pending:
+                logging.debug("Increasing days ago to %d." % (days))
+        for acct in missing:
+            logging.warning(
+                "%s is not in the combined response from %s, downloading it "
+                "on its own." % (acct.description, description)
+            )
+            metrics.inc("combined_missing")
+            with metrics.labels(account=acct.description):
+                ofx, new_txns = self.get_new_txns(acct, max_days, resync)
+            if ofx is None:
+                results[acct] = (None, None, None)
+            else:
+                results[acct] = (ofx, ofx.account, new_txns)
+        return results
+
+    @staticmethod
+    def backfill_windows(max_days, window_days):
+        """Return the (days, until_days) ranges, newest first, that cover the
+        last max_days days in windows of window_days days. Adjacent
+        windows share their boundary day; until_days is None for the
+        newest window, which runs up to now."""
+        windows = []
+        until_days = 0
+        while until_days < max_days:
+            days = min(until_days + window_days, max_days)
+            windows.append((days, until_days or None))
+            until_days = days
+        return windows
+
+    def download_window(self, accts, pool, days, until_days):
+        """Download and parse one backfill window of accts, retrying it up
+        to BACKFILL_RETRIES times. Return (f, ofx), f being the spooled
+        response."""
+        from ledgerautosync import download
+
+        description = accts[0].institution.description
+        key = download.response_key(accts, days, until_days)
+        attempt = 0
+        while True:
+            try:
+                f, digest = self.fetch(
+                    key, lambda: download.download(accts, days, pool, until_days)
+                )
+                try:
+                    return (f, self.parse_download(f, key, description))
+                except BaseException:
+                    f.close()
+                    raise
+            except KeyboardInterrupt:
+                raise
+            except Exception as ex:
+                if attempt >= BACKFILL_RETRIES:
+                    raise
+                attempt += 1
+                metrics.inc("backfill_retries")
+                logging.warning(
+                    "Downloading %d to %d days ago for %s failed (%s), retrying."
+                    % (days, until_days or 0, description, ex)
+                )
+
+    def backfill(self, accts, pool, window_days, max_days=999999, jobs=1):
+        """Download the last max_days days of accts, which are at one
+        institution, in windows of window_days days, up to jobs of them at
+        once. Windows are parsed on their own and their statements merged
+        per account, dropping transactions that several windows have.
+
+        Return a dict like get_new_txns_combined."""
+        windows = self.backfill_windows(max_days, window_days)
+        logging.debug(
+            "Backfilling %d days for %d accounts at %s in %d windows."
+            % (
+                max_days,
+                len(accts),
+                accts[0].institution.description,
+                len(windows),
+            )
+        )
+
+        def fetch(window):
+            return self.download_window(accts, pool, *window)
+
+        responses = []
+        for f, ofx in map_ordered(fetch, windows, jobs):
+            with f:
+                if ofx is None:
+                    continue
+                self.archive_response(f, ofx, self.account_names(accts))
+            responses.append(ofx)
+        # Every window is converted with the securities of all of them
+        securities = {}
+        for ofx in responses:
+            for sec in getattr(ofx, "security_list", None) or []:
+                securities.setdefault(sec.uniqueid, sec)
+        for ofx in responses:
+            if securities:
+                ofx.security_list = list(securities.values())
+
+        results = {}
+        for acct in accts:
+            merged = None
+            seen = set()
+            txns = []
+            # newest first, so that the balance and positions are current
+            for ofx in responses:
+                for account in ofx.accounts:
+                    if account.account_id != acct.number:
+                        continue
+                    if merged is None:
+                        merged = (ofx, account)
+                    for txn in account.statement.transactions:
+                        if txn.id not in seen:
+                            seen.add(txn.id)
+                            txns.append(txn)
+            if merged is None:
+                results[acct] = (None, None, None)
+                continue
+            ofx, account = merged
+            account.statement.transactions = txns
+            with metrics.labels(account=acct.description):
+                new_txns = self.filter(txns, account.account_id)
+            logging.debug(
+                "%s: txns: %d, new txns: %d"
+                % (acct.description, len(txns), len(new_txns))
+            )
+            results[acct] = (ofx, account, new_txns)
+        return results
+
 
 class CsvSynchronizer(Synchronizer):
-    def __init__(self, lgr, payee_format=None, date_format=None):
-        super(CsvSynchronizer, self).__init__(lgr)
+    def __init__(
+        self,
+        lgr,
+        payee_format=None,
+        date_format=None,
+        date_slack=None,
+        index=None,
+        prefilter=None,
+        archive=None,
+        batch_ids=None,
+        processes=None,
+        fmt=None,
+    ):
+        super(CsvSynchronizer, self).__init__(
+            lgr,
+            date_slack=date_slack,
+            index=index,
+            prefilter=prefilter,
+            archive=archive,
+            batch_ids=batch_ids,
+        )
         self.payee_format = payee_format
         self.date_format = date_format
+        # convert large files in up to this many processes, and if fmt
+        # is given, return what they convert formatted with these
+        # (indent, assertions)
+        self.processes = processes
+        self.fmt = fmt
 
-    def is_row_synced(self, converter, row):
+    def is_row_synced(self, converter, row, window=None):
         if self.lgr is None:
             # User called with --no-ledger
             # All transactions are considered "synced" in this case.
             return False
         else:
-            return self.lgr.check_transaction_by_id("csvid", converter.get_csv_id(row))
+            return self.check_id("csvid", converter.get_csv_id(row), window)
 
-    def parse_file(self, path, accountname=None, unknownaccount=None):
+    def parse_file(self, path, accountname=None, unknownaccount=None, offset=0):
+        """Return the converted transactions of the CSV file at path (or of
+        the text file path) that are not in the ledger. If offset is
+        given, the rows before that byte offset (which must be at the start
+        of a row) were imported before and are not read."""
+        if hasattr(path, "read"):
+            return self.parse(path, accountname, unknownaccount, offset)
+        if self.processes is not None and self.processes > 1:
+            retval = self.parse_parallel(path, accountname, unknownaccount, offset)
+            if retval is not None:
+                return retval
         with open(path) as f:
-            has_bom = f.read(3) == codecs.BOM_UTF8
-            if not (has_bom):
-                f.seek(0)
-            else:
-                f.seek(3)
-            dialect = csv.Sniffer().sniff(f.readline())
-            if not (has_bom):
-                f.seek(0)
-            else:
-                f.seek(3)
-            dialect.skipinitialspace = True
-            reader = csv.DictReader(f, dialect=dialect)
-            converter = CsvConverter.make_converter(
-                set(reader.fieldnames),
+            return self.parse(f, accountname, unknownaccount, offset)
+
+    def read_header(self, header, accountname, unknownaccount):
+        """Return the converter, dialect and field names for a CSV file with
+        the header line header."""
+        if header.startswith("\ufeff"):
+            header = header[1:]
+        dialect = csv.Sniffer().sniff(header)
+        dialect.skipinitialspace = True
+        converter = CsvConverter.make_converter(
+            set(next(csv.reader([header], dialect=dialect))),
+            dialect,
+            ledger=self.lgr,
+            **self.converter_args(accountname, unknownaccount)
+        )
+        # Parse the header again in case the converter modified the dialect
+        fieldnames = next(csv.reader([header], dialect=dialect))
+        return (converter, dialect, fieldnames)
+
+    def converter_args(self, accountname, unknownaccount):
+        return {
+            "name": accountname,
+            "unknownaccount": unknownaccount,
+            "payee_format": self.payee_format,
+            "date_format": self.date_format,
+        }
+
+    def parse(self, f, accountname=None, unknownaccount=None, offset=0):
+        """Like parse_file, reading the CSV from the text file f. f is only
+        read forwards, unless offset is given."""
+        converter, dialect, fieldnames = self.read_header(
+            f.readline(), accountname, unknownaccount
+        )
+        if offset:
+            f.seek(offset)
+        reader = csv.DictReader(f, fieldnames=fieldnames, dialect=dialect)
+        archived = []
+        window = None
+        if self.date_slack is not None:
+            reader = list(reader)
+            window = self.date_window([converter.get_date(row) for row in reader])
+        retval = []
+        seen = 0
+        for row in reader:
+            seen += 1
+            if self.archive is not None:
+                archived.append(
+                    (converter.get_csv_id(row), converter.get_date(row), row)
+                )
+            with profiling.span("dedup"):
+                synced = self.is_row_synced(converter, row, window)
+            if not synced:
+                with profiling.span("convert"):
+                    retval.append(converter.convert(row))
+        if self.archive is not None:
+            self.archive.add_csv(accountname, fieldnames, dialect, archived)
+        metrics.gauge("transactions_seen", seen)
+        metrics.gauge("transactions_new", len(retval))
+        metrics.gauge("transactions_deduplicated", seen - len(retval))
+        return retval
+
+    def parse_parallel(self, path, accountname=None, unknownaccount=None, offset=0):
+        """Like parse_file, converting the rows in self.processes processes.
+        The rows are converted before they are looked up in the ledger,
+        which only this process consults. Return None if the file is too
+        small to split, or its converter or dialect does not allow it."""
+        from ledgerautosync import csvsplit
+
+        with open(path) as f:
+            converter, dialect, fieldnames = self.read_header(
+                f.readline(), accountname, unknownaccount
+            )
+        if not (converter.PARALLEL and csvsplit.can_split(dialect)):
+            return None
+        quotechar = dialect.quotechar
+        if dialect.quoting == csv.QUOTE_NONE:
+            quotechar = None
+        with open(path, "rb") as f:
+            start = offset or len(f.readline())
+            with profiling.span("split"):
+                ranges = csvsplit.split(f, start, quotechar)
+        if len(ranges) < 2 or csvsplit.get_context() is None:
+            return None
+        with profiling.span("convert"):
+            records = list(
+                csvsplit.convert(
+                    path,
+                    ranges,
+                    converter,
+                    fieldnames,
+                    self.converter_args(accountname, unknownaccount),
+                    self.processes,
+                    fmt=self.fmt,
+                    keep_rows=self.archive is not None,
+                )
+            )
+        window = None
+        if self.date_slack is not None:
+            window = self.date_window([date for (_, date, _, _) in records])
+        retval = []
+        with profiling.span("dedup"):
+            for csvid, date, txn, row in records:
+                if self.lgr is None or not self.check_id("csvid", csvid, window):
+                    retval.append(txn)
+        if self.archive is not None:
+            self.archive.add_csv(
+                accountname,
+                fieldnames,
                 dialect,
-                ledger=self.lgr,
-                name=accountname,
-                unknownaccount=unknownaccount,
-                payee_format=self.payee_format,
-                date_format=self.date_format,
+                [(csvid, date, row) for (csvid, date, _, row) in records],
             )
-            # Create a new reader in case the converter modified the dialect
-            if not (has_bom):
-                f.seek(0)
-            else:
-                f.seek(3)
-            reader = csv.DictReader(f, dialect=dialect)
-            return [
-                converter.convert(row)
-                for row in reader
-                if not (self.is_row_synced(converter, row))
-            ]
+        metrics.gauge("transactions_seen", len(records))
+        metrics.gauge("transactions_new", len(retval))
+        metrics.gauge("transactions_deduplicated", len(records) - len(retval))
+        return retval
@@ -0,0 +1,108 @@
+# Copyright (c) 2013-2021 Erik Hetzner
+#
+# This file is part of ledger-autosync
+#
+# ledger-autosync is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# ledger-autosync is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with ledger-autosync. If not, see
+# <http://www.gnu.org/licenses/>.
+
+
+"""Pair up the two sides of transfers between accounts synced in the
+same run.
+
+A transfer from checking to savings shows up in both statements, each
+converted with an unknown (or inferred) counter-account. Transactions
+with two postings are joined on the commodity and amount of their first
+posting (the account that was synced): a transaction for -X in one
+account is paired with a transaction for +X in another account dated at
+most `days` apart, preferring the closest date. The pair is merged into
+one transaction whose postings are the two synced accounts, each keeping
+its ofxid, so that neither side is imported again.
+"""
+
+import datetime
+
+from ledgerautosync.converter import Transaction
+
+
+def signed_number(amount):
+    if amount.reverse:
+        return -amount.number
+    return amount.number
+
+
+def to_date(d):
+    if isinstance(d, datetime.datetime):
+        return d.date()
+    return d
+
+
+def join_key(txn):
+    if not isinstance(txn, Transaction) or len(txn.postings) != 2:
+        return None
+    amount = txn.postings[0].amount
+    if amount.currency != txn.postings[1].amount.currency:
+        return None
+    number = signed_number(amount)
+    if number == 0:
+        return None
+    return (amount.currency, number)
+
+
+def merge(first, second):
+    metadata = dict(second.metadata)
+    metadata.update(first.metadata)
+    return Transaction(
+        date=first.date,
+        payee=first.payee,
+        postings=[first.postings[0], second.postings[0]],
+        checknum=first.checknum,
+        cleared=first.cleared and second.cleared,
+        metadata=metadata,
+        aux_date=first.aux_date,
+        date_format=first.date_format,
+    )
+
+
+def pair_transfers(items, days):
+    """Return items with transfers merged. items is a list of Transaction
+    objects and other output (e.g. formatted balance assertions), in the
+    order they would be printed; a merged transaction takes the place of
+    the first of its two sides, and the second is dropped."""
+    result = list(items)
+    # (currency, signed amount) -> [(position in result, txn), ...] of
+    # transactions still waiting for their other side
+    pending = {}
+    for i, txn in enumerate(items):
+        key = join_key(txn)
+        if key is None:
+            continue
+        date = to_date(txn.date)
+        account = txn.postings[0].account
+        candidates = pending.get((key[0], -key[1]), [])
+        best = None
+        best_distance = None
+        for n, (j, other) in enumerate(candidates):
+            if other.postings[0].account == account:
+                continue
+            distance = abs((to_date(other.date) - date).days)
+            if distance <= days and (best is None or distance < best_distance):
+                best = n
+                best_distance = distance
+        if best is None:
+            pending.setdefault(key, []).append((i, txn))
+            continue
+        j, other = candidates.pop(best)
+        result[j] = merge(other, txn)
+        result[i] = None
+    return [item for item in result if item is not None]
@@ -0,0 +1,83 @@
+# Copyright (c) 2013-2021 Erik Hetzner
+#
+# This file is part of ledger-autosync
+#
+# ledger-autosync is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# ledger-autosync is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with ledger-autosync. If not, see
+# <http://www.gnu.org/licenses/>.
+
+import datetime
+import os.path
+from io import StringIO
+from unittest.mock import patch
+
+from ledgerautosync.archive import Archive
+from ledgerautosync.cli import run
+from ledgerautosync.sync import CsvSynchronizer, OfxSynchronizer
+
+
+def test_archive(tmpdir):
+    path = str(tmpdir.join("archive.sqlite"))
+    archive = Archive(path)
+    sync = OfxSynchronizer(None, archive=archive)
+    sync.load_file(os.path.join("fixtures", "checking.ofx"), "Assets:Checking")
+    # archiving the same file again does not duplicate anything
+    sync.load_file(os.path.join("fixtures", "checking.ofx"), "Assets:Checking")
+    sync = CsvSynchronizer(None, archive=archive)
+    sync.parse_file(os.path.join("fixtures", "paypal.csv"), accountname="Assets:Paypal")
+    assert archive.db.execute("SELECT COUNT(*) FROM statements").fetchone() == (2,)
+    rows = list(archive.transactions())
+    assert len(rows) == 5
+    assert [(s.format, key) for (s, key, _, _) in rows].count(("csv", "csvid")) == 2
+    rows = list(archive.transactions(since=datetime.date(2011, 4, 6)))
+    assert [id for (_, _, id, _) in rows] == [
+        "1452687~7.0000488",
+        "paypal.XYZ1",
+        "paypal.XYZ2",
+    ]
+    rows = list(archive.transactions(account="Assets:Paypal"))
+    assert rows[0][0].fieldnames[0] == "Date"
+    assert rows[0][3]["Transaction ID"] == "XYZ1"
+    archive.close()
+
+
+def test_reconvert(tmpdir):
+    path = str(tmpdir.join("archive.sqlite"))
+    with patch("sys.stdout", new_callable=StringIO):
+        run(["-L", "--archive", path, "-a", "Assets:Paypal", "fixtures/paypal.csv"])
+        run(["-L", "--archive", path, "fixtures/checking.ofx"])
+    with patch("sys.stdout", new_callable=StringIO) as mock_stdout:
+        run(
+            [
+                "reconvert",
+                "-L",
+                "--archive",
+                path,
+                "-a",
+                "1452687~7",
+                "--since",
+                "2011-04-01",
+                "--payee-format",
+                "{memo} / {payee}",
+            ]
+        )
+    output = mock_stdout.getvalue()
+    assert output.count("ofxid: ") == 2
+    assert "csvid: " not in output
+    assert "RETURNED CHECK FEE, CHECK # 319 FOR $45.33 ON 04/07/11 / " in output
+    with patch("sys.stdout", new_callable=StringIO) as mock_stdout:
+        run(["reconvert", "-L", "--archive", path])
+    output = mock_stdout.getvalue()
+    assert output.count("ofxid: ") == 3
+    assert output.count("csvid: paypal.") == 2
+    assert output.index("ofxid: ") < output.index("csvid: ")
@@ -0,0 +1,117 @@
+# Copyright (c) 2013-2021 Erik Hetzner
+#
+# This file is part of ledger-autosync
+#
+# ledger-autosync is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# ledger-autosync is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with ledger-autosync. If not, see
+# <http://www.gnu.org/licenses/>.
+
+import os.path
+import shutil
+from unittest.mock import Mock
+
+import pytest
+
+from ledgerautosync.bloom import BloomFilter
+from ledgerautosync.cli import run
+from ledgerautosync.index import IdIndex
+from ledgerautosync.sync import CsvSynchronizer, OfxSynchronizer
+
+
+def test_false_positive_rate(tmpdir):
+    bloom = BloomFilter.for_capacity(10000, 0.01)
+    for i in range(10000):
+        bloom.add("ofxid=%d" % (i))
+    path = str(tmpdir.join("bloom"))
+    bloom.write(path)
+    bloom = BloomFilter.open(path)
+    assert all("ofxid=%d" % (i) in bloom for i in range(10000))
+    false_positives = sum("csvid=%d" % (i) in bloom for i in range(10000))
+    assert false_positives < 200
+    bloom.close()
+
+
+def mk_index(tmpdir, fp_rate):
+    path = str(tmpdir.join("journal.lgr"))
+    if not os.path.exists(path):
+        shutil.copy(os.path.join("fixtures", "checking.lgr"), path)
+    idx = IdIndex(path, directory=str(tmpdir.join("index")), fp_rate=fp_rate)
+    idx.update()
+    return (path, idx)
+
+
+def test_invalid_false_positive_rate(capsys):
+    for rate in (0, 1, 1.5, -0.1):
+        with pytest.raises(ValueError):
+            BloomFilter.for_capacity(10, rate)
+    path = os.path.join("fixtures", "checking.ofx")
+    for rate in ("0", "1", "2", "x"):
+        with pytest.raises(SystemExit):
+            run(["-L", "--bloom-fp-rate", rate, path])
+    assert "invalid rate" in capsys.readouterr().err
+
+
+def test_index_bloom(tmpdir):
+    (path, idx) = mk_index(tmpdir, 0.01)
+    assert idx.might_contain("ofxid", "1101.1452687~7.0000486")
+    assert idx.might_contain("ofxid", "1452687~7.0000486")
+    assert not idx.might_contain("ofxid", "not there")
+    idx.close()
+
+    with open(path, "a") as f:
+        f.write("\n2011/05/01 New\n  ; ofxid: new1\n  Assets:Foo  $1\n  Income\n")
+    (_, idx) = mk_index(tmpdir, 0.01)
+    assert idx.might_contain("ofxid", "new1")
+    assert idx.check_transaction_by_id("ofxid", "new1")
+    idx.close()
+
+    # appends made without the filter invalidate it
+    with open(path, "a") as f:
+        f.write("\n2011/05/02 New\n  ; ofxid: new2\n  Assets:Foo  $1\n  Income\n")
+    (_, idx) = mk_index(tmpdir, None)
+    assert idx.bloom is None
+    (_, idx) = mk_index(tmpdir, 0.001)
+    assert idx.bloom.fp_rate == 0.001
+    assert idx.might_contain("ofxid", "new2")
+
+
+def test_prefilter_skips_backend(tmpdir):
+    (_, idx) = mk_index(tmpdir, 0.01)
+    ledger = Mock()
+    ledger.check_transaction_by_id = Mock(return_value=True)
+    sync = OfxSynchronizer(ledger, prefilter=idx)
+    ofx = OfxSynchronizer.parse_file(os.path.join("fixtures", "checking.ofx"))
+    txns = sync.filter(ofx.account.statement.transactions, ofx.account.account_id)
+    assert txns == []
+    assert ledger.check_transaction_by_id.call_count == 3
+    assert not sync.check_id("ofxid", "1452687~7.9999999")
+    assert ledger.check_transaction_by_id.call_count == 3
+
+
+def test_prefilter_prefixed_csvids(tmpdir):
+    # Mint csvids are written as "mint.<hash>" but looked up as "<hash>"
+    txns = CsvSynchronizer(None).parse_file(
+        os.path.join("fixtures", "mint.csv"), accountname="Foo"
+    )
+    path = str(tmpdir.join("journal.lgr"))
+    with open(path, "w") as f:
+        f.write("\n".join(txn.format() for txn in txns))
+    idx = IdIndex(path, directory=str(tmpdir.join("index")), fp_rate=0.01)
+    idx.update()
+    ledger = Mock()
+    ledger.check_transaction_by_id = Mock(return_value=True)
+    sync = CsvSynchronizer(ledger, prefilter=idx)
+    assert (
+        sync.parse_file(os.path.join("fixtures", "mint.csv"), accountname="Foo") == []
+    )
+    assert ledger.check_transaction_by_id.call_count == 2
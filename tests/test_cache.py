@@ -0,0 +1,64 @@
+# Copyright (c) 2013-2021 Erik Hetzner
+#
+# This file is part of ledger-autosync
+#
+# ledger-autosync is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# ledger-autosync is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with ledger-autosync. If not, see
+# <http://www.gnu.org/licenses/>.
+
+import os
+from io import BytesIO, StringIO
+
+from ledgerautosync.cache import Fingerprint, StatementCache, spool
+
+
+def fingerprint(data, size):
+    digest = Fingerprint()
+    for i in range(0, len(data), size):
+        digest.update(data[i : i + size])
+    return digest.hexdigest()
+
+
+def test_fingerprint_ignores_request_ids():
+    with open(os.path.join("fixtures", "checking.ofx"), "rb") as f:
+        data = f.read()
+    other = data.replace(b"<TRNUID>0", b"<TRNUID>4f3a9c").replace(
+        b"<DTSERVER>20", b"<DTSERVER>21"
+    )
+    assert other != data
+    expected = fingerprint(data, len(data))
+    for size in (1, 7, 100, len(data)):
+        assert fingerprint(data, size) == expected
+        assert fingerprint(other, size) == expected
+    assert fingerprint(data.replace(b"<TRNAMT>-", b"<TRNAMT>"), 100) != expected
+
+
+def test_statement_cache(tmpdir):
+    cache = StatementCache(str(tmpdir), ttl=60)
+    assert cache.get("a") is None
+    f, digest, size = cache.put("a", StringIO("<OFX>data</OFX>"))
+    assert f.read() == b"<OFX>data</OFX>"
+    f.close()
+    f, cached_digest, cached_size = cache.get("a")
+    f.close()
+    assert (cached_digest, cached_size) == (digest, size)
+    assert digest == spool(BytesIO(b"<OFX>data</OFX>"), BytesIO())[0]
+
+    assert not cache.is_processed("a", "1234", digest)
+    cache.mark_processed("a", "1234", digest)
+    assert cache.is_processed("a", "1234", digest)
+    assert not cache.is_processed("a", "5678", digest)
+
+    expired = StatementCache(str(tmpdir), ttl=0)
+    assert expired.get("a") is None
+    assert expired.is_processed("a", "1234", digest)
@@ -0,0 +1,160 @@
+# Copyright (c) 2013-2021 Erik Hetzner
+#
+# This file is part of ledger-autosync
+#
+# ledger-autosync is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# ledger-autosync is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with ledger-autosync. If not, see
+# <http://www.gnu.org/licenses/>.
+
+import json
+import os
+import shutil
+from unittest.mock import Mock
+
+import pytest
+
+from ledgerautosync import LedgerAutosyncException
+from ledgerautosync.checkpoint import Checkpoint, position
+from ledgerautosync.cli import run
+from ledgerautosync.sync import OfxSynchronizer
+
+TXN = """2016/06/05 Jane Doe
+    ; csvid: paypal.XYZ4
+    Assets:Paypal  -30.00 USD
+    Expenses:Misc
+"""
+
+
+def test_resume(tmpdir):
+    first = str(tmpdir.join("first.csv"))
+    second = str(tmpdir.join("second.csv"))
+    shutil.copy(os.path.join("fixtures", "paypal.csv"), first)
+    journal = str(tmpdir.join("journal.ledger"))
+    checkpoint = str(tmpdir.join("checkpoint.jsonl"))
+
+    def import_files(*options):
+        with open(journal, "a") as f:
+            with pytest.MonkeyPatch.context() as mp:
+                mp.setattr("sys.stdout", f)
+                run(["-L", "-a", "Paypal", first, second] + list(options))
+
+    # the second file is missing: the run is interrupted after the first
+    with pytest.raises(FileNotFoundError):
+        import_files("--checkpoint", checkpoint)
+    with open(journal) as f:
+        assert f.read().count("csvid: ") == 2
+    with open(checkpoint) as f:
+        records = [json.loads(line) for line in f]
+    assert [r.get("phase") for r in records] == [None, "started", "output", "done"]
+    assert records[1]["position"][2] == 0
+    assert records[2]["end"] == os.path.getsize(journal)
+    # the ids output, as they are looked up
+    assert ["csvid", "paypal.XYZ1"] in records[2]["ids"]
+    assert ["csvid", "paypal.XYZ2"] in records[2]["ids"]
+
+    # resuming is only for the same files
+    with pytest.raises(LedgerAutosyncException):
+        run(["-L", "-a", "Paypal", "--checkpoint", checkpoint, "--resume", first])
+    shutil.copy(os.path.join("fixtures", "paypal.csv"), second)
+    import_files("--checkpoint", checkpoint, "--resume")
+    # the first file was not imported again
+    with open(journal) as f:
+        assert f.read().count("csvid: ") == 4
+    checkpoint = Checkpoint(checkpoint, [first, second], resume=True)
+    assert checkpoint.phase(first) == "done"
+    assert checkpoint.phase(second) == "done"
+    with open(second, "a") as f:
+        f.write("\n")
+    assert checkpoint.phase(second) is None
+    checkpoint.close()
+
+
+def test_interrupted_output(tmpdir):
+    path = str(tmpdir.join("paypal.csv"))
+    shutil.copy(os.path.join("fixtures", "paypal.csv"), path)
+    journal = str(tmpdir.join("journal.ledger"))
+    checkpoint_path = str(tmpdir.join("checkpoint.jsonl"))
+    checkpoint = Checkpoint(checkpoint_path, [path])
+    with open(journal, "w") as f:
+        f.write(TXN.replace("XYZ4", "XYZ3") + "\n")
+        checkpoint.start(path, position(f))
+        # killed after writing some of its output
+        f.write(TXN)
+    checkpoint.close()
+
+    checkpoint = Checkpoint(checkpoint_path, [path], resume=True)
+    assert checkpoint.phase(path) == "started"
+    assert checkpoint.ids(journal) == {("csvid", "paypal.XYZ4"), ("csvid", "XYZ4")}
+    assert checkpoint.ids(str(tmpdir.join("other.ledger"))) == set()
+    checkpoint.close()
+
+
+def test_resume_started(tmpdir):
+    path = str(tmpdir.join("paypal.csv"))
+    shutil.copy(os.path.join("fixtures", "paypal.csv"), path)
+    journal = str(tmpdir.join("journal.ledger"))
+    checkpoint_path = str(tmpdir.join("checkpoint.jsonl"))
+    with open(journal, "w") as f:
+        with pytest.MonkeyPatch.context() as mp:
+            mp.setattr("sys.stdout", f)
+            run(["-L", "-a", "Paypal", path])
+    with open(journal) as f:
+        txns = f.read().split("\n\n")
+    assert len(txns) > 2
+
+    checkpoint = Checkpoint(checkpoint_path, [path])
+    with open(journal, "w") as f:
+        checkpoint.start(path, position(f))
+        # killed after writing its first transaction
+        f.write(txns[0] + "\n\n")
+    checkpoint.close()
+
+    ledger = Mock()
+    ledger.check_transaction_by_id = Mock(return_value=False)
+    with open(journal, "a") as f:
+        with pytest.MonkeyPatch.context() as mp:
+            mp.setattr("sys.stdout", f)
+            mp.setattr("ledgerautosync.cli.mk_ledger", Mock(return_value=ledger))
+            run(
+                ["-l", journal, "-a", "Paypal", "--checkpoint", checkpoint_path]
+                + ["--resume", path]
+            )
+    with open(journal) as f:
+        assert f.read().split("\n\n") == txns
+    checkpoint = Checkpoint(checkpoint_path, [path], resume=True)
+    assert checkpoint.phase(path) == "done"
+    assert ("csvid", "paypal.XYZ1") in checkpoint.ids()
+    checkpoint.close()
+
+
+def test_interrupted_ofx_output(tmpdir):
+    path = os.path.join("fixtures", "checking.ofx")
+    journal = str(tmpdir.join("journal.ledger"))
+    checkpoint_path = str(tmpdir.join("checkpoint.jsonl"))
+    checkpoint = Checkpoint(checkpoint_path, [path])
+    with open(journal, "w") as f:
+        checkpoint.start(path, position(f))
+        with pytest.MonkeyPatch.context() as mp:
+            mp.setattr("sys.stdout", f)
+            run(["-L", path])
+    checkpoint.close()
+
+    checkpoint = Checkpoint(checkpoint_path, [path], resume=True)
+    # the ids are looked up without the FID written to the journal
+    ledger = Mock()
+    ledger.check_transaction_by_id = Mock(return_value=False)
+    sync = OfxSynchronizer(ledger, batch_ids=checkpoint.ids(journal))
+    ofx = OfxSynchronizer.parse_file(path)
+    txns = sync.filter(ofx.account.statement.transactions, ofx.account.account_id)
+    assert txns == []
+    checkpoint.close()
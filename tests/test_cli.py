@@ -18,6 +18,8 @@
 
 import os.path
 import re
+import subprocess
+import sys
 import tempfile
 from io import StringIO
 from unittest.mock import Mock, call, patch
@@ -43,6 +45,23 @@ def test_run():
     assert config.accounts.call_count == 1
 
 
+def test_backfill_warnings(capsys):
+    config = OfxConfig(os.path.join("fixtures", "ofxclient.ini"))
+    acct = config.accounts()[0]
+    acct.download = Mock(
+        side_effect=lambda *args, **kwargs: open(
+            os.path.join("fixtures", "checking.ofx"), "rb"
+        )
+    )
+    config.accounts = Mock(return_value=[acct])
+    with patch("ledgerautosync.download.can_combine", return_value=False):
+        run(["-L", "--backfill", "30", "--max", "20"], config)
+    err = capsys.readouterr().err
+    assert "Backfilling only the last 20 days" in err
+    assert "Cannot backfill %s, downloading it as usual" % (acct.description) in err
+    assert acct.download.called
+
+
 def test_run_csv_file():
     config = OfxConfig(os.path.join("fixtures", "ofxclient.ini"))
     run(
@@ -148,3 +167,63 @@ def test_no_ledger():
                 mock_stdout.getvalue()
                 == "LEDGER_FILE environment variable not set, and no .ledgerrc file found, and -l argument was not supplied: running with deduplication disabled. All transactions will be printed!\n"
             )
+
+
+def test_csv_import_does_not_load_ofx_modules():
+    code = (
+        "import sys; from ledgerautosync.cli import run; "
+        "run(['-L', '-a', 'Assets:Foo', %r]); "
+        "sys.stderr.write(' '.join(sys.modules))"
+        % (os.path.join("fixtures", "paypal.csv"),)
+    )
+    env = dict(os.environ, LEDGER_FILE=os.path.join("fixtures", "empty.lgr"))
+    modules = subprocess.run(
+        [sys.executable, "-c", code],
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+        universal_newlines=True,
+        check=True,
+    ).stderr.split()
+    assert "ofxclient" not in modules
+    assert "ofxparse" not in modules
+
+
+def test_import_multi_account_ofx():
+    outputs = []
+    for jobs in ("1", "2"):
+        with patch("sys.stdout", new_callable=StringIO) as mock_stdout:
+            run(
+                [
+                    "-L",
+                    "-j",
+                    jobs,
+                    "-a",
+                    "Assets:Bank",
+                    os.path.join("fixtures", "multi_account.ofx"),
+                ]
+            )
+        outputs.append(mock_stdout.getvalue())
+    assert outputs[0] == outputs[1]
+    output = outputs[0]
+    assert output.count("Assets:Bank:1452687~7") == 3
+    assert output.count("Assets:Bank:8765432~1") == 1
+    # grouped per account, in file order
+    assert output.index("Assets:Bank:1452687~7") < output.index("Assets:Bank:8765432~1")
+    assert "ofxid: 1101.8765432~1.0000901" in output
+
+
+def test_import_multi_account_ofx_merge_by_date():
+    with patch("sys.stdout", new_callable=StringIO) as mock_stdout:
+        run(
+            [
+                "-L",
+                "-a",
+                "Assets:Bank",
+                "--merge-by-date",
+                os.path.join("fixtures", "multi_account.ofx"),
+            ]
+        )
+    dates = re.findall(r"^(\d{4}/\d\d/\d\d) ", mock_stdout.getvalue(), re.M)
+    assert dates == sorted(dates)
+    assert len(dates) == 4
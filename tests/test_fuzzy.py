@@ -0,0 +1,112 @@
+# Copyright (c) 2013-2021 Erik Hetzner
+#
+# This file is part of ledger-autosync
+#
+# ledger-autosync is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# ledger-autosync is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with ledger-autosync. If not, see
+# <http://www.gnu.org/licenses/>.
+
+import datetime
+from argparse import Namespace
+from decimal import Decimal
+
+from ledgerautosync.cli import check_fuzzy
+from ledgerautosync.converter import Amount, Posting, Transaction
+from ledgerautosync.fuzzy import FuzzyMatcher, parse_amount
+
+
+def mk_txn(date, payee, amount):
+    return Transaction(
+        date=date,
+        payee=payee,
+        postings=[
+            Posting("Assets:Checking", Amount(Decimal(amount), "$")),
+            Posting("Expenses:Misc", Amount(Decimal(amount), "$", reverse=True)),
+        ],
+    )
+
+
+def test_parse_amount():
+    assert parse_amount("$1,234.50") == (Decimal("1234.50"), "$")
+    assert parse_amount("-$10") == (Decimal("-10"), "$")
+    assert parse_amount("$-10") == (Decimal("-10"), "$")
+    assert parse_amount("20.00 USD @ $1") == (Decimal("20.00"), "USD")
+    assert parse_amount('5 "ABC123"') == (Decimal("5"), "ABC123")
+    assert parse_amount("(1 + 2)") is None
+
+
+def test_match(tmpdir):
+    lgr = tmpdir.join("main.lgr")
+    lgr.write(
+        "2020/01/02 Coffee Shop\n"
+        "    Expenses:Coffee  $4.50\n"
+        "    Assets:Checking\n"
+        "\n"
+        "2020/01/03 Grocery Store\n"
+        "    Expenses:Food  $4.50\n"
+        "    Assets:Checking\n"
+        "\n"
+        "2020/01/03 Already synced\n"
+        "    Assets:Checking  -$30.00\n"
+        "    ; ofxid: 1.2.3\n"
+        "    Expenses:Misc\n"
+        "\n"
+        "2020/01/20 Grocery Store\n"
+        "    Expenses:Food  $4.50\n"
+        "    Assets:Checking\n"
+    )
+    matcher = FuzzyMatcher(str(lgr), days=3)
+    match = matcher.match(mk_txn(datetime.date(2020, 1, 1), "COFFEE SHOP #12", "-4.50"))
+    assert match.entry.payee == "Coffee Shop"
+    assert match.location() == "%s:1" % (lgr)
+    # the best candidate was used; the next one is still available
+    match = matcher.match(mk_txn(datetime.date(2020, 1, 1), "COFFEE SHOP #12", "-4.50"))
+    assert match.entry.payee == "Grocery Store"
+    assert match.entry.line == 5
+    assert matcher.match(mk_txn(datetime.date(2020, 1, 1), "Coffee", "-4.50")) is None
+    # tagged transactions are left to ofxid/csvid deduplication
+    assert matcher.match(mk_txn(datetime.date(2020, 1, 3), "Synced", "-30")) is None
+    assert matcher.match(mk_txn(datetime.date(2020, 1, 20), "Grocery", "4.50")) is None
+
+
+def test_check_fuzzy(tmpdir):
+    lgr = tmpdir.join("main.lgr")
+    lgr.write(
+        "2020/01/02 Coffee Shop\n    Expenses:Coffee  $4.50\n    Assets:Checking\n"
+    )
+    txn = mk_txn(datetime.date(2020, 1, 2), "Coffee Shop", "-4.50")
+    args = Namespace(fuzzy_duplicates="annotate")
+    assert check_fuzzy(FuzzyMatcher(str(lgr)), txn, args) is txn
+    assert txn.metadata == {"possible_duplicate": "%s:1" % (lgr)}
+    assert mk_txn(datetime.date(2020, 1, 2), "Other", "-4.50").metadata == {}
+    args = Namespace(fuzzy_duplicates="suppress")
+    assert check_fuzzy(FuzzyMatcher(str(lgr)), txn, args) is None
+
+
+def test_match_commodity_and_date(tmpdir):
+    lgr = tmpdir.join("main.lgr")
+    lgr.write(
+        "".join(
+            "2020/%02d/01 Rent\n    Expenses:Rent  $4.50\n    Assets:Checking\n\n"
+            % (month)
+            for month in range(1, 13)
+        )
+        + "2021/01/02 Coffee Shop\n    Expenses:Coffee  4.50 EUR\n"
+        "    Assets:Checking\n"
+    )
+    matcher = FuzzyMatcher(str(lgr), days=3)
+    match = matcher.match(mk_txn(datetime.date(2020, 6, 3), "Rent", "-4.50"))
+    assert match.entry.date == datetime.date(2020, 6, 1)
+    assert matcher.match(mk_txn(datetime.date(2020, 6, 3), "Rent", "-4.50")) is None
+    # $4.50 is not 4.50 EUR
+    assert matcher.match(mk_txn(datetime.date(2021, 1, 2), "Coffee", "-4.50")) is None
@@ -0,0 +1,142 @@
+# Copyright (c) 2013-2021 Erik Hetzner
+#
+# This file is part of ledger-autosync
+#
+# ledger-autosync is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# ledger-autosync is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with ledger-autosync. If not, see
+# <http://www.gnu.org/licenses/>.
+
+import datetime
+import os
+import os.path
+import shutil
+from unittest.mock import patch
+
+from ledgerautosync import index
+from ledgerautosync.index import IdIndex
+from ledgerautosync.sync import CsvSynchronizer, OfxSynchronizer
+
+
+def mk_index(tmpdir, fixture):
+    path = str(tmpdir.join("journal.lgr"))
+    shutil.copy(os.path.join("fixtures", fixture), path)
+    idx = IdIndex(path, directory=str(tmpdir.join("index")))
+    idx.update()
+    return (path, idx)
+
+
+def test_lookup(tmpdir):
+    (_, idx) = mk_index(tmpdir, "checking.lgr")
+    assert idx.check_transaction_by_id("ofxid", "1101.1452687~7.0000486")
+    assert idx.check_transaction_by_id("ofxid", "empty")
+    # ids are cleaned as when they are written
+    assert idx.check_transaction_by_id("ofxid", "1/2")
+    assert not idx.check_transaction_by_id("ofxid", "1101.1452687~7.000048")
+    assert not idx.check_transaction_by_id("csvid", "empty")
+    # as looked up by OfxSynchronizer, without the FID
+    assert idx.check_transaction_by_id("ofxid", "1452687~7.0000486")
+    assert sorted(idx.segment_names()) == ["2011-03", "2011-04"]
+
+
+def test_window(tmpdir):
+    (_, idx) = mk_index(tmpdir, "checking.lgr")
+    ofxid = "1101.1452687~7.0000486"
+    window = (datetime.date(2011, 3, 28), datetime.date(2011, 4, 3))
+    assert idx.check_transaction_by_id("ofxid", ofxid, window)
+    idx.close()
+    window = (datetime.date(2011, 4, 1), datetime.date(2011, 5, 1))
+    assert not idx.check_transaction_by_id("ofxid", ofxid, window)
+    # only the segments in the window were opened
+    assert sorted(idx.segments) == ["2011-04", "2011-05"]
+
+
+def test_append_and_merge(tmpdir):
+    (path, idx) = mk_index(tmpdir, "checking.lgr")
+    with open(path, "a") as f:
+        f.write("\n2011/05/01 New\n  ; ofxid: new1\n  Assets:Foo  $1\n  Income\n")
+    idx = IdIndex(path, directory=idx.directory)
+    with patch.object(idx, "rebuild") as rebuild:
+        idx.update()
+        assert not rebuild.called
+    assert idx.head == {"2011-05": {"ofxid=new1"}}
+    assert idx.check_transaction_by_id("ofxid", "new1")
+
+    # postings appended to the last transaction keep its date
+    with open(path, "a") as f:
+        f.write("  ; csvid: new2\n")
+    with patch.object(index, "HEAD_LIMIT", 2):
+        idx = IdIndex(path, directory=idx.directory)
+        idx.update()
+    assert idx.head == {}
+    assert "2011-05" in idx.segment_names()
+    # the merged segments are known without listing the directory again
+    with patch("os.listdir") as listdir:
+        assert idx.check_transaction_by_id("csvid", "new2")
+        assert idx.check_transaction_by_id("ofxid", "new1")
+        assert idx.check_transaction_by_id("ofxid", "empty")
+        assert not idx.check_transaction_by_id("ofxid", "missing")
+        assert not listdir.called
+
+
+def test_rewrite_rebuilds(tmpdir):
+    (path, idx) = mk_index(tmpdir, "checking.lgr")
+    idx.close()
+    with open(path, "w") as f:
+        f.write("2012/01/01 Only\n  ; ofxid: only\n  Assets:Foo  $1\n  Income\n")
+    idx = IdIndex(path, directory=idx.directory)
+    idx.update()
+    assert idx.check_transaction_by_id("ofxid", "only")
+    assert not idx.check_transaction_by_id("ofxid", "empty")
+    assert idx.segment_names() == ["2012-01"]
+
+
+def test_included_file_changes(tmpdir):
+    tmpdir.join("main.lgr").write("include other.lgr\n")
+    other = tmpdir.join("other.lgr")
+    other.write("2012/01/01 A\n  ; ofxid: a\n  Assets:Foo  $1\n  Income\n")
+    directory = str(tmpdir.join("index"))
+    idx = IdIndex(str(tmpdir.join("main.lgr")), directory=directory)
+    idx.update()
+    assert idx.check_transaction_by_id("ofxid", "a")
+    other.write("2012/01/02 B\n  ; ofxid: b\n  Assets:Foo  $1\n  Income\n", "a")
+    idx = IdIndex(str(tmpdir.join("main.lgr")), directory=directory)
+    idx.update()
+    assert idx.check_transaction_by_id("ofxid", "a")
+    assert idx.check_transaction_by_id("ofxid", "b")
+
+
+def test_synchronizers_use_index(tmpdir):
+    (_, idx) = mk_index(tmpdir, "checking.lgr")
+    sync = OfxSynchronizer(object(), index=idx)
+    ofx = OfxSynchronizer.parse_file(os.path.join("fixtures", "checking.ofx"))
+    txns = sync.filter(ofx.account.statement.transactions, ofx.account.account_id)
+    assert txns == []
+    (_, idx) = mk_index(tmpdir, "paypal.lgr")
+    sync = CsvSynchronizer(object(), index=idx)
+    assert 1 == len(sync.parse_file(os.path.join("fixtures", "paypal.csv")))
+
+
+def test_prefixed_csvids(tmpdir):
+    # Mint csvids are written as "mint.<hash>" but looked up as "<hash>"
+    txns = CsvSynchronizer(None).parse_file(
+        os.path.join("fixtures", "mint.csv"), accountname="Foo"
+    )
+    path = str(tmpdir.join("journal.lgr"))
+    with open(path, "w") as f:
+        f.write("\n".join(txn.format() for txn in txns))
+    idx = IdIndex(path, directory=str(tmpdir.join("index")))
+    idx.update()
+    sync = CsvSynchronizer(object(), index=idx)
+    assert (
+        sync.parse_file(os.path.join("fixtures", "mint.csv"), accountname="Foo") == []
+    )
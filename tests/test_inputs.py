@@ -0,0 +1,127 @@
+# Copyright (c) 2013-2021 Erik Hetzner
+#
+# This file is part of ledger-autosync
+#
+# ledger-autosync is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# ledger-autosync is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with ledger-autosync. If not, see
+# <http://www.gnu.org/licenses/>.
+
+import bz2
+import gzip
+import io
+import lzma
+import os
+import zipfile
+from io import StringIO
+from unittest.mock import Mock, patch
+
+import pytest
+
+from ledgerautosync.cli import record_output, run
+from ledgerautosync.inputs import open_inputs
+from ledgerautosync.sync import CsvSynchronizer
+
+
+def fixture(name):
+    with open(os.path.join("fixtures", name), "rb") as f:
+        return f.read()
+
+
+def sources(path):
+    return [(s.name, s.format, s.path, s.f.read()) for s in open_inputs(path)]
+
+
+def test_open_inputs(tmpdir):
+    ofx = fixture("checking.ofx")
+    csv = fixture("paypal.csv")
+    path = str(tmpdir.join("statement"))
+    with open(path, "wb") as f:
+        f.write(ofx)
+    assert sources(path) == [(path, "ofx", path, ofx)]
+    for module in (gzip, bz2, lzma):
+        with open(path, "wb") as f:
+            f.write(module.compress(csv))
+        assert sources(path) == [(path, "csv", None, csv)]
+    with zipfile.ZipFile(path, "w") as z:
+        z.writestr("a/checking.ofx", ofx)
+        z.writestr("__MACOSX/a/._checking.ofx", b"junk")
+        z.writestr("paypal.csv.gz", gzip.compress(csv))
+    assert sources(path) == [
+        (path + ":a/checking.ofx", "ofx", None, ofx),
+        (path + ":paypal.csv.gz", "csv", None, csv),
+    ]
+
+
+def import_output(*args, stdin=b""):
+    stdin = io.TextIOWrapper(io.BufferedReader(io.BytesIO(stdin)))
+    with patch("sys.stdout", new_callable=StringIO) as mock_stdout, patch(
+        "sys.stdin", stdin
+    ):
+        run(["-L"] + list(args))
+    return mock_stdout.getvalue()
+
+
+def test_import_compressed_and_stdin(tmpdir):
+    plain = import_output(os.path.join("fixtures", "checking.ofx"))
+    assert plain.count("ofxid: ") == 3
+    path = str(tmpdir.join("checking.ofx.xz"))
+    with open(path, "wb") as f:
+        f.write(lzma.compress(fixture("checking.ofx")))
+    assert import_output(path) == plain
+    assert import_output("-", stdin=gzip.compress(fixture("checking.ofx"))) == plain
+
+    path = str(tmpdir.join("bundle.zip"))
+    with zipfile.ZipFile(path, "w") as z:
+        z.writestr("paypal.csv", fixture("paypal.csv"))
+        z.writestr("checking.ofx", fixture("checking.ofx"))
+    output = import_output("-a", "Assets:Paypal", path)
+    assert output.count("csvid: ") == 2
+    assert output.count("ofxid: ") == 3
+
+
+@pytest.mark.lgr_file("empty.lgr")
+def test_batch_dedup(ledger):
+    batch_ids = set()
+    sync = CsvSynchronizer(ledger, batch_ids=batch_ids)
+    path = os.path.join("fixtures", "paypal.csv")
+    txns = sync.parse_file(path, accountname="Assets:Paypal")
+    assert len(txns) == 2
+    # nothing is recorded until it is output
+    assert len(sync.parse_file(path, accountname="Assets:Paypal")) == 2
+    for txn in txns:
+        record_output(batch_ids, txn.format())
+    # e.g. the same rows in another file of the same zip archive
+    assert sync.parse_file(path, accountname="Assets:Paypal") == []
+
+
+def test_batch_dedup_within_file(tmpdir):
+    mint = fixture("mint.csv").splitlines(True)
+    # two equal purchases on the same day have the same csvid
+    csv = b"".join([mint[0], mint[1], mint[1]])
+    path = str(tmpdir.join("mint.csv"))
+    with open(path, "wb") as f:
+        f.write(csv)
+    bundle = str(tmpdir.join("bundle.zip"))
+    with zipfile.ZipFile(bundle, "w") as z:
+        z.writestr("mint.csv", csv)
+    ledger = Mock()
+    ledger.check_transaction_by_id = Mock(return_value=False)
+    with patch("sys.stdout", new_callable=StringIO) as mock_stdout, patch(
+        "ledgerautosync.cli.mk_ledger", Mock(return_value=ledger)
+    ):
+        run(
+            ["-l", str(tmpdir.join("journal.ledger")), "-a", "Assets:Mint"]
+            + [path, bundle]
+        )
+    # both rows of the file, and none of the zip member that repeats them
+    assert mock_stdout.getvalue().count("csvid: mint.") == 2
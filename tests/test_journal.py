@@ -0,0 +1,61 @@
+# Copyright (c) 2013-2021 Erik Hetzner
+#
+# This file is part of ledger-autosync
+#
+# ledger-autosync is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# ledger-autosync is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with ledger-autosync. If not, see
+# <http://www.gnu.org/licenses/>.
+
+import datetime
+import os.path
+
+from ledgerautosync import journal
+
+
+def test_entries():
+    entries = list(journal.entries(os.path.join("fixtures", "checking.lgr")))
+    assert len(entries) == 13
+    assert entries[0].date == datetime.date(2011, 3, 31)
+    assert entries[0].get("ofxid") == "1101.1452687~7.0000486"
+    assert entries[0].postings == [("Assets:Foo", "$0.01"), ("Income:Bar", "-$0.01")]
+    assert entries[1].offset == entries[0].end + 1
+    with open(os.path.join("fixtures", "checking.lgr"), "rb") as f:
+        f.seek(entries[1].offset)
+        assert f.read(10) == b"2011/04/05"
+
+
+def test_directives(tmpdir):
+    main = tmpdir.join("main.lgr")
+    tmpdir.join("other.lgr").write(
+        "2020/02/01 * (42) Other ; ofxid: b\n    Assets:Foo  $1\n    Income\n"
+    )
+    main.write(
+        "; a comment\n"
+        "Y 2019\n"
+        "12/31 Short date\n"
+        "    Assets:Foo  $1  ; csvid: a\n"
+        "    Income\n"
+        "\n"
+        "comment\n"
+        "2020/01/01 Commented out\n"
+        "    ; ofxid: c\n"
+        "end comment\n"
+        "include other.lgr\n"
+    )
+    entries = list(journal.entries(str(main)))
+    assert [(e.date, e.payee, e.metadata) for e in entries] == [
+        (datetime.date(2019, 12, 31), "Short date", [("csvid", "a")]),
+        (datetime.date(2020, 2, 1), "Other", [("ofxid", "b")]),
+    ]
+    assert entries[1].code == "42"
+    assert entries[1].postings == [("Assets:Foo", "$1"), ("Income", None)]
@@ -17,6 +17,7 @@
 # <http://www.gnu.org/licenses/>.
 
 
+import datetime
 import os
 import os.path
 import tempfile
@@ -31,6 +32,15 @@ def test_check_transaction(ledger):
     assert ledger.check_transaction_by_id("ofxid", "1101.1452687~7.0000486")
 
 
+@pytest.mark.lgr_file("checking.lgr")
+def test_check_transaction_window(ledger):
+    ofxid = "1101.1452687~7.0000486"
+    window = (datetime.date(2011, 3, 28), datetime.date(2011, 4, 3))
+    assert ledger.check_transaction_by_id("ofxid", ofxid, window)
+    window = (datetime.date(2011, 4, 1), datetime.date(2011, 5, 1))
+    assert not ledger.check_transaction_by_id("ofxid", ofxid, window)
+
+
 @pytest.mark.lgr_file("checking.lgr")
 def test_nonexistent_transaction(ledger):
     assert not ledger.check_transaction_by_id("ofxid", "FOO")
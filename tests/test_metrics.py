@@ -0,0 +1,82 @@
+# Copyright (c) 2013-2021 Erik Hetzner
+#
+# This file is part of ledger-autosync
+#
+# ledger-autosync is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# ledger-autosync is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with ledger-autosync. If not, see
+# <http://www.gnu.org/licenses/>.
+
+import json
+import os.path
+import tempfile
+from io import StringIO
+from unittest.mock import Mock, patch
+
+from ofxclient.config import OfxConfig
+
+from ledgerautosync import metrics
+from ledgerautosync.cli import run
+
+
+def metrics_path(suffix):
+    (f, path) = tempfile.mkstemp(suffix)
+    os.close(f)
+    return path
+
+
+def test_labels_nest():
+    metrics.start()
+    with metrics.labels(account="A"):
+        metrics.inc("errors")
+        with metrics.labels(kind="x"):
+            metrics.inc("errors")
+    metrics.inc("errors")
+    values = metrics._metrics.values
+    metrics._metrics = None
+    assert values[("errors", (("account", "A"),))] == 1
+    assert values[("errors", (("account", "A"), ("kind", "x")))] == 1
+    assert values[("errors", ())] == 1
+
+
+def test_csv_metrics_prometheus():
+    path = metrics_path(".prom")
+    csv_path = os.path.join("fixtures", "paypal.csv")
+    with patch("sys.stdout", new_callable=StringIO):
+        run([csv_path, "-a", "Assets:Foo", "-L", "--metrics-file", path])
+    with open(path) as f:
+        text = f.read()
+    os.unlink(path)
+    assert "# TYPE ledgerautosync_transactions_seen gauge" in text
+    assert 'ledgerautosync_transactions_new{file="%s"} 2' % (csv_path) in text
+    assert "ledgerautosync_run_seconds " in text
+
+
+def test_sync_metrics_json():
+    path = metrics_path(".json")
+    config = OfxConfig(os.path.join("fixtures", "ofxclient.ini"))
+    acct = config.accounts()[0]
+    acct.download = Mock(
+        side_effect=lambda *args, **kwargs: open(
+            os.path.join("fixtures", "checking.ofx"), "rb"
+        )
+    )
+    config.accounts = Mock(return_value=[acct])
+    with patch("sys.stdout", new_callable=StringIO):
+        run(["-L", "--max", "7", "--metrics-file", path], config)
+    with open(path) as f:
+        data = json.load(f)["metrics"]
+    os.unlink(path)
+    by_name = {(m["name"], m["labels"].get("account")): m["value"] for m in data}
+    assert by_name[("ledgerautosync_transactions_seen", acct.description)] == 3
+    assert by_name[("ledgerautosync_download_bytes", acct.description)] > 0
+    assert ("ledgerautosync_download_seconds", acct.description) in by_name
@@ -0,0 +1,110 @@
+# Copyright (c) 2013-2021 Erik Hetzner
+#
+# This file is part of ledger-autosync
+#
+# ledger-autosync is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# ledger-autosync is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with ledger-autosync. If not, see
+# <http://www.gnu.org/licenses/>.
+
+import os.path
+from io import StringIO
+from unittest.mock import patch
+
+from ledgerautosync.cli import run
+from ledgerautosync.index import IdIndex
+from ledgerautosync.migrate import MoveIdTag, RenameAccount, ReplaceInIds, migrate
+
+JOURNAL = """2011/03/31 DIVIDEND EARNED FOR PERIOD OF 03
+    ; ofxid: 1101.1452687~7.0000486
+    Assets:Bank:Checking                                       $0.01
+    Income:Interest
+
+2011/04/05 AUTOMATIC WITHDRAWAL, ELECTRIC BILL
+    Assets:Bank:Checking                                     -$34.51
+    ; ofxid: 1101.1452687~7.0000487
+    Expenses:Misc
+
+include other.lgr
+"""
+
+OTHER = """2011/04/07 Cash
+    Assets:Bank\t$20
+    ; csvid: other.1452687~7.1
+    Assets:Cash
+"""
+
+
+def write_journal(tmpdir):
+    tmpdir.join("other.lgr").write(OTHER)
+    path = tmpdir.join("main.lgr")
+    path.write(JOURNAL)
+    return str(path)
+
+
+def test_rules():
+    lines = [b"2011/03/31 Foo", b"    ; ofxid: a.b.c", b"    Assets:Foo  $1", b"    X"]
+    assert MoveIdTag().rewrite(lines) == [lines[0], lines[2], lines[1], lines[3]]
+    assert MoveIdTag().rewrite(lines[:1] + lines[2:]) == lines[:1] + lines[2:]
+    assert RenameAccount("Assets", "A").rewrite(lines)[2] == b"    A:Foo       $1"
+    assert RenameAccount("Asset", "A").rewrite(lines) == lines
+    assert ReplaceInIds(".b.", ".x.").rewrite(lines)[1] == b"    ; ofxid: a.x.c"
+
+
+def test_migrate(tmpdir):
+    path = write_journal(tmpdir)
+    index = IdIndex(path, directory=str(tmpdir.join("index")))
+    index.update()
+    assert index.check_transaction_by_id("ofxid", "1452687~7.0000486")
+    migration = migrate(
+        path,
+        [
+            ReplaceInIds("1452687~7", "87~7"),
+            RenameAccount("Assets:Bank", "Assets:Acme"),
+            MoveIdTag(),
+        ],
+        index,
+    )
+    assert migration.changed == 3
+    with open(path) as f:
+        assert f.read() == (
+            "2011/03/31 DIVIDEND EARNED FOR PERIOD OF 03\n"
+            "    Assets:Acme:Checking                                       $0.01\n"
+            "    ; ofxid: 1101.87~7.0000486\n"
+            "    Income:Interest\n"
+            "\n"
+            "2011/04/05 AUTOMATIC WITHDRAWAL, ELECTRIC BILL\n"
+            "    Assets:Acme:Checking                                     -$34.51\n"
+            "    ; ofxid: 1101.87~7.0000487\n"
+            "    Expenses:Misc\n"
+            "\n"
+            "include other.lgr\n"
+        )
+    with open(str(tmpdir.join("other.lgr"))) as f:
+        assert f.read() == OTHER.replace("Bank", "Acme").replace("1452687~7", "87~7")
+    # the index was updated without being rebuilt
+    index = IdIndex(path, directory=str(tmpdir.join("index")))
+    with patch.object(IdIndex, "rebuild") as rebuild:
+        index.update()
+        assert not rebuild.called
+    assert index.check_transaction_by_id("ofxid", "87~7.0000486")
+    assert index.check_transaction_by_id("csvid", "other.87~7.1")
+    assert not index.check_transaction_by_id("ofxid", "1452687~7.0000486")
+    index.close()
+
+
+def test_migrate_command(tmpdir):
+    path = write_journal(tmpdir)
+    with patch("sys.stderr", new_callable=StringIO) as mock_stderr:
+        run(["migrate", "-l", path, "--fix-ofxid"])
+    assert mock_stderr.getvalue() == "Rewrote 1 transactions in 1 files\n"
+    assert os.path.exists(path)
@@ -0,0 +1,106 @@
+# Copyright (c) 2013-2021 Erik Hetzner
+#
+# This file is part of ledger-autosync
+#
+# ledger-autosync is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# ledger-autosync is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with ledger-autosync. If not, see
+# <http://www.gnu.org/licenses/>.
+
+import os
+from io import StringIO
+from unittest.mock import patch
+
+from ledgerautosync.cli import run
+from ledgerautosync.offsets import DatedInserter, OffsetIndex
+
+JOURNAL = """; header
+
+2020/01/05 A
+    Assets  $1
+    Income
+
+2020/02/01 B
+    Assets  $1
+    Income
+"""
+
+
+def txn(date, payee):
+    return "%s %s\n    Assets  $2\n    Income\n" % (date, payee)
+
+
+def payees(path):
+    with open(path) as f:
+        return [line.split()[1] for line in f if line[:1].isdigit()]
+
+
+def test_insert_in_date_order(tmpdir):
+    path = str(tmpdir.join("journal.ledger"))
+    with open(path, "w") as f:
+        f.write(JOURNAL)
+    directory = str(tmpdir.join("offsets"))
+    inserter = DatedInserter(path, directory)
+    assert inserter.write(txn("2020/01/10", "X"))
+    assert inserter.write(txn("2019/12/31", "Y"))
+    assert inserter.write(txn("2021/01/01", "Z"))
+    assert inserter.write(txn("2020/02/01", "W"))
+    assert inserter.write("P 2020/01/20 00:00:00 FOO $1\n")
+    assert not inserter.write("; a comment\n")
+    inserter.close()
+    assert payees(path) == ["Y", "A", "X", "B", "W", "Z"]
+    with open(path) as f:
+        assert "Income\n\nP 2020/01/20 00:00:00 FOO $1\n\n2020/02/01 B" in f.read()
+
+    # the index was updated from the edits
+    idx = OffsetIndex(path, directory)
+    assert idx.load()
+    rebuilt = OffsetIndex(path, str(tmpdir.join("rebuilt")))
+    rebuilt.update()
+    assert (idx.dates, idx.starts, idx.ends) == (
+        rebuilt.dates,
+        rebuilt.starts,
+        rebuilt.ends,
+    )
+
+    # and is reused, scanning only what was appended
+    with open(path, "a") as f:
+        f.write("    ; note: appended to Z\n\n" + txn("2021/02/01", "V"))
+    inserter = DatedInserter(path, directory)
+    inserter.write(txn("2021/01/15", "U"))
+    with patch.object(inserter.index, "rebuild") as rebuild:
+        inserter.close()
+        assert not rebuild.called
+    assert payees(path) == ["Y", "A", "X", "B", "W", "Z", "U", "V"]
+    with open(path) as f:
+        assert "appended to Z\n\n2021/01/15 U" in f.read()
+
+
+def test_insert_into_option(tmpdir):
+    path = str(tmpdir.join("journal.ledger"))
+    with open(path, "w") as f:
+        f.write(JOURNAL.replace("2020", "2016"))
+    with patch("sys.stdout", new_callable=StringIO) as mock_stdout, patch.dict(
+        os.environ, {"XDG_CACHE_HOME": str(tmpdir)}
+    ):
+        run(
+            [
+                "-L",
+                "-a",
+                "Assets:Paypal",
+                "--insert-into",
+                path,
+                os.path.join("fixtures", "paypal.csv"),
+            ]
+        )
+    assert mock_stdout.getvalue() == ""
+    assert payees(path) == ["A", "B", "Jane", "Debit"]
@@ -0,0 +1,272 @@
+# Copyright (c) 2013-2021 Erik Hetzner
+#
+# This file is part of ledger-autosync
+#
+# ledger-autosync is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# ledger-autosync is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with ledger-autosync. If not, see
+# <http://www.gnu.org/licenses/>.
+
+import datetime
+import os
+import re
+import shutil
+import sys
+from io import BytesIO, StringIO
+from unittest.mock import patch
+
+import pytest
+from ofxparse import OfxParser
+
+from ledgerautosync.cli import run
+
+sys.path.insert(
+    0, os.path.join(os.path.dirname(os.path.dirname(__file__)), "benchmarks")
+)
+import ofxserver  # noqa: E402
+
+
+def stmtrq(acctid, days):
+    dtstart = datetime.date.today() - datetime.timedelta(days=days)
+    return (
+        "<BANKMSGSRQV1><STMTTRNRQ><TRNUID>1<STMTRQ><BANKACCTFROM><BANKID>1101"
+        "<ACCTID>%s<ACCTTYPE>CHECKING</BANKACCTFROM><INCTRAN><DTSTART>%s"
+        "<INCLUDE>Y</INCTRAN></STMTRQ></STMTTRNRQ></BANKMSGSRQV1>"
+        % (acctid, dtstart.strftime("%Y%m%d"))
+    )
+
+
+def test_respond_honours_dtstart():
+    bank = ofxserver.FakeBank(history=100)
+    status, body = bank.respond(stmtrq("1", 1))
+    assert status == 200
+    ofx = OfxParser.parse(BytesIO(body.encode("ascii")))
+    # one day before today: two days of transactions
+    assert len(ofx.account.statement.transactions) == 40
+    assert ofx.account.account_id == "1"
+
+
+def test_respond_failures():
+    bank = ofxserver.FakeBank(history=100, empty_accounts=["2"], fail_accounts=["3"])
+    status, body = bank.respond(stmtrq("2", 30))
+    ofx = OfxParser.parse(BytesIO(body.encode("ascii")))
+    assert len(ofx.account.statement.transactions) == 0
+    assert bank.respond(stmtrq("3", 30)) == (400, ofxserver.ERROR_400)
+    bank = ofxserver.FakeBank(history=100, error_rate=1)
+    status, body = bank.respond(stmtrq("1", 30))
+    assert "<SEVERITY>ERROR" in body
+
+
+@pytest.mark.skipif(shutil.which("openssl") is None, reason="openssl not found")
+def test_sync_against_fake_bank(tmpdir):
+    certfile, keyfile = ofxserver.make_certificate(str(tmpdir))
+    bank = ofxserver.FakeBank(history=100)
+    server = ofxserver.serve(bank, certfile, keyfile)
+    try:
+        config = ofxserver.write_config(
+            os.path.join(str(tmpdir), "ofxclient.ini"), server.server_address[1]
+        )
+        with patch.dict(os.environ, {"SSL_CERT_FILE": certfile}), patch(
+            "sys.stdout", new_callable=StringIO
+        ) as mock_stdout:
+            run(["-L", "-o", config, "--max", "2"])
+        assert mock_stdout.getvalue().count("ofxid: 1101.0123456789.") == 60
+        assert bank.statements >= 2
+    finally:
+        server.shutdown()
+
+
+def account_names(output):
+    """Return the set of accounts posted to in output."""
+    return set(re.findall(r"^ +([A-Z][^;\n]*?)(?:  |\n)", output, re.M))
+
+
+@pytest.mark.skipif(shutil.which("openssl") is None, reason="openssl not found")
+def test_sync_combines_requests_per_institution(tmpdir):
+    certfile, keyfile = ofxserver.make_certificate(str(tmpdir))
+    bank = ofxserver.FakeBank(history=100)
+    server = ofxserver.serve(bank, certfile, keyfile)
+    try:
+        config = ofxserver.write_config(
+            os.path.join(str(tmpdir), "ofxclient.ini"), server.server_address[1]
+        )
+        with patch.dict(os.environ, {"SSL_CERT_FILE": certfile}), patch(
+            "sys.stdout", new_callable=StringIO
+        ) as mock_stdout:
+            run(["-L", "-o", config, "--max", "2", "--combine"])
+        output = mock_stdout.getvalue()
+        assert output.count("ofxid: 1101.0123456789.") == 60
+        assert "9876543210" in output
+        # both accounts are at the same institution
+        assert bank.requests == 1
+        assert bank.statements == 2
+
+        with patch.dict(os.environ, {"SSL_CERT_FILE": certfile}), patch(
+            "sys.stdout", new_callable=StringIO
+        ) as mock_stdout:
+            run(["-L", "-o", config, "--max", "2"])
+        assert mock_stdout.getvalue() == output
+        assert bank.requests == 3
+
+        # reconverted, accounts get the same names as when synced
+        archive = os.path.join(str(tmpdir), "archive.sqlite")
+        with patch.dict(os.environ, {"SSL_CERT_FILE": certfile}), patch(
+            "sys.stdout", new_callable=StringIO
+        ):
+            run(["-L", "-o", config, "--max", "2", "--combine", "--archive", archive])
+        with patch("sys.stdout", new_callable=StringIO) as mock_stdout:
+            run(["reconvert", "-L", "--archive", archive])
+        assert account_names(mock_stdout.getvalue()) == account_names(output)
+    finally:
+        server.shutdown()
+
+
+class PartialBank(ofxserver.FakeBank):
+    """Leaves the broker account out of combined responses."""
+
+    def respond(self, body):
+        if len(ofxserver.REQUEST_RE.findall(body)) > 1:
+            body = re.sub("<INVSTMTRQ>.*?</INVSTMTRQ>", "", body, flags=re.S)
+        return super(PartialBank, self).respond(body)
+
+
+@pytest.mark.skipif(shutil.which("openssl") is None, reason="openssl not found")
+def test_sync_downloads_accounts_left_out(tmpdir):
+    certfile, keyfile = ofxserver.make_certificate(str(tmpdir))
+    bank = PartialBank(history=100)
+    server = ofxserver.serve(bank, certfile, keyfile)
+    try:
+        config = ofxserver.write_config(
+            os.path.join(str(tmpdir), "ofxclient.ini"), server.server_address[1]
+        )
+        with patch.dict(os.environ, {"SSL_CERT_FILE": certfile}), patch(
+            "sys.stdout", new_callable=StringIO
+        ) as mock_stdout:
+            run(["-L", "-o", config, "--max", "2"])
+        output = mock_stdout.getvalue()
+        assert bank.requests == 2
+
+        with patch.dict(os.environ, {"SSL_CERT_FILE": certfile}), patch(
+            "sys.stdout", new_callable=StringIO
+        ) as mock_stdout:
+            run(["-L", "-o", config, "--max", "2", "--combine"])
+        assert mock_stdout.getvalue() == output
+        # the broker account was downloaded again on its own
+        assert bank.requests == 4
+    finally:
+        server.shutdown()
+
+
+class FlakyBank(ofxserver.FakeBank):
+    """Answers the first `failures` requests with a server error."""
+
+    failures = 1
+
+    def respond(self, body):
+        with self.lock:
+            self.failures -= 1
+            fail = self.failures >= 0
+        if fail:
+            return (200, self.envelope(signon_error=True))
+        return super(FlakyBank, self).respond(body)
+
+
+@pytest.mark.skipif(shutil.which("openssl") is None, reason="openssl not found")
+def test_backfill_in_windows(tmpdir):
+    certfile, keyfile = ofxserver.make_certificate(str(tmpdir))
+    bank = FlakyBank(history=1000)
+    server = ofxserver.serve(bank, certfile, keyfile)
+    archive = ["--archive", os.path.join(str(tmpdir), "archive.sqlite")]
+    try:
+        config = ofxserver.write_config(
+            os.path.join(str(tmpdir), "ofxclient.ini"), server.server_address[1]
+        )
+        with patch.dict(os.environ, {"SSL_CERT_FILE": certfile}), patch(
+            "sys.stdout", new_callable=StringIO
+        ) as mock_stdout:
+            run(
+                ["-L", "-o", config, "--max", "40", "--backfill", "10", "--combine"]
+                + archive
+            )
+        backfilled = mock_stdout.getvalue()
+        # 4 windows, one of which failed once and was downloaded again
+        assert bank.failures == -4
+        assert bank.requests == 4
+        with patch("sys.stdout", new_callable=StringIO) as mock_stdout:
+            run(["reconvert", "-L"] + archive)
+        assert account_names(mock_stdout.getvalue()) == account_names(backfilled)
+
+        with patch.dict(os.environ, {"SSL_CERT_FILE": certfile}), patch(
+            "sys.stdout", new_callable=StringIO
+        ) as mock_stdout:
+            run(["-L", "-o", config, "--max", "40", "--resync"])
+        assert backfilled == mock_stdout.getvalue()
+        assert backfilled.count("ofxid: 1101.0123456789.") == 41 * 20
+    finally:
+        server.shutdown()
+
+
+@pytest.mark.skipif(shutil.which("openssl") is None, reason="openssl not found")
+def test_cached_and_unchanged_statements(tmpdir):
+    certfile, keyfile = ofxserver.make_certificate(str(tmpdir))
+    bank = ofxserver.FakeBank(history=100)
+    server = ofxserver.serve(bank, certfile, keyfile)
+    env = {"SSL_CERT_FILE": certfile, "XDG_CACHE_HOME": str(tmpdir.join("cache"))}
+    try:
+        config = ofxserver.write_config(
+            os.path.join(str(tmpdir), "ofxclient.ini"), server.server_address[1]
+        )
+
+        def sync(ttl):
+            with patch.dict(os.environ, env), patch(
+                "sys.stdout", new_callable=StringIO
+            ) as mock_stdout:
+                run(["-L", "-o", config, "--max", "2", "--cache-ttl", ttl, "--combine"])
+            return mock_stdout.getvalue()
+
+        assert sync("3600").count("ofxid: 1101.0123456789.") == 60
+        assert bank.requests == 1
+        # read from the cache, and already converted
+        assert sync("3600") == ""
+        assert bank.requests == 1
+        # downloaded again, but the same statements as last time
+        assert sync("0") == ""
+        assert bank.requests == 2
+    finally:
+        server.shutdown()
+
+
+@pytest.mark.skipif(shutil.which("openssl") is None, reason="openssl not found")
+def test_sync_merge_by_date(tmpdir):
+    certfile, keyfile = ofxserver.make_certificate(str(tmpdir))
+    bank = ofxserver.FakeBank(history=100)
+    server = ofxserver.serve(bank, certfile, keyfile)
+    try:
+        config = ofxserver.write_config(
+            os.path.join(str(tmpdir), "ofxclient.ini"), server.server_address[1]
+        )
+        outputs = []
+        for options in ([], ["--merge-by-date"]):
+            with patch.dict(os.environ, {"SSL_CERT_FILE": certfile}), patch(
+                "sys.stdout", new_callable=StringIO
+            ) as mock_stdout:
+                run(["-L", "-o", config, "--max", "2", "--assertions"] + options)
+            outputs.append(mock_stdout.getvalue())
+        dates = re.findall(r"^(\d{4}/\d\d/\d\d) ", outputs[1], re.M)
+        assert dates == sorted(dates)
+        chunks = [
+            sorted(chunk.strip() for chunk in output.split("\n\n") if chunk.strip())
+            for output in outputs
+        ]
+        assert chunks[0] == chunks[1]
+    finally:
+        server.shutdown()
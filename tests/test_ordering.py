@@ -0,0 +1,72 @@
+# Copyright (c) 2013-2021 Erik Hetzner
+#
+# This file is part of ledger-autosync
+#
+# ledger-autosync is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# ledger-autosync is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with ledger-autosync. If not, see
+# <http://www.gnu.org/licenses/>.
+
+import datetime
+
+from ledgerautosync.converter import Amount, Posting, Transaction
+from ledgerautosync.ordering import in_date_order, merge_by_date
+
+
+def mk_txn(day, payee):
+    posting = Posting("Assets:Bank", Amount(1, "$"))
+    return Transaction(
+        date=datetime.datetime(2021, 1, day, 12),
+        payee=payee,
+        postings=[posting, posting.clone_inverted("Income")],
+    )
+
+
+def test_merge_by_date():
+    converted = []
+
+    def convert(txns):
+        for txn in txns:
+            converted.append(txn.payee)
+            yield txn
+
+    first = in_date_order(
+        ["2021/01/01 * Initial\n    Assets:Bank  $0\n"],
+        convert([mk_txn(2, "a2"), mk_txn(5, "a5"), mk_txn(9, "a9")]),
+        iter(
+            [
+                "P 2021/01/05 00:00:00 FOO $1\n",
+                "2021/01/05 * Assertion\n    Assets:Bank  $0 = $2\n",
+                "",
+            ]
+        ),
+    )
+    second = in_date_order(
+        [], convert([mk_txn(1, "b1"), mk_txn(5, "b5")]), iter([None])
+    )
+    merged = merge_by_date([first, second])
+    assert "Initial" in next(merged)
+    assert next(merged).payee == "b1"
+    # conversion is lazy
+    assert converted == ["a2", "b1"]
+    items = [
+        item.payee if isinstance(item, Transaction) else item.split("\n")[0]
+        for item in merged
+    ]
+    assert items == [
+        "a2",
+        "a5",
+        "P 2021/01/05 00:00:00 FOO $1",
+        "2021/01/05 * Assertion",
+        "b5",
+        "a9",
+    ]
@@ -0,0 +1,93 @@
+# Copyright (c) 2013-2021 Erik Hetzner
+#
+# This file is part of ledger-autosync
+#
+# ledger-autosync is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# ledger-autosync is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with ledger-autosync. If not, see
+# <http://www.gnu.org/licenses/>.
+
+import json
+import os.path
+import tempfile
+from io import StringIO
+from unittest.mock import patch
+
+from ledgerautosync import profiling
+from ledgerautosync.cli import run
+
+
+def test_disabled_is_noop():
+    assert not profiling.enabled()
+    with profiling.span("foo"):
+        profiling.count("bar")
+    stream = StringIO()
+    profiling.stop(stream)
+    assert stream.getvalue() == ""
+
+
+def test_spans_and_counters():
+    profiling.start()
+    with profiling.span("foo"):
+        profiling.count("spawn:ledger")
+        profiling.count("spawn:ledger")
+    with profiling.span("foo"):
+        pass
+    stream = StringIO()
+    profiling.stop(stream)
+    assert not profiling.enabled()
+    lines = stream.getvalue().splitlines()
+    assert lines[1].split()[0:2] == ["foo", "2"]
+    assert lines[-1].split() == ["spawn:ledger", "2"]
+
+
+def test_profile_json_output():
+    (f, path) = tempfile.mkstemp(".json")
+    os.close(f)
+    with patch("sys.stderr", new_callable=StringIO) as mock_stderr:
+        with patch("sys.stdout", new_callable=StringIO):
+            run(
+                [
+                    os.path.join("fixtures", "paypal.csv"),
+                    "-a",
+                    "Assets:Foo",
+                    "-L",
+                    "--profile",
+                    "--profile-output",
+                    path,
+                ]
+            )
+        assert "phase" in mock_stderr.getvalue()
+    with open(path) as f:
+        data = json.load(f)
+    os.unlink(path)
+    assert data["spans"]["total"]["calls"] == 1
+    assert data["spans"]["convert"]["calls"] == 2
+
+
+def test_profile_output_implies_profile(tmpdir):
+    path = str(tmpdir.join("profile.json"))
+    with patch("sys.stderr", new_callable=StringIO) as mock_stderr:
+        with patch("sys.stdout", new_callable=StringIO):
+            run(
+                [
+                    os.path.join("fixtures", "paypal.csv"),
+                    "-a",
+                    "Assets:Foo",
+                    "-L",
+                    "--profile-output",
+                    path,
+                ]
+            )
+        assert "phase" in mock_stderr.getvalue()
+    with open(path) as f:
+        assert json.load(f)["spans"]["total"]["calls"] == 1
@@ -0,0 +1,115 @@
+# Copyright (c) 2013-2021 Erik Hetzner
+#
+# This file is part of ledger-autosync
+#
+# ledger-autosync is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# ledger-autosync is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with ledger-autosync. If not, see
+# <http://www.gnu.org/licenses/>.
+
+import os
+import re
+import stat
+from io import StringIO
+from unittest.mock import patch
+
+import pytest
+
+from ledgerautosync.cli import run
+from ledgerautosync.recategorize import apply_changes, find_changes, replace_account
+
+JOURNAL = """2020/01/01 Coffee Shop
+    Expenses:Coffee                                            $4.50
+    Assets:Checking
+
+2020/01/02 Coffee Shop
+    Expenses:Misc                                              $3.00
+    ; ofxid: 1.2
+    Assets:Checking
+
+2020/01/03 Hardware Store
+    Expenses:Misc:Tools                                        $9.00
+    Assets:Checking
+
+2020/01/04 HARDWARE #12
+    Assets:Checking                                           -$9.00
+    Expenses:Misc
+
+2020/01/05 Nobody Knows
+    Expenses:Misc                                              $1.00
+    Assets:Checking
+"""
+
+
+def test_replace_account():
+    line = b"    Expenses:Misc                                              $3.00"
+    assert (
+        replace_account(line, "Expenses:Misc", "Expenses:Coffee")
+        == b"    Expenses:Coffee                                            $3.00"
+    )
+    assert replace_account(b"  * Expenses:Misc", "Expenses:Misc", "E:F") == b"  * E:F"
+    assert (
+        replace_account(b"\tExpenses:Misc\t$1", "Expenses:Misc", "E:F") == b"\tE:F\t$1"
+    )
+    assert replace_account(b"  Expenses:Misc:Tools  $1", "Expenses:Misc", "E") is None
+
+
+def test_recategorize(tmpdir):
+    path = str(tmpdir.join("main.lgr"))
+    with open(path, "w") as f:
+        f.write(JOURNAL)
+    os.chmod(path, 0o640)
+    rules = [(re.compile("HARDWARE", re.IGNORECASE), "Expenses:Tools")]
+    changes = find_changes(path, rules)
+    assert [(c.entry.payee, c.old, c.new) for c in changes] == [
+        ("Coffee Shop", "Expenses:Misc", "Expenses:Coffee"),
+        ("HARDWARE #12", "Expenses:Misc", "Expenses:Tools"),
+    ]
+    apply_changes(changes)
+    with open(path) as f:
+        assert f.read() == (
+            JOURNAL.replace(
+                "    Expenses:Misc                                              $3.00",
+                "    Expenses:Coffee                                            $3.00",
+            ).replace("    Expenses:Misc\n", "    Expenses:Tools\n")
+        )
+    assert stat.S_IMODE(os.stat(path).st_mode) == 0o640
+    assert find_changes(path, rules) == []
+
+
+def test_recategorize_command(tmpdir):
+    path = str(tmpdir.join("main.lgr"))
+    with open(path, "w") as f:
+        f.write(JOURNAL)
+    with patch("sys.stderr", new_callable=StringIO) as mock_stderr:
+        run(["recategorize", "--dry-run", "-l", path])
+    assert "Coffee Shop: Expenses:Misc -> Expenses:Coffee" in mock_stderr.getvalue()
+    with open(path) as f:
+        assert f.read() == JOURNAL
+    with patch("sys.stderr", new_callable=StringIO):
+        run(["recategorize", "-l", path, "--unknown-account", "Expenses:Coffee"])
+    with open(path) as f:
+        assert f.read() == JOURNAL
+
+
+def test_changed_since_scan(tmpdir):
+    path = str(tmpdir.join("main.lgr"))
+    with open(path, "w") as f:
+        f.write(JOURNAL)
+    changes = find_changes(path)
+    # edited (without moving the postings) before the changes are applied
+    with open(path, "a") as f:
+        f.write("\n2020/01/06 Coffee Shop\n    Expenses:Coffee  $2.00\n    Assets\n")
+    with pytest.raises(ValueError):
+        apply_changes(changes)
+    with open(path) as f:
+        assert f.read().startswith(JOURNAL)
@@ -0,0 +1,80 @@
+# Copyright (c) 2013-2021 Erik Hetzner
+#
+# This file is part of ledger-autosync
+#
+# ledger-autosync is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# ledger-autosync is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with ledger-autosync. If not, see
+# <http://www.gnu.org/licenses/>.
+
+import os
+import shutil
+from io import StringIO
+from unittest.mock import patch
+
+from ledgerautosync.cli import run
+from ledgerautosync.registry import ImportRegistry
+
+ROW = (
+    '"6/5/2016","10:46:49","PDT","Jane Doe","Recurring Payment Sent",'
+    '"Completed","USD","-30.00","0.00","-30.00","me@example.com",'
+    '"someone@example.net","XYZ4","Verified","","","","","","","","","","",'
+    '"","","","","","","","","","","","0.00","",\n'
+)
+
+
+def test_lookup(tmpdir):
+    path = str(tmpdir.join("paypal.csv"))
+    shutil.copy(os.path.join("fixtures", "paypal.csv"), path)
+    registry = ImportRegistry(str(tmpdir.join("registry.json")))
+    state = registry.lookup(path)
+    assert not state.imported and state.offset == 0
+    registry.record(state)
+    size = os.path.getsize(path)
+
+    registry = ImportRegistry(str(tmpdir.join("registry.json")))
+    assert registry.lookup(path).imported
+    # a copy is recognized by its contents
+    copy = str(tmpdir.join("copy.csv"))
+    shutil.copy(path, copy)
+    assert registry.lookup(copy).imported
+
+    with open(path, "a") as f:
+        f.write(ROW)
+    state = registry.lookup(path)
+    assert not state.imported and state.offset == size
+
+    with open(copy, "w") as f:
+        f.write("something else\n")
+    state = registry.lookup(copy)
+    assert not state.imported and state.offset == 0
+
+
+def test_skip_imported_files(tmpdir):
+    path = str(tmpdir.join("paypal.csv"))
+    shutil.copy(os.path.join("fixtures", "paypal.csv"), path)
+    registry = str(tmpdir.join("registry.json"))
+
+    def import_file(*options):
+        with patch("sys.stdout", new_callable=StringIO) as mock_stdout:
+            run(["-L", "-a", "Paypal", "--registry", registry, path] + list(options))
+        return mock_stdout.getvalue()
+
+    assert import_file().count("csvid: ") == 2
+    assert import_file() == ""
+    with open(path, "a") as f:
+        f.write(ROW)
+    output = import_file()
+    assert output.count("csvid: ") == 1
+    assert "-30.00 USD" in output
+    assert import_file() == ""
+    assert import_file("--force").count("csvid: ") == 3
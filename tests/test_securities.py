@@ -0,0 +1,117 @@
+# Copyright (c) 2013-2021 Erik Hetzner
+#
+# This file is part of ledger-autosync
+#
+# ledger-autosync is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# ledger-autosync is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with ledger-autosync. If not, see
+# <http://www.gnu.org/licenses/>.
+
+import argparse
+import datetime
+
+import pytest
+
+from ledgerautosync.cli import print_results
+from ledgerautosync.converter import OfxConverter, SecurityList
+from ledgerautosync.journal import Price, scan
+from ledgerautosync.securities import PriceIndex, SecurityMaster
+
+
+class NoSecurities(object):
+    security_list = None
+
+
+@pytest.mark.ofx_file("cusip.ofx")
+def test_security_master(ofx, tmpdir):
+    path = str(tmpdir.join("securities.json"))
+    master = SecurityMaster(path)
+    SecurityList(ofx, master)
+    master.save()
+
+    master = SecurityMaster(path)
+    assert master.ticker("957904675") == "SHSAX"
+    assert master.cusip("SHSAX") == "957904675"
+    # a statement without the security list
+    converter = OfxConverter(
+        account=ofx.account,
+        name="Foo",
+        security_list=SecurityList(NoSecurities(), master),
+    )
+    assert converter.maybe_get_ticker("957904675") == "SHSAX"
+    converter = OfxConverter(
+        account=ofx.account, name="Foo", security_list=SecurityList(NoSecurities())
+    )
+    assert converter.maybe_get_ticker("957904675") == "957904675"
+
+
+def test_scan_prices(tmpdir):
+    journal = tmpdir.join("journal.ledger")
+    journal.write(
+        'P 2020/01/02 00:00:00 FOO 1.50 USD\nP 2020-01-03 "BAR 1" $2\n'
+        "2020/01/04 Payee\n    A  $1\n    B\nP 01/05 FOO $1\n"
+    )
+    with open(str(journal), "rb") as f:
+        prices = [
+            (item.date, item.commodity)
+            for item in scan(f, str(journal))
+            if isinstance(item, Price)
+        ]
+    assert prices == [
+        (datetime.date(2020, 1, 2), "FOO"),
+        (datetime.date(2020, 1, 3), "BAR 1"),
+    ]
+
+
+def test_price_index(tmpdir):
+    journal = tmpdir.join("journal.ledger")
+    journal.write("P 2020/01/02 00:00:00 FOO 1.50 USD\ninclude prices.ledger\n")
+    tmpdir.join("prices.ledger").write("P 2020/01/03 00:00:00 BAR $2\n")
+    directory = str(tmpdir.join("prices"))
+    index = PriceIndex(str(journal), directory)
+    index.update()
+    assert not index.is_new(datetime.date(2020, 1, 2), "FOO")
+    assert not index.is_new(datetime.datetime(2020, 1, 3, 12, 0), "BAR")
+    assert index.is_new(datetime.date(2020, 1, 3), "FOO")
+    # found new once
+    assert not index.is_new(datetime.date(2020, 1, 3), "FOO")
+
+    journal.write("P 2020/01/04 00:00:00 FOO 1.60 USD\n", mode="a")
+    index = PriceIndex(str(journal), directory)
+    index.update()
+    assert not index.is_new(datetime.date(2020, 1, 4), "FOO")
+    assert index.is_new(datetime.date(2020, 1, 3), "FOO")
+
+
+@pytest.mark.ofx_file("cusip.ofx")
+def test_only_new_prices(ofx, tmpdir):
+    args = argparse.Namespace(initial=False, assertions=False, fuzzy_duplicates=False)
+    journal = tmpdir.join("journal.ledger")
+    journal.write("")
+    master = SecurityMaster(str(tmpdir.join("securities.json")))
+    master.prices = PriceIndex(str(journal), str(tmpdir.join("prices")))
+    master.prices.update()
+
+    def prices():
+        converter = OfxConverter(
+            account=ofx.account, name="Foo", security_list=SecurityList(ofx, master)
+        )
+        out = []
+        print_results(converter, ofx.account, None, [], args, out=out)
+        return [item for item in out if item.startswith("P ")]
+
+    assert prices() == ["P 2016/10/08 07:30:08 SHSAX 47.8600000\n"]
+    assert prices() == []
+    journal.write("P 2016/10/08 07:30:08 SHSAX 47.8600000\n")
+    master.prices = PriceIndex(str(journal), str(tmpdir.join("prices")))
+    master.prices.update()
+    assert prices() == []
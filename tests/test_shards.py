@@ -0,0 +1,112 @@
+# Copyright (c) 2013-2021 Erik Hetzner
+#
+# This file is part of ledger-autosync
+#
+# ledger-autosync is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# ledger-autosync is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with ledger-autosync. If not, see
+# <http://www.gnu.org/licenses/>.
+
+import datetime
+import os
+from io import StringIO
+from unittest.mock import patch
+
+from ledgerautosync.cli import run
+from ledgerautosync.converter import Amount, Posting, Transaction
+from ledgerautosync.index import IdIndex
+from ledgerautosync.shards import ShardedJournal, shard_name
+
+
+def mk_txn(account, date, csvid):
+    posting = Posting(account, Amount(1, "$"), metadata={"csvid": csvid})
+    return Transaction(
+        date=date, payee="Payee", postings=[posting, posting.clone_inverted("Misc")]
+    )
+
+
+def test_shard_name():
+    txn = mk_txn("Assets:Bank:Checking", datetime.date(2021, 3, 4), "a")
+    name = os.path.join("Assets", "Bank", "Checking", "2021.ledger")
+    assert shard_name(txn.format(), txn) == name
+    assert shard_name(txn.format()) == name
+    assert shard_name("P 2020/01/02 00:00:00 FOO 1.50 USD\n") == os.path.join(
+        "prices", "2020.ledger"
+    )
+    assert shard_name("; a comment\n") is None
+    txn = mk_txn("Assets:..:x/y", datetime.date(2021, 3, 4), "a")
+    assert shard_name(txn.format(), txn) == os.path.join(
+        "Assets", "_", "x_y", "2021.ledger"
+    )
+
+
+def test_shards_and_index(tmpdir):
+    directory = str(tmpdir.join("journals"))
+    main = str(tmpdir.join("main.ledger"))
+    with open(main, "w") as f:
+        f.write("include journals/manifest.ledger\n")
+    shards = ShardedJournal(directory)
+    for txn in (
+        mk_txn("Assets:Checking", datetime.date(2020, 12, 31), "a"),
+        mk_txn("Assets:Checking", datetime.date(2021, 1, 1), "b"),
+        mk_txn("Assets:Savings", datetime.date(2021, 1, 2), "c"),
+    ):
+        assert shards.write(txn.format(), txn)
+    assert not shards.write("; a comment\n")
+    shards.close()
+    with open(os.path.join(directory, "manifest.ledger")) as f:
+        assert f.read() == (
+            "include Assets/Checking/2020.ledger\n"
+            "include Assets/Checking/2021.ledger\n"
+            "include Assets/Savings/2021.ledger\n"
+        )
+    idx = IdIndex(main, directory=str(tmpdir.join("index")))
+    idx.update()
+    for csvid in ("a", "b", "c"):
+        assert idx.check_transaction_by_id("csvid", csvid)
+    idx.close()
+
+    # only the shard written to is scanned again
+    shards = ShardedJournal(directory)
+    txn = mk_txn("Assets:Checking", datetime.date(2021, 2, 1), "d")
+    shards.write(txn.format(), txn)
+    shards.close()
+    idx = IdIndex(main, directory=idx.directory)
+    with patch.object(idx, "rebuild") as rebuild, patch.object(
+        idx, "scan_file", wraps=idx.scan_file
+    ) as scan_file:
+        idx.update()
+        assert not rebuild.called
+    assert [call.args[0] for call in scan_file.call_args_list] == [
+        os.path.join(directory, "Assets", "Checking", "2021.ledger")
+    ]
+    assert idx.check_transaction_by_id("csvid", "d")
+    with open(os.path.join(directory, "manifest.ledger")) as f:
+        assert len(f.readlines()) == 3
+
+
+def test_shard_dir_option(tmpdir):
+    directory = str(tmpdir.join("journals"))
+    with patch("sys.stdout", new_callable=StringIO) as mock_stdout:
+        run(
+            [
+                "-L",
+                "-a",
+                "Assets:Paypal",
+                "--shard-dir",
+                directory,
+                os.path.join("fixtures", "paypal.csv"),
+            ]
+        )
+    assert mock_stdout.getvalue() == ""
+    with open(os.path.join(directory, "Assets", "Paypal", "2016.ledger")) as f:
+        assert f.read().count("csvid: ") == 2
@@ -17,12 +17,15 @@
 # <http://www.gnu.org/licenses/>.
 
 
+import datetime
+import io
 import os
 import os.path
 from unittest.mock import Mock
 
 from ofxparse import OfxParser
 
+from ledgerautosync.converter import PaypalConverter
 from ledgerautosync.ledgerwrap import Ledger
 from ledgerautosync.sync import CsvSynchronizer, OfxSynchronizer
 
@@ -115,3 +118,85 @@ def test_paypal_partial_sync():
     ledger = Ledger(os.path.join("fixtures", "paypal.lgr"))
     sync = CsvSynchronizer(ledger)
     assert 1 == len(sync.parse_file(os.path.join("fixtures", "paypal.csv")))
+
+
+def test_date_window():
+    ledger = Mock()
+    ledger.check_transaction_by_id = Mock(return_value=False)
+    sync = OfxSynchronizer(ledger, date_slack=3)
+    ofx = OfxSynchronizer.parse_file(os.path.join("fixtures", "checking.ofx"))
+    txns = sync.filter(ofx.account.statement.transactions, ofx.account.account_id)
+    window = (datetime.date(2011, 3, 28), datetime.date(2011, 4, 11))
+    assert len(txns) == 3
+    for call in ledger.check_transaction_by_id.call_args_list:
+        assert call.args[2] == window
+
+
+def test_no_date_window_by_default():
+    ledger = Mock()
+    ledger.check_transaction_by_id = Mock(return_value=False)
+    sync = OfxSynchronizer(ledger)
+    ofx = OfxSynchronizer.parse_file(os.path.join("fixtures", "checking.ofx"))
+    sync.filter(ofx.account.statement.transactions, ofx.account.account_id)
+    for call in ledger.check_transaction_by_id.call_args_list:
+        assert call.args[2] is None
+
+
+def test_csv_date_window():
+    ledger = Mock()
+    ledger.check_transaction_by_id = Mock(return_value=False)
+    sync = CsvSynchronizer(ledger, date_slack=0)
+    assert 2 == len(sync.parse_file(os.path.join("fixtures", "paypal.csv")))
+    window = (datetime.date(2016, 6, 4), datetime.date(2016, 6, 5))
+    for call in ledger.check_transaction_by_id.call_args_list:
+        assert call.args[2] == window
+
+
+def test_backfill_windows():
+    assert OfxSynchronizer.backfill_windows(200, 90) == [
+        (90, None),
+        (180, 90),
+        (200, 180),
+    ]
+    assert OfxSynchronizer.backfill_windows(30, 90) == [(30, None)]
+
+
+def test_csv_split_at_records():
+    from ledgerautosync.csvsplit import split
+
+    data = b'a,b\n1,"x\ny"\n2,z\n3,"\n\n"\n4,w\n'
+    ranges = split(io.BytesIO(data), 4, '"', size=1)
+    assert ranges == [(4, 12), (12, 16), (16, 23), (23, 27)]
+    assert split(io.BytesIO(data), 4, '"', size=100) == [(4, 27)]
+
+
+def test_csv_parallel_parse(tmp_path, monkeypatch):
+    from ledgerautosync import csvsplit
+
+    with open(os.path.join("fixtures", "paypal.csv")) as f:
+        header = f.readline()
+        rows = f.readlines()
+    path = str(tmp_path / "paypal.csv")
+    with open(path, "w") as f:
+        f.write(header)
+        for i in range(50):
+            for row in rows:
+                f.write(row.replace("XYZ", "XYZ%d-" % (i)))
+    ledger = Mock()
+    ledger.check_transaction_by_id = Mock(return_value=False)
+    expected = [
+        txn.format()
+        for txn in CsvSynchronizer(ledger).parse_file(path, "Assets:Paypal")
+    ]
+    monkeypatch.setattr(csvsplit, "RANGE_SIZE", 1000)
+    sync = CsvSynchronizer(ledger, processes=3)
+    txns = sync.parse_parallel(path, "Assets:Paypal")
+    assert len(txns) == 100
+    assert [txn.format() for txn in txns] == expected
+    sync = CsvSynchronizer(ledger, processes=3, fmt=(4, True))
+    assert sync.parse_parallel(path, "Assets:Paypal") == expected
+    # a converter that may use the ledger is not copied into processes
+    monkeypatch.setattr(PaypalConverter, "PARALLEL", False)
+    assert sync.parse_parallel(path, "Assets:Paypal") is None
+    txns = sync.parse_file(path, "Assets:Paypal")
+    assert [txn.format() for txn in txns] == expected
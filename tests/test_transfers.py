@@ -0,0 +1,64 @@
+# Copyright (c) 2013-2021 Erik Hetzner
+#
+# This file is part of ledger-autosync
+#
+# ledger-autosync is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# ledger-autosync is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with ledger-autosync. If not, see
+# <http://www.gnu.org/licenses/>.
+
+import datetime
+from decimal import Decimal
+
+from ledgerautosync.converter import Amount, Posting, Transaction
+from ledgerautosync.transfers import pair_transfers
+
+
+def mk_txn(day, account, amount, ofxid):
+    return Transaction(
+        date=datetime.datetime(2020, 1, day, 12),
+        payee="Transfer %s" % (ofxid),
+        postings=[
+            Posting(account, Amount(Decimal(amount), "$"), metadata={"ofxid": ofxid}),
+            Posting("Expenses:Misc", Amount(Decimal(amount), "$", reverse=True)),
+        ],
+    )
+
+
+def test_pair_transfers():
+    out = pair_transfers(
+        [
+            mk_txn(1, "Assets:Checking", "-100", "c1"),
+            mk_txn(1, "Assets:Checking", "-20", "c2"),
+            "balance assertion",
+            mk_txn(9, "Assets:Savings", "100", "s1"),
+            mk_txn(2, "Assets:Savings", "100", "s2"),
+            mk_txn(2, "Assets:Checking", "20", "c3"),
+        ],
+        days=3,
+    )
+    assert len(out) == 5
+    merged = out[0]
+    assert merged.payee == "Transfer c1"
+    assert merged.date == datetime.datetime(2020, 1, 1, 12)
+    assert [(p.account, p.metadata["ofxid"]) for p in merged.postings] == [
+        ("Assets:Checking", "c1"),
+        ("Assets:Savings", "s2"),
+    ]
+    assert merged.format().count("$100.00") == 2
+    # same account, or too far apart: left alone
+    assert [getattr(t, "payee", t) for t in out[1:]] == [
+        "Transfer c2",
+        "balance assertion",
+        "Transfer s1",
+        "Transfer c3",
+    ]